@@ -0,0 +1 @@
+"""Benchmarks for Citadel's performance-sensitive paths, run with `python -m benchmarks.<name>`."""
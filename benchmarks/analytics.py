@@ -0,0 +1,127 @@
+"""Benchmark recording quiz answer events, and reading aggregates back from them.
+
+Compares the time recording an answer adds to a click (buffering it for the background writer, against inserting it
+straight away), times the writer draining a large backlog, and times the aggregate queries over a database full of
+events, checking that each one is answered from an index. Run with `python -m benchmarks.analytics [events]`.
+"""
+
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from citadel import analytics, database, globals
+from citadel.leaderboard import PlayerStats
+from citadel.models import AnswerEvent, QuizResult, Test
+from sqlalchemy import text
+from sqlmodel import Session
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+EVENTS = 1_000_000
+# How many events to insert one at a time, for comparison (as it's much slower).
+DIRECT_EVENTS = 2000
+PLAYERS = 5000
+TESTS = 200
+QUESTIONS_PER_TEST = 50
+QUIZ_PLAYERS = 20
+# The share of answers that are correct.
+CORRECT = 0.6
+# How many answers to record between letting the writer run.
+ANSWERS_BETWEEN_YIELDS = 1000
+
+
+def insert_event(event: dict[str, object]) -> None:
+    """Insert a single event in its own transaction, as the quiz loop would without the writer."""
+    analytics.write_rows([(AnswerEvent, event)])
+
+
+def make_event(quiz: int) -> dict[str, object]:
+    """Make up an answer event."""
+    test_id = quiz % TESTS + 1
+    return {
+        "quiz_id": quiz,
+        "test_id": test_id,
+        "question_id": test_id * QUESTIONS_PER_TEST + random.randrange(QUESTIONS_PER_TEST),  # noqa: S311
+        "question_index": random.randrange(QUESTIONS_PER_TEST),  # noqa: S311
+        "guild_id": 1,
+        "player_id": random.randrange(PLAYERS),  # noqa: S311
+        "correct": random.random() < CORRECT,  # noqa: S311
+        "response_time": random.uniform(0.5, 30.0),  # noqa: S311
+        "answered_at": time.time(),
+    }
+
+
+def query_plan(statement: str) -> str:
+    """Get SQLite's plan for a query, to check it's using an index."""
+    with Session(globals.get_sql_engine()) as session:
+        return " / ".join(row[-1] for row in session.connection().execute(text(f"EXPLAIN QUERY PLAN {statement}")))
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else EVENTS
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        globals.SQL_ENGINE = database.setup(str(Path(directory) / "citadel.db"))
+        with Session(globals.SQL_ENGINE) as session:
+            session.add_all([Test(name=f"Test {index}") for index in range(TESTS)])
+            session.commit()
+
+        events = [make_event(index // (QUIZ_PLAYERS * QUESTIONS_PER_TEST)) for index in range(count)]
+        direct = events[:DIRECT_EVENTS]
+
+        started = time.perf_counter()
+        for event in direct:
+            await database.run(insert_event, event)
+        elapsed = time.perf_counter() - started
+        print(f"insert each answer: {elapsed / len(direct) * 1e6:.0f}us per answer")
+
+        # The writer's buffer is sized to hold the whole backlog, so none of it gets dropped.
+        analytics.WRITER = analytics.AnswerWriter(max_pending=count)
+        started = time.perf_counter()
+        for index, event in enumerate(events):
+            analytics.WRITER.record(AnswerEvent, event)
+            if index % ANSWERS_BETWEEN_YIELDS == ANSWERS_BETWEEN_YIELDS - 1:
+                # Let the writer run now and again, like it would between clicks.
+                await asyncio.sleep(0)
+        recorded = time.perf_counter() - started
+        await analytics.WRITER.close()
+        drained = time.perf_counter() - started
+        print(
+            f"buffer each answer: {recorded / count * 1e6:.2f}us per answer, "
+            f"{count} answers written in {drained:.2f}s ({count / drained:.0f}/s)",
+        )
+
+        for quiz in range(count // (QUIZ_PLAYERS * QUESTIONS_PER_TEST)):
+            players = random.sample(range(PLAYERS), QUIZ_PLAYERS)
+            stats = {player: PlayerStats(random.randrange(10_000), random.randrange(10)) for player in players}  # noqa: S311
+            analytics.QuizEvents(quiz, quiz % TESTS + 1, 1).finish(stats, QUESTIONS_PER_TEST)
+        await analytics.WRITER.close()
+
+        queries: dict[str, Callable[[], object]] = {
+            "player_summaries": lambda: analytics.player_summaries(PLAYERS // 2),
+            "test_summary": lambda: analytics.test_summary(TESTS // 2),
+            "question_summaries": lambda: analytics.question_summaries(TESTS // 2),
+            "player_history": lambda: analytics.player_history(PLAYERS // 2),
+            "top_players": lambda: analytics.top_players(TESTS // 2),
+        }
+        for name, query in queries.items():
+            started = time.perf_counter()
+            query()
+            print(f"{name}: {(time.perf_counter() - started) * 1000:.2f}ms")
+
+        for model, column in ((AnswerEvent, "player_id"), (AnswerEvent, "test_id"), (QuizResult, "player_id")):
+            table = model.__tablename__
+            print(f"{table} by {column}: {query_plan(f'SELECT count(*) FROM {table} WHERE {column} = 1')}")  # noqa: S608
+
+        globals.get_sql_engine().dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
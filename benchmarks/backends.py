@@ -0,0 +1,96 @@
+"""Benchmark spreading uncached completions over a pool of OpenAI-compatible backends.
+
+Each backend is a fake server with a limited capacity, some of whose completions stall, like a self-hosted model. The
+same requests are made against a single backend, a pool of them, a pool with hedging, and a pool where one of the
+backends is down, reporting the latencies and how many requests each backend got. Run with
+`python -m benchmarks.backends [requests]`.
+"""
+
+import asyncio
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from citadel import backends, globals, governor, metrics, utils
+
+from benchmarks import harness
+from benchmarks.fake_openai import FakeOpenAIServer
+
+REQUESTS = 400
+BACKENDS = 3
+# How many completions each backend generates at once, and how many requests are made at once in total (each waiting
+# for its response before making the next).
+CAPACITY = 4
+CONCURRENCY = BACKENDS * CAPACITY
+STALL_SHARE = 0.03
+STALL = 3.0
+
+
+def unreachable_url() -> tuple[str, socket.socket]:
+    """Get the base URL of a backend that's down, and the socket reserving its port (which must be kept open)."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    return f"http://127.0.0.1:{sock.getsockname()[1]}/v1", sock
+
+
+async def run(name: str, pool: backends.BackendPool, servers: list[FakeOpenAIServer], count: int) -> None:
+    """Make the requests through a pool, printing how they went."""
+    globals.OPENAI_POOL = pool
+    governor.GOVERNOR = governor.RequestGovernor(max_concurrency=CONCURRENCY)
+    # Start from fresh latencies, so hedging only goes by this pool's.
+    metrics.OPENAI_BACKEND_SECONDS.series.clear()
+    hedges = metrics.OPENAI_HEDGES.total()
+    requests = [server.requests for server in servers]
+    latencies: list[float] = []
+
+    async def worker(number: int) -> None:
+        for index in range(number, count, CONCURRENCY):
+            started = time.perf_counter()
+            await utils.request_openai_resp(f"{name} prompt {index}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - started
+
+    spread = ", ".join(str(server.requests - before) for server, before in zip(servers, requests, strict=True))
+    print(
+        f"{name}: {count} requests in {elapsed:.2f}s ({count / elapsed:.1f}/s), "
+        f"{harness.percentile(latencies, 50) * 1000:.0f}ms p50, {harness.percentile(latencies, 99) * 1000:.0f}ms p99, "
+        f"{metrics.OPENAI_HEDGES.total() - hedges:.0f} hedges, requests per backend: {spread}",
+    )
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else REQUESTS
+
+    servers = [FakeOpenAIServer(capacity=CAPACITY, stall_share=STALL_SHARE, stall=STALL) for _ in range(BACKENDS)]
+    for server in servers:
+        server.start_in_thread()
+    endpoints = [(server.base_url, "benchmark") for server in servers]
+    down, reserved = unreachable_url()
+
+    with tempfile.TemporaryDirectory() as directory:
+        harness.setup(Path(directory), servers[0])
+        try:
+            await run("one backend", backends.BackendPool.connect("benchmark", endpoints[:1]), servers, count)
+            await run("pool", backends.BackendPool.connect("benchmark", endpoints), servers, count)
+            await run(
+                "pool (hedged)", backends.BackendPool.connect("benchmark", endpoints, hedge=True), servers, count
+            )
+            await run(
+                "pool (one down)",
+                backends.BackendPool.connect("benchmark", [*endpoints, (down, "benchmark")]),
+                servers,
+                count,
+            )
+        finally:
+            globals.get_sql_engine().dispose()
+            reserved.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""Benchmark bulk importing and exporting a large test bank.
+
+Run with `python -m benchmarks.bulk_import [rows]` (defaults to a million questions).
+"""
+
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+from citadel import database, transfer
+
+ROWS = 1_000_000
+TESTS = 1_000
+
+
+def write_bank(path: Path, rows: int) -> None:
+    """Write a test bank with `rows` questions spread across `TESTS` tests."""
+    with path.open("w") as file:
+        for index in range(rows):
+            row = {"test": f"Test {index % TESTS}", "question": f"Question {index}?", "answer": f"Answer {index}"}
+            file.write(json.dumps(row))
+            file.write("\n")
+
+
+def main() -> None:
+    """Run the benchmark."""
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+
+    with tempfile.TemporaryDirectory() as directory:
+        bank = Path(directory) / "bank.ndjson"
+        write_bank(bank, rows)
+        engine = database.setup(str(Path(directory) / "citadel.db"))
+
+        with bank.open() as file:
+            stats = transfer.import_questions(engine, transfer.read_rows(file, transfer.Format.NDJSON))
+        print(f"import: {stats.rows} rows in {stats.elapsed():.2f}s ({stats.throughput():.0f} rows/s)")
+
+        stats = transfer.TransferStats()
+        with (Path(directory) / "export.csv").open("w", newline="") as file:
+            transfer.write_rows(file, transfer.Format.CSV, transfer.export_questions(engine, stats))
+        print(f"export: {stats.rows} rows in {stats.elapsed():.2f}s ({stats.throughput():.0f} rows/s)")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark deduplicating a large database of questions.
+
+Builds a database of generated questions (some of which are reworded copies of others, in the same test or in other
+tests, and some of which have distractors), and times deduplicating it. Run with
+`python -m benchmarks.dedupe [questions]`.
+"""
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from citadel import database, dedupe, transfer
+from citadel.models import Distractor, Question
+from sqlalchemy import Engine, insert, select
+from sqlmodel import Session
+
+QUESTIONS = 100_000
+TESTS = 500
+# The share of questions that copy an earlier question, and of those, the share that copy one in the same test.
+COPIES = 0.1
+SAME_TEST = 0.5
+# The share of questions that have distractors.
+WITH_DISTRACTORS = 0.5
+WORDS = [f"{stem}{suffix}" for stem in ("alpha", "bravo", "delta", "gamma", "omega", "sigma") for suffix in range(400)]
+
+
+def reword(question: str) -> str:
+    """Reword a question in ways that shouldn't stop it counting as a duplicate."""
+    return random.choice([question.upper(), question.rstrip("?") + " ?", "  " + question.replace(" ", "  ")])  # noqa: S311
+
+
+def generate_rows(count: int) -> list[dict[str, str]]:
+    """Generate questions, with some of them being copies of earlier ones."""
+    rows: list[dict[str, str]] = []
+    for _ in range(count):
+        if len(rows) != 0 and random.random() < COPIES:  # noqa: S311
+            original = random.choice(rows)  # noqa: S311
+            test = original["test"] if random.random() < SAME_TEST else f"Test {random.randrange(TESTS)}"  # noqa: S311
+            rows.append({"test": test, "question": reword(original["question"]), "answer": original["answer"]})
+        else:
+            words = " ".join(random.choices(WORDS, k=8))  # noqa: S311
+            rows.append(
+                {
+                    "test": f"Test {random.randrange(TESTS)}",  # noqa: S311
+                    "question": f"What is {words}?",
+                    "answer": " ".join(random.choices(WORDS, k=2)),  # noqa: S311
+                },
+            )
+    return rows
+
+
+def add_distractors(engine: Engine) -> None:
+    """Give some of the questions distractors."""
+    with Session(engine) as session:
+        questions = list(session.execute(select(Question.id, Question.question, Question.answer)))  # type: ignore[call-overload]
+        session.execute(
+            insert(Distractor),
+            [
+                {
+                    "question_id": question_id,
+                    "content_hash": Question(question=question, answer=answer, test_id=0).content_hash(),
+                    "correct_answer": answer,
+                    "incorrect_answers": ["Wrong 1", "Wrong 2", "Wrong 3"],
+                }
+                for question_id, question, answer in questions
+                if random.random() < WITH_DISTRACTORS  # noqa: S311
+            ],
+        )
+        session.commit()
+
+
+def main() -> None:
+    """Run the benchmark."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else QUESTIONS
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = database.setup(str(Path(directory) / "citadel.db"))
+        transfer.import_questions(engine, generate_rows(count))
+        add_distractors(engine)
+
+        for dry_run in (True, False):
+            started = time.perf_counter()
+            stats = dedupe.dedupe(engine, dry_run=dry_run)
+            print(
+                f"dedupe{' (dry run)' if dry_run else ''}: {stats.questions} questions in "
+                f"{time.perf_counter() - started:.2f}s, {stats.deleted} deleted, {stats.shared} sharing distractors",
+            )
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
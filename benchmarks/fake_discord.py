@@ -0,0 +1,195 @@
+"""Stand-ins for the Discord objects that commands use, so they can be driven without a gateway connection.
+
+Only the attributes and methods Citadel actually touches are implemented. Messages keep track of the view they were
+last edited with, so benchmarks can click the buttons currently being shown, and replies record how long after the
+click they were sent.
+"""
+
+__all__ = ["FakeChannel", "FakeClient", "FakeInteraction", "FakeMessage", "FakeUser"]
+
+import itertools
+import time
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any
+
+import discord
+
+# Snowflakes start from now, so message ages (which are read from their IDs) look recent.
+IDS = itertools.count(discord.utils.time_snowflake(discord.utils.utcnow()))
+
+
+def next_id() -> int:
+    """Get a new, unique snowflake."""
+    return next(IDS)
+
+
+@dataclass(frozen=True)
+class FakeUser:
+    """A Discord user."""
+
+    id: int = field(default_factory=next_id)
+    display_name: str = "User"
+
+
+@dataclass
+class FakeAuthor:
+    """The author of a message in a channel's history."""
+
+    id: int
+
+
+@dataclass
+class FakeHistoryMessage:
+    """A message in a channel's history."""
+
+    id: int
+    author: FakeAuthor
+    content: str
+
+
+class FakeChannel(discord.TextChannel):
+    """A text channel, with a history of messages."""
+
+    def __init__(self, messages: list[str], author: FakeUser | None = None) -> None:
+        self.id = next_id()
+        author = author or FakeUser()
+        # Oldest first, like snowflakes.
+        self.messages = [FakeHistoryMessage(next_id(), FakeAuthor(author.id), content) for content in messages]
+        # The messages the bot has sent in the channel, by ID.
+        self.sent: dict[int, FakeMessage] = {}
+
+    async def history(  # type: ignore[override]
+        self,
+        *,
+        limit: int | None = 100,
+        after: discord.abc.Snowflake | None = None,
+        oldest_first: bool | None = None,
+        **_kwargs: Any,  # noqa: ANN401
+    ) -> AsyncIterator[FakeHistoryMessage]:
+        """Iterate over the channel's messages."""
+        messages = [message for message in self.messages if after is None or message.id > after.id]
+        if not oldest_first:
+            messages.reverse()
+        for message in messages[:limit]:
+            yield message
+
+    def get_partial_message(self, message_id: int) -> "FakeMessage":  # type: ignore[override]
+        """Get a message the bot has sent in the channel."""
+        return self.sent[message_id]
+
+
+class FakeMessage:
+    """A message sent by the bot."""
+
+    def __init__(self, channel_id: int, **kwargs: Any) -> None:  # noqa: ANN401
+        self.id = next_id()
+        self.channel = discord.Object(id=channel_id)
+        self.edits = 0
+        self.deleted = False
+        self.content: str | None = None
+        self.embed: discord.Embed | None = None
+        self.view: discord.ui.View | None = None
+        self.apply(kwargs)
+
+    def apply(self, kwargs: dict[str, Any]) -> None:
+        """Apply the fields of a send or an edit."""
+        for key in ["content", "embed", "view"]:
+            if key in kwargs:
+                setattr(self, key, kwargs[key])
+
+    async def edit(self, **kwargs: Any) -> "FakeMessage":  # noqa: ANN401
+        """Edit the message."""
+        self.edits += 1
+        self.apply(kwargs)
+        return self
+
+    async def delete(self) -> None:
+        """Delete the message."""
+        self.deleted = True
+
+
+class FakeResponse:
+    """The initial response to an interaction."""
+
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+
+    def record(self) -> None:
+        """Record how long it took to respond to the interaction."""
+        if self.interaction.latencies is not None:
+            self.interaction.latencies.append(time.perf_counter() - self.interaction.created)
+
+    async def defer(self, **_kwargs: Any) -> None:  # noqa: ANN401
+        """Acknowledge the interaction."""
+        self.record()
+
+    async def send_message(self, *_args: Any, **_kwargs: Any) -> None:  # noqa: ANN401
+        """Reply to the interaction."""
+        self.record()
+
+    async def send_modal(self, _modal: discord.ui.Modal) -> None:
+        """Open a modal."""
+        self.record()
+
+
+class FakeFollowup:
+    """The webhook used to send messages after responding to an interaction."""
+
+    def __init__(self, interaction: "FakeInteraction") -> None:
+        self.interaction = interaction
+        self.messages: list[FakeMessage] = []
+
+    async def send(self, content: str | None = None, **kwargs: Any) -> FakeMessage:  # noqa: ANN401
+        """Send a message."""
+        message = FakeMessage(self.interaction.channel.id, content=content, **kwargs)
+        self.messages.append(message)
+        self.interaction.channel.sent[message.id] = message
+        return message
+
+
+class FakeClient:
+    """The bot's client, for code that looks channels up by their ID rather than getting them from an interaction."""
+
+    def __init__(self) -> None:
+        # The bot's own user isn't known, so none of the channel's messages get filtered out as the bot's.
+        self.user = None
+        self.channels: dict[int, FakeChannel] = {}
+
+    def add_channel(self, channel: FakeChannel) -> FakeChannel:
+        """Make a channel findable by its ID."""
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_partial_messageable(self, channel_id: int, **_kwargs: Any) -> FakeChannel:  # noqa: ANN401
+        """Get a channel by its ID."""
+        return self.channels[channel_id]
+
+
+class FakeInteraction:
+    """An interaction, from a slash command or a component."""
+
+    def __init__(
+        self,
+        user: FakeUser,
+        channel: FakeChannel,
+        guild_id: int = 1,
+        latencies: list[float] | None = None,
+    ) -> None:
+        self.user = user
+        self.channel = channel
+        self.guild_id = guild_id
+        # The bot's own user isn't known, so none of the channel's messages get filtered out as the bot's.
+        self.client = SimpleNamespace(user=None)
+        self.message: FakeMessage | None = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        # When the interaction was created, and where to record how long it took to respond to it.
+        self.created = time.perf_counter()
+        self.latencies = latencies
+
+    def click(self, view: discord.ui.View, label: Any) -> None:  # noqa: ANN401
+        """Click a button on a view, as this interaction."""
+        self.created = time.perf_counter()
+        view.responses.put(label, self)  # type: ignore[attr-defined]
@@ -0,0 +1,187 @@
+"""A local, OpenAI-compatible chat completions server for benchmarks.
+
+Completions are made up from the prompt (questions from notes prompts, distractors from quiz prompts, and filler for
+anything else), and delivered with a configurable time to first token and token rate, either all at once or streamed as
+server-sent events. Like a self-hosted model, the server can have a limited capacity, and some of its completions can
+stall. Rate limit headers are included, so the request governor sees realistic responses.
+
+The server can run on its own thread (with its own event loop), so its work doesn't show up as lag in the event loop
+being benchmarked.
+"""
+
+__all__ = ["FakeOpenAIServer"]
+
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+# How many characters make up a token, matching `citadel.utils.CHARS_PER_TOKEN`.
+CHARS_PER_TOKEN = 4
+# How many tokens go in each streamed chunk.
+TOKENS_PER_CHUNK = 4
+# How many notes messages produce a question.
+MESSAGES_PER_QUESTION = 10
+
+QUIZ_INPUT = "Here's the input you need to generate answers for:"
+NOTES_LINE = re.compile(r"^- (.+)$", re.MULTILINE)
+
+
+@dataclass
+class FakeOpenAIServer:
+    """An OpenAI-compatible server running on localhost."""
+
+    # How long to wait before the first token, in seconds.
+    latency: float = 0.2
+    # How many output tokens are generated per second.
+    tokens_per_second: float = 500.0
+    # The most completions to generate at once (with the rest waiting their turn), or 0 for no limit.
+    capacity: int = 0
+    # The share of completions that stall, and how long they stall for before their first token, in seconds.
+    stall_share: float = 0.0
+    stall: float = 0.0
+    host: str = "127.0.0.1"
+    port: int = 0
+    requests: int = 0
+    runner: web.AppRunner | None = field(default=None, repr=False)
+    slots: asyncio.Semaphore | None = field(default=None, repr=False)
+
+    @property
+    def base_url(self) -> str:
+        """The base URL to give the OpenAI client."""
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self) -> None:
+        """Start serving."""
+        if self.capacity != 0:
+            self.slots = asyncio.Semaphore(self.capacity)
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        # Bind the socket ourselves, so we know which port got picked if we asked for any free one.
+        sock = socket.socket()
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        await web.SockSite(self.runner, sock).start()
+
+    async def stop(self) -> None:
+        """Stop serving."""
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def start_in_thread(self) -> None:
+        """Start serving from a background thread, returning once the server is up."""
+        ready = threading.Event()
+
+        def run() -> None:
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="fake-openai", daemon=True).start()
+        ready.wait()
+
+    def respond_to(self, prompt: str) -> str:
+        """Make up the completion for a prompt."""
+        if QUIZ_INPUT in prompt:
+            questions = json.loads(prompt.split(QUIZ_INPUT, 1)[1])
+            return json.dumps(
+                [
+                    {
+                        "index": question["index"],
+                        "incorrect_answers": [f"Not {question['answer']} ({index})" for index in range(3)],
+                    }
+                    for question in questions
+                ],
+            )
+
+        lines = NOTES_LINE.findall(prompt)
+        if len(lines) != 0:
+            return json.dumps(
+                [
+                    {"question": f"What was said in {line[:60]!r}?", "answer": f"Answer {index}"}
+                    for index, line in enumerate(lines[::MESSAGES_PER_QUESTION])
+                ],
+            )
+
+        return json.dumps([{"question": "What is this?", "answer": "A benchmark"}])
+
+    def headers(self) -> dict[str, str]:
+        """Get the rate limit headers to send."""
+        return {
+            "x-ratelimit-remaining-requests": "10000",
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-remaining-tokens": "10000000",
+            "x-ratelimit-reset-tokens": "1s",
+        }
+
+    def chunk(self, model: str, content: str | None, finish_reason: str | None = None) -> str:
+        """Format a streamed chunk."""
+        delta = {} if content is None else {"content": content}
+        data = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        """Handle a chat completion request."""
+        self.requests += 1
+        try:
+            if self.slots is None:
+                return await self.complete(request)
+            async with self.slots:
+                return await self.complete(request)
+        except ConnectionResetError:
+            # The client gave up on the request (e.g. it was cancelled) while it was waiting.
+            return web.Response(status=499)
+
+    async def complete(self, request: web.Request) -> web.StreamResponse:
+        """Generate the completion for a request."""
+        body = await request.json()
+        prompt = "\n".join(message["content"] for message in body["messages"])
+        content = self.respond_to(prompt)
+        model = body["model"]
+
+        stalled = random.random() < self.stall_share  # noqa: S311
+        await asyncio.sleep(self.latency + (self.stall if stalled else 0.0))
+        chunk_chars = CHARS_PER_TOKEN * TOKENS_PER_CHUNK
+        chunk_delay = TOKENS_PER_CHUNK / self.tokens_per_second
+
+        if not body.get("stream", False):
+            await asyncio.sleep(len(content) / CHARS_PER_TOKEN / self.tokens_per_second)
+            completion = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}},
+                ],
+            }
+            return web.json_response(completion, headers=self.headers())
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **self.headers()})
+        await response.prepare(request)
+        try:
+            for start in range(0, len(content), chunk_chars):
+                await response.write(self.chunk(model, content[start : start + chunk_chars]).encode())
+                await asyncio.sleep(chunk_delay)
+            await response.write(self.chunk(model, None, "stop").encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client stopped reading the stream (e.g. its request was cancelled).
+            pass
+        return response
@@ -0,0 +1,96 @@
+"""Running benchmark scenarios against the real command code, with OpenAI and Discord faked out.
+
+Each scenario gets a fresh database and fresh copies of the process-wide caches, with the OpenAI client pointed at a
+local `FakeOpenAIServer`. While a scenario runs, the event loop's lag is sampled, and afterwards its latencies,
+throughput and the process's peak memory use are reported.
+"""
+
+__all__ = ["Result", "Scenario", "measure", "percentile", "setup"]
+
+import math
+import resource
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from citadel import analytics, backends, cache, catalog, client, database, globals, governor, jobs, monitor
+from citadel.monitor import LagStats
+
+from benchmarks.fake_openai import FakeOpenAIServer
+
+# How often to check the event loop's lag while a scenario runs, in seconds.
+LAG_INTERVAL = 0.05
+
+# A scenario takes a list to record its latencies in (in seconds), and returns how many operations it completed.
+Scenario = Callable[[list[float]], Awaitable[int]]
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Get a percentile of some values, using the nearest-rank method."""
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+@dataclass
+class Result:
+    """The measurements from running a scenario."""
+
+    name: str
+    # What the scenario's operations are, for reporting throughput (e.g. "answers").
+    unit: str
+    operations: int
+    elapsed: float
+    latencies: list[float] = field(repr=False)
+    lag: LagStats
+    llm_requests: int
+    # The most memory the process has used so far (not just during this scenario), in bytes.
+    peak_rss: int
+
+    def report(self) -> str:
+        """Format the results for printing."""
+        return "\n".join(
+            [
+                f"{self.name}: {self.operations} {self.unit} in {self.elapsed:.2f}s "
+                f"({self.operations / self.elapsed:.1f} {self.unit}/s, {self.llm_requests} LLM requests)",
+                f"  latency: {percentile(self.latencies, 50) * 1000:.1f}ms p50, "
+                f"{percentile(self.latencies, 99) * 1000:.1f}ms p99, {len(self.latencies)} samples",
+                f"  loop lag: {self.lag.mean_lag() * 1000:.1f}ms mean, {self.lag.max_lag * 1000:.1f}ms max, "
+                f"{self.lag.stalls} stalls",
+                f"  peak RSS: {self.peak_rss / 1024 / 1024:.1f}MiB",
+            ],
+        )
+
+
+def setup(directory: Path, server: FakeOpenAIServer) -> None:
+    """Point Citadel at a fresh database in `directory` and at the fake OpenAI server, resetting its caches."""
+    globals.SQL_ENGINE = database.setup(str(directory / "citadel.db"))
+    globals.OPENAI_POOL = backends.BackendPool.connect("benchmark", [(server.base_url, "benchmark")])
+    cache.CACHE = cache.ResponseCache()
+    analytics.WRITER = analytics.AnswerWriter()
+    catalog.CATALOG = catalog.TestCatalog()
+    governor.GOVERNOR = governor.RequestGovernor()
+    jobs.QUEUE = jobs.JobQueue()
+    # The bot preloads these while it connects to Discord, so they shouldn't show up as lag in scenarios either.
+    client.preload()
+
+
+async def measure(name: str, unit: str, scenario: Scenario, server: FakeOpenAIServer) -> Result:
+    """Run a scenario, measuring it."""
+    lag_monitor = monitor.LoopMonitor(interval=LAG_INTERVAL)
+    requests = server.requests
+    latencies: list[float] = []
+
+    lag_monitor.start()
+    started = time.perf_counter()
+    try:
+        operations = await scenario(latencies)
+    finally:
+        elapsed = time.perf_counter() - started
+        lag_monitor.stop()
+
+    # `ru_maxrss` is in KiB on Linux.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return Result(name, unit, operations, elapsed, latencies, lag_monitor.stats, server.requests - requests, peak_rss)
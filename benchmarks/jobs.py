@@ -0,0 +1,151 @@
+"""Benchmark the test generation queue's fairness between guilds, and resuming its jobs after a restart.
+
+A busy guild queues lots of tests at once, just ahead of a few quiet guilds queueing one each. The time until each
+test's questions are shown is reported for the busy and the quiet guilds, with workers handed out fairly between
+guilds, in arrival order (as if every job was from one guild), and without a bound (like generating inside the
+command). Then a queue is stopped part way through its jobs, as if the bot had restarted, and a fresh queue resumes
+them. Run with `python -m benchmarks.jobs`.
+"""
+
+import asyncio
+import importlib
+import itertools
+import tempfile
+import time
+from pathlib import Path
+
+import sqlmodel
+from citadel import defaults, globals, jobs
+from citadel.commands.generate import ButtonChoice, Buttons, confirm_test, generate_questions
+from citadel.models import Test
+from sqlmodel import Session
+
+from benchmarks import harness
+from benchmarks.fake_discord import FakeChannel, FakeClient, FakeInteraction, FakeMessage, FakeUser
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.scenarios import POLL_INTERVAL
+
+# The command module, as `citadel.commands` exports the command itself under the same name.
+generate_command = importlib.import_module("citadel.commands.generate")
+
+WORKERS = defaults.GENERATE_WORKERS
+# The busy guild queues more tests than there are workers, so the quiet guilds' tests have to wait for one.
+BUSY_JOBS = WORKERS * 2
+QUIET_GUILDS = 3
+MESSAGES = 500
+RESTART_JOBS = 6
+CAPACITY = 8
+BUSY_GUILD = 1
+
+# Every channel gets its own notes, so no job is served from another's cached responses.
+CHANNELS = itertools.count()
+
+
+async def wait_for_buttons(message: FakeMessage, previous: Buttons | None = None) -> Buttons:
+    """Wait for a job's message to show confirmation buttons other than `previous`."""
+    while not isinstance(message.view, Buttons) or message.view is previous:
+        await asyncio.sleep(POLL_INTERVAL)
+    return message.view
+
+
+async def submit(client: FakeClient, guild_id: int, name: str) -> tuple[FakeInteraction, FakeMessage]:
+    """Run `/generate` in a new channel of notes, returning its interaction and the message its job edits."""
+    index = next(CHANNELS)
+    channel = client.add_channel(
+        FakeChannel(
+            [f"Note {number} from channel {index}: fact {number} is worth learning." for number in range(MESSAGES)]
+        ),
+    )
+    interaction = FakeInteraction(FakeUser(), channel, guild_id=guild_id)
+    await generate_command.generate.callback(interaction, "Notes", name)
+    return interaction, interaction.followup.messages[0]
+
+
+async def generate_test(client: FakeClient, guild_id: int, job_guild_id: int, name: str) -> tuple[int, float]:
+    """Generate a test and create it, returning its guild and how long its questions took to be shown."""
+    started = time.perf_counter()
+    interaction, message = await submit(client, job_guild_id, name)
+    view = await wait_for_buttons(message)
+    elapsed = time.perf_counter() - started
+    interaction.click(view, ButtonChoice.CREATE)
+    return guild_id, elapsed
+
+
+async def fairness(name: str, workers: int, fair: bool) -> None:  # noqa: FBT001
+    """Queue a busy guild's tests just ahead of the quiet guilds' ones, printing how long each guild waited."""
+    jobs.QUEUE = jobs.JobQueue(workers)
+    client = FakeClient()
+    await jobs.QUEUE.start(client, generate_questions, confirm_test)  # type: ignore[arg-type]
+
+    guilds = [BUSY_GUILD] * BUSY_JOBS + list(range(BUSY_GUILD + 1, BUSY_GUILD + 1 + QUIET_GUILDS))
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            generate_test(client, guild, guild if fair else BUSY_GUILD, f"{name} {index}")
+            for index, guild in enumerate(guilds)
+        ),
+    )
+    await jobs.QUEUE.join()
+    elapsed = time.perf_counter() - started
+
+    busy = [seconds for guild, seconds in results if guild == BUSY_GUILD]
+    quiet = [seconds for guild, seconds in results if guild != BUSY_GUILD]
+    print(
+        f"{name}: busy guild {sum(busy) / len(busy):.2f}s mean, {max(busy):.2f}s max; "
+        f"quiet guilds {sum(quiet) / len(quiet):.2f}s mean, {max(quiet):.2f}s max; all done in {elapsed:.2f}s",
+    )
+
+
+def count_tests(prefix: str) -> int:
+    """Count the tests whose names start with `prefix`."""
+    with Session(globals.get_sql_engine()) as session:
+        return len(session.exec(sqlmodel.select(Test).where(Test.name.startswith(prefix))).all())
+
+
+async def restart() -> None:
+    """Stop a queue part way through its jobs, and check a fresh queue picks every one of them up again."""
+    client = FakeClient()
+    jobs.QUEUE = jobs.JobQueue(WORKERS)
+    await jobs.QUEUE.start(client, generate_questions, confirm_test)  # type: ignore[arg-type]
+    submitted = [await submit(client, guild, f"Restart {guild}") for guild in range(RESTART_JOBS)]
+
+    # Restart once the first job is waiting for confirmation, with others generating or still queued.
+    first = await wait_for_buttons(submitted[0][1])
+    jobs.QUEUE.stop()
+    await jobs.QUEUE.join()
+    stored = await asyncio.to_thread(jobs.load_jobs)
+    generated = sum(job.questions is not None for job in stored)
+    print(f"restart: {len(stored)} of {RESTART_JOBS} jobs left stored, {generated} with their questions generated")
+
+    started = time.perf_counter()
+    jobs.QUEUE = jobs.JobQueue(WORKERS)
+    await jobs.QUEUE.start(client, generate_questions, confirm_test)  # type: ignore[arg-type]
+    for index, (interaction, message) in enumerate(submitted):
+        view = await wait_for_buttons(message, first if index == 0 else None)
+        interaction.click(view, ButtonChoice.CREATE)
+    await jobs.QUEUE.join()
+    print(
+        f"resumed: {count_tests('Restart')} of {RESTART_JOBS} tests created, "
+        f"{time.perf_counter() - started:.2f}s after restarting",
+    )
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    # A self-hosted model, which only generates so many completions at once.
+    server = FakeOpenAIServer(capacity=CAPACITY)
+    server.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as directory:
+        harness.setup(Path(directory), server)
+        try:
+            await fairness("fair", WORKERS, fair=True)
+            await fairness("arrival order", WORKERS, fair=False)
+            await fairness("unbounded", BUSY_JOBS + QUIET_GUILDS, fair=True)
+            await restart()
+        finally:
+            globals.get_sql_engine().dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Benchmark scoring and ranking a large quiz lobby.
+
+Run with `python -m benchmarks.leaderboard [players]` (defaults to 5,000 players).
+"""
+
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+from citadel import globals
+from citadel.leaderboard import Leaderboard
+
+PLAYERS = 5_000
+QUESTIONS = 20
+QUIZ_OVERVIEW = globals.get_template("messages/QUIZ-OVERVIEW.md")
+
+
+@dataclass(frozen=True)
+class FakePlayer:
+    """Stands in for a Discord user."""
+
+    display_name: str
+
+
+def main() -> None:
+    """Run the benchmark."""
+    players = [FakePlayer(f"Player {index}") for index in range(int(sys.argv[1]) if len(sys.argv) > 1 else PLAYERS)]
+    leaderboard = Leaderboard(players)
+    score_times = []
+    render_times = []
+
+    for question in range(QUESTIONS):
+        # Players answer in a random order, with most of them getting it right.
+        order = random.sample(players, len(players))
+        correct = [random.random() < 0.6 for _ in players]  # noqa: PLR2004,S311
+
+        started = time.perf_counter()
+        for position, player in enumerate(order):
+            if correct[position]:
+                leaderboard.score(player, len(players) - position)
+        score_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        QUIZ_OVERVIEW.render(
+            question_number=question + 1,
+            question_total=QUESTIONS,
+            correct_answer="Answer",
+            leaderboard=leaderboard.top(),
+            seconds=10,
+        )
+        render_times.append(time.perf_counter() - started)
+
+    print(f"{len(players)} players, {QUESTIONS} questions")
+    print(f"score question: {max(score_times) * 1000:.2f}ms max, {sum(score_times) / QUESTIONS * 1000:.2f}ms mean")
+    print(f"render top 5:   {max(render_times) * 1000:.2f}ms max, {sum(render_times) / QUESTIONS * 1000:.2f}ms mean")
+
+
+if __name__ == "__main__":
+    main()
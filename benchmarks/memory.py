@@ -0,0 +1,178 @@
+"""Benchmark how much memory each memory profile uses per 1000 guilds.
+
+Each profile runs in a fresh interpreter, whose client is fed the gateway events Discord would send it: a guild create
+for every guild (with the channels, roles, emojis and members a busy server has) if it has the guilds intent, and a
+burst of messages in each guild if it has the guild messages intent. The growth in resident memory and in the amount of
+Python objects is reported, along with what ended up in the caches. Run with `python -m benchmarks.memory [guilds]`.
+"""
+
+import asyncio
+import gc
+import itertools
+import json
+import subprocess
+import sys
+from typing import Any
+
+GUILDS = 2000
+CHANNELS = 40
+ROLES = 25
+EMOJIS = 30
+# The members sent with a guild create (those in voice channels, and the bot itself), and the members who send
+# messages.
+MEMBERS = 10
+MESSAGES = 25
+
+IDS = itertools.count(1 << 40)
+
+
+def user(user_id: int) -> dict[str, Any]:
+    """Make up a user payload."""
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0",
+        "avatar": None,
+        "global_name": None,
+    }
+
+
+def member(user_id: int) -> dict[str, Any]:
+    """Make up a guild member payload."""
+    return {
+        "user": user(user_id),
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "nick": None,
+        "flags": 0,
+    }
+
+
+def guild_create(guild_id: int, bot_id: int) -> dict[str, Any]:
+    """Make up the payload of a guild create event."""
+    channels = [
+        {"id": str(next(IDS)), "type": 0, "name": f"channel-{index}", "position": index, "permission_overwrites": []}
+        for index in range(CHANNELS)
+    ]
+    roles = [
+        {
+            "id": str(guild_id if index == 0 else next(IDS)),
+            "name": f"role-{index}",
+            "permissions": "0",
+            "position": index,
+            "color": 0,
+            "hoist": False,
+            "managed": False,
+            "mentionable": False,
+        }
+        for index in range(ROLES)
+    ]
+    emojis = [{"id": str(next(IDS)), "name": f"emoji_{index}", "roles": []} for index in range(EMOJIS)]
+    return {
+        "id": str(guild_id),
+        "name": f"Guild {guild_id}",
+        "owner_id": str(next(IDS)),
+        "member_count": 5000,
+        "large": True,
+        "channels": channels,
+        "roles": roles,
+        "emojis": emojis,
+        "stickers": [],
+        "members": [member(bot_id)] + [member(next(IDS)) for _ in range(MEMBERS - 1)],
+        "voice_states": [],
+        "presences": [],
+        "threads": [],
+        "stage_instances": [],
+        "guild_scheduled_events": [],
+        "features": [],
+    }
+
+
+def message_create(guild_id: int, channel_id: int, author_id: int) -> dict[str, Any]:
+    """Make up the payload of a message create event."""
+    return {
+        "id": str(next(IDS)),
+        "channel_id": str(channel_id),
+        "guild_id": str(guild_id),
+        "author": user(author_id),
+        "member": {key: value for key, value in member(author_id).items() if key != "user"},
+        "content": "Mitochondria are the powerhouse of the cell, which is why they come up in every biology test.",
+        "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+    }
+
+
+async def measure(profile: str, guilds: int) -> dict[str, Any]:
+    """Feed a client the events for some guilds, returning how much its memory grew by."""
+    import discord
+    from citadel import memory
+    from citadel.client import CitadelClient
+    from citadel.defaults import MemoryProfile
+
+    client = CitadelClient(guilds=[], memory_profile=MemoryProfile(profile))
+    state = client._connection  # noqa: SLF001
+    bot_id = next(IDS)
+    state.user = discord.ClientUser(state=state, data=user(bot_id))  # type: ignore[arg-type]
+    # Keep the events' payloads from counting towards the memory used.
+    payloads = [(next(IDS), [next(IDS) for _ in range(MEMBERS)]) for _ in range(guilds)]
+
+    gc.collect()
+    resident, objects = memory.resident_memory(), len(gc.get_objects())
+    for guild_id, authors in payloads:
+        data = guild_create(guild_id, bot_id)
+        if client.intents.guilds:
+            state.parse_guild_create(data)
+        if client.intents.guild_messages:
+            channel_id = int(data["channels"][0]["id"])
+            for index in range(MESSAGES):
+                message = message_create(guild_id, channel_id, authors[index % MEMBERS])
+                state.parse_message_create(message)  # type: ignore[arg-type]
+        # Let any tasks started by the events run.
+        await asyncio.sleep(0)
+    gc.collect()
+
+    return {
+        "resident": memory.resident_memory() - resident,
+        "objects": len(gc.get_objects()) - objects,
+        "caches": memory.cache_sizes(client),
+    }
+
+
+def main() -> None:
+    """Run the benchmark."""
+    if len(sys.argv) > 2 and sys.argv[1] == "--profile":  # noqa: PLR2004
+        # Running as one of the fresh interpreters.
+        print(json.dumps(asyncio.run(measure(sys.argv[2], int(sys.argv[3])))))
+        return
+
+    from citadel.defaults import MemoryProfile
+
+    guilds = int(sys.argv[1]) if len(sys.argv) > 1 else GUILDS
+    for profile in MemoryProfile:
+        output = subprocess.run(  # noqa: S603
+            [sys.executable, "-m", "benchmarks.memory", "--profile", profile.value, str(guilds)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        # The result comes last, after anything the client logged.
+        result = json.loads(output.stdout.splitlines()[-1])
+        caches = ", ".join(f"{count} {name}" for name, count in result["caches"].items())
+        print(
+            f"{profile.value}: {result['resident'] / (1 << 20) / guilds * 1000:.1f}MiB and "
+            f"{result['objects'] / guilds * 1000:.0f} objects per 1000 guilds, caching {caches}",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmark running many quizzes at once on one event loop.
+
+Each quiz is driven the way `/quiz` drives it (a `QuizSession` woken by the shared timer wheel), minus Discord. Reports
+how late questions end compared to their deadlines. Run with `python -m benchmarks.quizzes [quizzes]`.
+"""
+
+import asyncio
+import functools
+import random
+import statistics
+import sys
+
+from citadel import game, timers
+from citadel.distractors import GameQuestion
+from citadel.game import Phase, QuizSession
+
+QUIZZES = 500
+PLAYERS = 10
+QUESTIONS = 3
+
+
+def answer(session: QuizSession[int], player: int) -> None:
+    """Answer the current question correctly."""
+    session.answer(player, "D", asyncio.get_running_loop().time())
+
+
+async def run_quiz(lateness: list[float]) -> None:
+    """Run a quiz where players answer at random times, recording how late each question ended."""
+    loop = asyncio.get_running_loop()
+    session = QuizSession(0, QUESTIONS, loop.time())
+    for player in range(1, PLAYERS):
+        session.join(player)
+    session.start(0, loop.time())
+
+    while not session.done:
+        if session.phase == Phase.QUESTION and session.question is None:
+            question = GameQuestion(question="Question", incorrect_answers=["A", "B", "C"], correct_answer="D")
+            session.show_question(question, ["A", "B", "C", "D"], loop.time())
+            # Most players answer in time, with the rest letting the question run out.
+            for player in random.sample(range(PLAYERS), PLAYERS - 1):
+                answer_at = loop.time() + random.uniform(0, game.QUESTION_TIME)  # noqa: S311
+                timers.TIMERS.call_at(answer_at, functools.partial(answer, session, player))
+            continue
+
+        deadline = session.deadline
+        phase = session.phase
+        wakeup = session.next_wakeup(loop.time())
+        if wakeup is not None:
+            await timers.TIMERS.sleep_until(wakeup)
+        session.tick(loop.time())
+
+        if phase == Phase.QUESTION and session.phase != Phase.QUESTION and deadline is not None:
+            lateness.append(loop.time() - deadline)
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    quizzes = int(sys.argv[1]) if len(sys.argv) > 1 else QUIZZES
+    game.LOBBY_STARTING_TIME = 1
+    game.QUESTION_TIME = 3
+    game.OVERVIEW_TIME = 1
+
+    lateness: list[float] = []
+    await asyncio.gather(*(run_quiz(lateness) for _ in range(quizzes)))
+
+    quantiles = [quantile * 1000 for quantile in statistics.quantiles(lateness, n=100)]
+    worst = max(lateness) * 1000
+    print(f"{quizzes} quizzes, {len(lateness)} questions ended by their deadline")
+    print(f"lateness: {quantiles[49]:.1f}ms p50, {quantiles[98]:.1f}ms p99, {worst:.1f}ms max")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+"""End-to-end benchmark scenarios, driving the real command coroutines against fake OpenAI and Discord.
+
+Run with `python -m benchmarks.scenarios [scenario ...]` (defaults to all of them). The scenarios are:
+
+- `openai`: many concurrent, uncached LLM requests going through the governor. Latency is per request.
+- `generate`: `/generate` over channels with 10k messages each, up to the test being created. Latency is from running
+  the command until its job shows the confirmation buttons.
+- `quizzes`: 50 concurrent `/quiz` games with 40 players each. Latency is from clicking a button until the click gets
+  a reply.
+- `lobby`: `/quiz` on tests of 100 questions whose distractors haven't been generated yet. Latency is from running the
+  command until the launcher is shown.
+
+Peak RSS is for the whole process, so run scenarios on their own to compare their memory use.
+"""
+
+import asyncio
+import importlib
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import discord
+from citadel import analytics, catalog, database, distractors, game, globals, jobs, utils
+from citadel.commands.generate import ButtonChoice, Buttons, confirm_test, create_test, generate_questions
+from citadel.commands.quiz import TestLauncherButtons
+
+from benchmarks import harness
+from benchmarks.fake_discord import FakeChannel, FakeClient, FakeInteraction, FakeMessage, FakeUser
+from benchmarks.fake_openai import FakeOpenAIServer
+
+# The command modules, as `citadel.commands` exports the commands themselves under the same names.
+generate_command = importlib.import_module("citadel.commands.generate")
+quiz_command = importlib.import_module("citadel.commands.quiz")
+
+OPENAI_REQUESTS = 500
+GENERATE_CHANNELS = 3
+GENERATE_MESSAGES = 10_000
+QUIZZES = 50
+QUIZ_PLAYERS = 40
+QUIZ_QUESTIONS = 5
+LOBBY_QUIZZES = 10
+LOBBY_QUESTIONS = 100
+# How often drivers check the fake messages for changes, in seconds.
+POLL_INTERVAL = 0.05
+
+
+async def wait_for_message(interaction: FakeInteraction, command: asyncio.Task[None]) -> FakeMessage:
+    """Wait for the command to send its first followup message."""
+    while len(interaction.followup.messages) == 0:
+        if command.done():
+            await command
+            raise RuntimeError("Command finished without sending a message")  # noqa: TRY003,EM101
+        await asyncio.sleep(POLL_INTERVAL)
+    return interaction.followup.messages[0]
+
+
+async def wait_for_view(
+    message: FakeMessage,
+    previous: discord.ui.View | None,
+    command: asyncio.Task[None],
+) -> discord.ui.View | None:
+    """Wait for the message to show a view other than `previous`, or `None` if the command finishes first."""
+    while message.view is None or message.view is previous:
+        if command.done():
+            await command
+            return None
+        await asyncio.sleep(POLL_INTERVAL)
+    return message.view
+
+
+async def openai_scenario(latencies: list[float]) -> int:
+    """Make lots of LLM requests at once."""
+
+    async def request(index: int) -> None:
+        started = time.perf_counter()
+        await utils.get_openai_resp(f"Benchmark prompt {index}")
+        latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(request(index) for index in range(OPENAI_REQUESTS)))
+    return OPENAI_REQUESTS
+
+
+async def wait_for_buttons(message: FakeMessage) -> Buttons:
+    """Wait for a generation job to show its questions for confirmation."""
+    while not isinstance(message.view, Buttons):
+        if message.content is not None and message.content.startswith("An unknown error"):
+            raise RuntimeError("Generation job failed")  # noqa: TRY003,EM101
+        await asyncio.sleep(POLL_INTERVAL)
+    return message.view
+
+
+async def generate_test(index: int, client: FakeClient, latencies: list[float]) -> None:
+    """Generate a test from a channel full of notes, and create it."""
+    channel = client.add_channel(
+        FakeChannel(
+            [
+                f"Note {number} from channel {index}: fact {number} is worth remembering."
+                for number in range(GENERATE_MESSAGES)
+            ],
+        ),
+    )
+    interaction = FakeInteraction(FakeUser(), channel)
+
+    started = time.perf_counter()
+    await generate_command.generate.callback(interaction, "Notes", f"Generated {index}")
+    view = await wait_for_buttons(interaction.followup.messages[0])
+    latencies.append(time.perf_counter() - started)
+
+    interaction.click(view, ButtonChoice.CREATE)
+
+
+async def generate_scenario(latencies: list[float]) -> int:
+    """Generate tests from several large channels at once."""
+    client = FakeClient()
+    await jobs.QUEUE.start(client, generate_questions, confirm_test)  # type: ignore[arg-type]
+    await asyncio.gather(*(generate_test(index, client, latencies) for index in range(GENERATE_CHANNELS)))
+    await jobs.QUEUE.join()
+    # Creating a test starts generating its distractors in the background, which isn't part of what's measured here.
+    fills = list(distractors.FILLS.values())
+    for fill in fills:
+        fill.cancel()
+    if len(fills) != 0:
+        await asyncio.wait(fills)
+    return GENERATE_CHANNELS * GENERATE_MESSAGES
+
+
+async def play_quiz(index: int, latencies: list[float]) -> int:
+    """Play a quiz, with every player joining and answering each question at a random time, returning the clicks."""
+    loop = asyncio.get_running_loop()
+    channel = FakeChannel([])
+    players = [FakeUser(display_name=f"Player {number}") for number in range(QUIZ_PLAYERS)]
+
+    name = f"Quiz {index}"
+    questions = [
+        {"question": f"Question {number} of quiz {index}?", "answer": f"Answer {number}"}
+        for number in range(QUIZ_QUESTIONS)
+    ]
+    catalog.CATALOG.add(await database.run(create_test, name, questions), name)
+
+    host = FakeInteraction(players[0], channel, latencies=latencies)
+    command = asyncio.create_task(quiz_command.quiz.callback(host, name))
+    message = await wait_for_message(host, command)
+
+    launcher = message.view
+    if launcher is None:
+        raise RuntimeError("Unexpected quiz without a launcher")  # noqa: TRY003,EM101
+    for player in players[1:]:
+        FakeInteraction(player, channel, latencies=latencies).click(launcher, TestLauncherButtons.JOIN.value)
+    FakeInteraction(players[0], channel, latencies=latencies).click(launcher, TestLauncherButtons.START.value)
+    clicks = len(players)
+
+    view: discord.ui.View | None = launcher
+    while (view := await wait_for_view(message, view, command)) is not None:
+        choices = [child.label for child in view.children if isinstance(child, discord.ui.Button)]
+        for player in players:
+            interaction = FakeInteraction(player, channel, latencies=latencies)
+            delay = random.uniform(0, game.QUESTION_TIME * 0.8)  # noqa: S311
+            loop.call_later(delay, interaction.click, view, random.choice(choices))  # noqa: S311
+        clicks += len(players)
+
+    return clicks
+
+
+async def quizzes_scenario(latencies: list[float]) -> int:
+    """Play lots of quizzes at once."""
+    clicks = await asyncio.gather(*(play_quiz(index, latencies) for index in range(QUIZZES)))
+    return sum(clicks)
+
+
+async def open_lobby(index: int, latencies: list[float]) -> None:
+    """Open a quiz on a test without distractors, leaving the lobby once it's shown."""
+    name = f"Lobby {index}"
+    questions = [
+        {"question": f"Question {number} of lobby {index}?", "answer": f"Answer {number}"}
+        for number in range(LOBBY_QUESTIONS)
+    ]
+    catalog.CATALOG.add(await database.run(create_test, name, questions), name)
+
+    host = FakeUser()
+    interaction = FakeInteraction(host, FakeChannel([]))
+    started = time.perf_counter()
+    command = asyncio.create_task(quiz_command.quiz.callback(interaction, name))
+    message = await wait_for_message(interaction, command)
+    latencies.append(time.perf_counter() - started)
+
+    if message.view is None:
+        raise RuntimeError("Unexpected quiz without a launcher")  # noqa: TRY003,EM101
+    # Leaving abandons the quiz, as the host is the only player.
+    FakeInteraction(host, interaction.channel).click(message.view, TestLauncherButtons.LEAVE.value)
+    await command
+
+
+async def lobby_scenario(latencies: list[float]) -> int:
+    """Open lots of quizzes at once on tests that still need their distractors generated."""
+    await asyncio.gather(*(open_lobby(index, latencies) for index in range(LOBBY_QUIZZES)))
+    return LOBBY_QUIZZES
+
+
+SCENARIOS = {
+    "openai": ("requests", openai_scenario),
+    "generate": ("messages", generate_scenario),
+    "quizzes": ("clicks", quizzes_scenario),
+    "lobby": ("quizzes", lobby_scenario),
+}
+
+
+async def main() -> None:
+    """Run the benchmark."""
+    names = sys.argv[1:] or list(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            sys.exit(f"Unknown scenario {name!r}, expected one of: {', '.join(SCENARIOS)}")
+
+    # Quizzes are sped up, so the scenario measures the bot rather than the players' thinking time.
+    game.LOBBY_STARTING_TIME = 1
+    game.QUESTION_TIME = 5
+    game.OVERVIEW_TIME = 1
+
+    # On its own thread, so the fake server's work isn't counted as lag in the bot's event loop.
+    server = FakeOpenAIServer()
+    server.start_in_thread()
+
+    for name in names:
+        unit, scenario = SCENARIOS[name]
+        with tempfile.TemporaryDirectory() as directory:
+            harness.setup(Path(directory), server)
+            try:
+                result = await harness.measure(name, unit, scenario, server)
+            finally:
+                await analytics.WRITER.close()
+                globals.get_sql_engine().dispose()
+        print(result.report())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Benchmark how long Citadel takes to start, and check that the CLI stays free of heavy imports.
+
+Each step runs in a fresh interpreter, and the fastest of several runs is reported. Exits with an error if importing
+`citadel.main` loads any of the modules that are meant to be deferred until a command needs them, so this can guard
+against regressions. Run with `python -m benchmarks.startup [runs]`.
+"""
+
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = 5
+# Modules that are slow to import, which only the commands that need them should load.
+HEAVY_MODULES = ["discord", "openai", "sqlalchemy", "sqlmodel", "inflect", "jinja2", "httpx", "numpy"]
+
+STEPS = {
+    "import citadel.main": "import citadel.main",
+    "citadel --help": "import sys; from citadel import main; sys.argv = ['citadel', '--help']; main.entrypoint()",
+    "import the bot": "import citadel.client, citadel.commands",
+    "compile templates (cold)": "from citadel import globals; globals.compile_templates()",
+    "compile templates (cached)": "from citadel import globals; globals.compile_templates()",
+    "create the inflect engine": "from citadel import globals; globals.get_inflect()",
+}
+
+
+def run(code: str, env: dict[str, str]) -> float:
+    """Run some code in a fresh interpreter, returning how long it took in seconds."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, env=env)  # noqa: S603
+    return time.perf_counter() - started
+
+
+def loaded_heavy_modules() -> list[str]:
+    """Get the heavy modules that importing `citadel.main` loads."""
+    code = f"import sys, citadel.main; print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)  # noqa: S603
+    return output.stdout.split()
+
+
+def main() -> None:
+    """Run the benchmark."""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else RUNS
+
+    with tempfile.TemporaryDirectory() as directory:
+        # A fresh temporary directory means a fresh template bytecode cache, so the cold step has to compile them.
+        env = {"TMPDIR": directory, "PATH": ""}
+        for name, code in STEPS.items():
+            # Cold steps only get one run, as they fill the cache for the rest.
+            times = [run(code, env) for _ in range(1 if "cold" in name else runs)]
+            print(f"{name}: {min(times) * 1000:.0f}ms")
+
+    heavy = loaded_heavy_modules()
+    if len(heavy) != 0:
+        sys.exit(f"Importing citadel.main loaded heavy modules: {', '.join(heavy)}")
+    print("Importing citadel.main doesn't load any heavy modules")
+
+
+if __name__ == "__main__":
+    main()
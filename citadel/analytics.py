@@ -0,0 +1,279 @@
+"""Write-behind persistence of quiz answers and results, along with the aggregates read back from them.
+
+Answering a question shouldn't wait on the database, so the quiz loop only appends events to an in-memory buffer, and
+a background writer flushes them to SQLite in batches, each in a single transaction on the database threads. The
+buffer is bounded: if the database falls so far behind that it fills up, new events are dropped (and counted) instead
+of memory growing without limit. Whatever's still buffered gets flushed when the bot shuts down.
+
+The per-player and per-test aggregates are covered by the tables' indexes, so they don't read the tables themselves.
+"""
+
+__all__ = [
+    "WRITER",
+    "AnswerWriter",
+    "QuizEvents",
+    "Summary",
+    "player_history",
+    "player_summaries",
+    "question_summaries",
+    "test_summary",
+    "top_players",
+]
+
+import asyncio
+import bisect
+import contextlib
+import time
+from collections import defaultdict, deque
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+import sqlmodel
+from sqlalchemy import Integer, cast, func, insert
+from sqlmodel import Session
+
+from citadel import database, globals, metrics
+from citadel.leaderboard import PlayerStats
+from citadel.models import AnswerEvent, QuizResult
+
+# The most events to buffer before dropping new ones.
+MAX_PENDING = 50_000
+# The most events to write in a single transaction. Flushes happen early once this many are buffered.
+BATCH_SIZE = 1000
+# How long events can wait in the buffer before being flushed, in seconds.
+FLUSH_INTERVAL = 1.0
+
+Row = tuple[type[AnswerEvent] | type[QuizResult], dict[str, Any]]
+
+
+def write_rows(rows: Sequence[Row]) -> None:
+    """Write buffered rows to the database, in a single transaction."""
+    by_model: defaultdict[type[AnswerEvent | QuizResult], list[dict[str, Any]]] = defaultdict(list)
+    for model, row in rows:
+        by_model[model].append(row)
+
+    with Session(globals.get_sql_engine()) as session:
+        for model, values in by_model.items():
+            # Inserted into the table directly, as the ORM's bulk inserts do a lot of work for every row.
+            session.connection().execute(insert(model.__table__), values)  # type: ignore[union-attr]
+        session.commit()
+
+
+class AnswerWriter:
+    """Buffers answer events and quiz results, writing them to the database in batches from a background task.
+
+    The task is started by the first event to come in, and stops once the buffer has been emptied.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = MAX_PENDING,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+    ) -> None:
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.__pending: deque[Row] = deque()
+        # Set when a full batch is waiting, or when closing, to flush without waiting for the interval.
+        self.__flush_now: asyncio.Event | None = None
+        self.__closing = False
+        self.__task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self.__pending)
+
+    def record(self, model: type[AnswerEvent] | type[QuizResult], row: dict[str, Any]) -> None:
+        """Buffer a row to be written, without waiting for it to be."""
+        if len(self.__pending) >= self.max_pending:
+            metrics.ANALYTICS_DROPPED.inc()
+            return
+        self.__pending.append((model, row))
+
+        if self.__task is None or self.__task.done():
+            self.__flush_now = asyncio.Event()
+            self.__task = asyncio.create_task(self.__run())
+        elif len(self.__pending) >= self.batch_size and self.__flush_now is not None:
+            self.__flush_now.set()
+
+    async def flush(self) -> None:
+        """Write everything buffered so far, in batches."""
+        while len(self.__pending) != 0:
+            batch = [self.__pending.popleft() for _ in range(min(self.batch_size, len(self.__pending)))]
+            try:
+                await database.run(write_rows, batch)
+            except Exception:  # noqa: BLE001
+                globals.LOGGER.exception("Failed to write %s analytics events", len(batch))
+                metrics.ANALYTICS_DROPPED.inc(amount=len(batch))
+            else:
+                metrics.ANALYTICS_WRITTEN.inc(amount=len(batch))
+
+    async def close(self) -> None:
+        """Flush everything that's buffered, waiting for the writer to finish."""
+        self.__closing = True
+        if self.__flush_now is not None:
+            self.__flush_now.set()
+        if self.__task is not None:
+            await self.__task
+        await self.flush()
+        self.__closing = False
+
+    async def __run(self) -> None:
+        while len(self.__pending) != 0:
+            if len(self.__pending) < self.batch_size and not self.__closing and self.__flush_now is not None:
+                self.__flush_now.clear()
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self.__flush_now.wait(), self.flush_interval)
+            await self.flush()
+
+
+WRITER = AnswerWriter()
+
+metrics.Gauge(
+    "citadel_analytics_pending",
+    "The amount of quiz answer events and results waiting to be written to the database.",
+    lambda: len(WRITER),
+)
+
+
+@dataclass
+class QuizEvents:
+    """Records the events of a single quiz to `WRITER`."""
+
+    quiz_id: int
+    test_id: int
+    guild_id: int | None
+
+    def answer(
+        self,
+        player_id: int,
+        question_id: int | None,
+        question_index: int,
+        correct: bool,  # noqa: FBT001
+        response_time: float,
+    ) -> None:
+        """Record a player's answer to a question."""
+        WRITER.record(
+            AnswerEvent,
+            {
+                "quiz_id": self.quiz_id,
+                "test_id": self.test_id,
+                "question_id": question_id,
+                "question_index": question_index,
+                "guild_id": self.guild_id,
+                "player_id": player_id,
+                "correct": correct,
+                "response_time": response_time,
+                "answered_at": time.time(),
+            },
+        )
+
+    def finish(self, stats: Mapping[int, PlayerStats], questions: int) -> None:
+        """Record how every player did, once the quiz has finished."""
+        # Negated, so players on more points come first, and a player's place is one more than the players ahead.
+        points = sorted(-player.points for player in stats.values())
+        finished_at = time.time()
+        for player_id, player in stats.items():
+            WRITER.record(
+                QuizResult,
+                {
+                    "quiz_id": self.quiz_id,
+                    "test_id": self.test_id,
+                    "guild_id": self.guild_id,
+                    "player_id": player_id,
+                    "points": player.points,
+                    "correct": player.correct,
+                    "questions": questions,
+                    "players": len(stats),
+                    "rank": bisect.bisect_left(points, -player.points) + 1,
+                    "finished_at": finished_at,
+                },
+            )
+
+
+@dataclass
+class Summary:
+    """Aggregate statistics about a set of answers."""
+
+    answers: int = 0
+    correct: int = 0
+    # The total time taken to answer, in seconds.
+    response_time: float = 0.0
+
+    def accuracy(self) -> float:
+        """Get the fraction of the answers that were correct."""
+        return 0.0 if self.answers == 0 else self.correct / self.answers
+
+    def mean_response_time(self) -> float:
+        """Get the average time taken to answer, in seconds."""
+        return 0.0 if self.answers == 0 else self.response_time / self.answers
+
+
+SUMMARY_COLUMNS = (
+    func.count(),
+    func.coalesce(func.sum(cast(AnswerEvent.correct, Integer)), 0),
+    func.coalesce(func.sum(AnswerEvent.response_time), 0.0),
+)
+
+
+def player_summaries(player_id: int) -> dict[int, Summary]:
+    """Summarize a player's answers in each test they've played, by test ID."""
+    with Session(globals.get_sql_engine()) as session:
+        statement = (
+            sqlmodel.select(AnswerEvent.test_id, *SUMMARY_COLUMNS)
+            .where(AnswerEvent.player_id == player_id)
+            .group_by(AnswerEvent.test_id)  # type: ignore[arg-type]
+        )
+        return {
+            test_id: Summary(answers, correct, response_time)
+            for test_id, answers, correct, response_time in session.exec(statement)
+        }
+
+
+def test_summary(test_id: int) -> Summary:
+    """Summarize every answer given to a test's questions."""
+    with Session(globals.get_sql_engine()) as session:
+        statement = sqlmodel.select(*SUMMARY_COLUMNS).where(AnswerEvent.test_id == test_id)
+        answers, correct, response_time = session.exec(statement).one()
+        return Summary(answers, correct, response_time)
+
+
+def question_summaries(test_id: int) -> dict[int | None, Summary]:
+    """Summarize the answers given to each of a test's questions, by question ID."""
+    with Session(globals.get_sql_engine()) as session:
+        statement = (
+            sqlmodel.select(AnswerEvent.question_id, *SUMMARY_COLUMNS)
+            .where(AnswerEvent.test_id == test_id)
+            .group_by(AnswerEvent.question_id)  # type: ignore[arg-type]
+        )
+        return {
+            question_id: Summary(answers, correct, response_time)
+            for question_id, answers, correct, response_time in session.exec(statement)
+        }
+
+
+def player_history(player_id: int, limit: int = 20) -> list[QuizResult]:
+    """Get a player's results in the quizzes they've finished, newest first."""
+    with Session(globals.get_sql_engine()) as session:
+        statement = (
+            sqlmodel.select(QuizResult)
+            .where(QuizResult.player_id == player_id)
+            .order_by(QuizResult.finished_at.desc())  # type: ignore[attr-defined]
+            .limit(limit)
+        )
+        return list(session.exec(statement))
+
+
+def top_players(test_id: int, limit: int = 10) -> list[tuple[int, int, int]]:
+    """Get the players with the best scores in a test, as `(player ID, best points, quizzes finished)` tuples."""
+    with Session(globals.get_sql_engine()) as session:
+        best = func.max(QuizResult.points)
+        statement = (
+            sqlmodel.select(QuizResult.player_id, best, func.count())
+            .where(QuizResult.test_id == test_id)
+            .group_by(QuizResult.player_id)  # type: ignore[arg-type]
+            .order_by(best.desc())
+            .limit(limit)
+        )
+        return list(session.exec(statement))
@@ -0,0 +1,248 @@
+"""A pool of OpenAI-compatible backends that requests are spread over.
+
+Citadel can be pointed at several endpoints (such as a few Ollama servers), each with its own model, which share a
+single connection-pooled HTTP client. Each request goes to the healthy backend with the fewest requests outstanding, so
+a slow or busy backend naturally gets less work. Backends that keep failing (with connection or server errors) are
+ejected for a cooldown that grows for as long as they keep failing, and retries go to a different backend if there is
+one.
+
+Completions can also be hedged: when one is taking longer than nearly all completions do, a copy of it is sent to
+another backend, and whichever finishes first is used. This trims the latency tail (such as from a backend that's
+stalled) at the cost of a few percent more requests.
+"""
+
+__all__ = ["Backend", "BackendPool", "Lease", "parse_endpoints"]
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Collection
+from types import TracebackType
+from typing import TypeVar
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from citadel import globals, metrics
+
+T = TypeVar("T")
+
+# How many failures in a row get a backend ejected, and for how long, in seconds. The cooldown doubles with every
+# further failure (as the backend gets one request to prove itself after each cooldown), up to the maximum.
+EJECT_FAILURES = 3
+EJECT_SECONDS = 10.0
+EJECT_MAX_SECONDS = 300.0
+# The quantile of completion latencies after which a completion gets hedged, and how many completions need to have
+# been seen before that quantile is trusted.
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+
+# Errors that say something's wrong with the backend, rather than with the request.
+BACKEND_ERRORS = (openai.APIConnectionError, openai.InternalServerError, httpx.TransportError)
+
+
+def parse_endpoints(bases: str, models: str) -> list[tuple[str, str]]:
+    """Pair up comma-separated base URLs with comma-separated models, with a single model being used for every URL."""
+    base_list = [base.strip() for base in bases.split(",") if base.strip() != ""]
+    model_list = [model.strip() for model in models.split(",") if model.strip() != ""]
+    if len(base_list) == 0 or len(model_list) == 0:
+        raise ValueError("At least one base URL and model are needed")  # noqa: TRY003,EM101
+    if len(model_list) == 1:
+        model_list *= len(base_list)
+    if len(model_list) != len(base_list):
+        raise ValueError("Expected either one model, or one for each base URL")  # noqa: TRY003,EM101
+    return list(zip(base_list, model_list, strict=True))
+
+
+class Backend:
+    """An OpenAI-compatible endpoint, and the model to use on it."""
+
+    def __init__(self, client: AsyncOpenAI, model: str) -> None:
+        self.client = client
+        self.model = model
+        self.name = str(client.base_url)
+        # The requests currently in-flight, and the requests sent in total.
+        self.outstanding = 0
+        self.requests = 0
+        # The failures in a row, and when the backend is ejected until (on the `time.monotonic` clock).
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def ejected(self) -> bool:
+        """Check whether the backend is currently out of rotation."""
+        return time.monotonic() < self.ejected_until
+
+    def succeeded(self) -> None:
+        """Record that a request succeeded."""
+        self.failures = 0
+
+    def failed(self) -> None:
+        """Record that a request failed, ejecting the backend if it's been failing too often."""
+        self.failures += 1
+        metrics.OPENAI_BACKEND_FAILURES.inc(self.name)
+        if self.failures < EJECT_FAILURES:
+            return
+
+        cooldown = min(EJECT_SECONDS * 2 ** min(self.failures - EJECT_FAILURES, 16), EJECT_MAX_SECONDS)
+        self.ejected_until = time.monotonic() + cooldown
+        metrics.OPENAI_BACKEND_EJECTIONS.inc(self.name)
+        globals.LOGGER.warning(
+            "Ejecting OpenAI backend %s for %.0fs after %s failures in a row", self.name, cooldown, self.failures
+        )
+
+
+class Lease:
+    """A request's hold on a backend, which counts as outstanding on it until the lease ends.
+
+    Each attempt at the request (such as the governor's retries) picks a backend afresh, avoiding the backends that
+    were already tried where it can. How the last attempt went is recorded against its backend when the lease ends, so
+    streams are held (and timed) until they've been fully read.
+    """
+
+    def __init__(self, pool: "BackendPool", mode: str, exclude: Collection[Backend] = ()) -> None:
+        self.mode = mode
+        self.tried = list(exclude)
+        self.backend: Backend | None = None
+        self.__pool = pool
+        self.__started = 0.0
+
+    async def call(self, call: Callable[[Backend], Awaitable[T]]) -> T:
+        """Make an attempt at the request on the best backend for it."""
+        backend = self.__pool.choose(self.tried)
+        self.tried.append(backend)
+        self.backend = backend
+        backend.outstanding += 1
+        backend.requests += 1
+        self.__started = time.perf_counter()
+
+        try:
+            return await call(backend)
+        except BaseException as err:
+            self.release(err)
+            raise
+
+    def release(self, error: BaseException | None = None) -> None:
+        """Stop holding the backend, recording how its request went."""
+        if self.backend is None:
+            return
+        backend, self.backend = self.backend, None
+        backend.outstanding -= 1
+
+        if error is None:
+            backend.succeeded()
+            metrics.OPENAI_BACKEND_SECONDS.observe(time.perf_counter() - self.__started, backend.name, self.mode)
+        elif isinstance(error, BACKEND_ERRORS):
+            backend.failed()
+
+    async def __aenter__(self) -> "Lease":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.release(exc)
+
+
+class BackendPool:
+    """The backends that requests to the model get spread over."""
+
+    def __init__(self, backends: list[Backend], hedge: bool = False) -> None:  # noqa: FBT001,FBT002
+        if len(backends) == 0:
+            raise ValueError("A backend pool needs at least one backend")  # noqa: TRY003,EM101
+        self.backends = backends
+        self.hedge = hedge
+
+    @classmethod
+    def connect(
+        cls,
+        api_key: str,
+        endpoints: list[tuple[str, str]],
+        timeout: float = 60.0,
+        hedge: bool = False,  # noqa: FBT001,FBT002
+    ) -> "BackendPool":
+        """Create a pool for some `(base URL, model)` endpoints, sharing a connection-pooled HTTP client."""
+        http_client = openai.DefaultAsyncHttpxClient()
+        # Retries are handled by the governor, so it can keep track of rate limits between them.
+        return cls(
+            [
+                Backend(
+                    AsyncOpenAI(
+                        api_key=api_key,
+                        base_url=base,
+                        max_retries=0,
+                        timeout=timeout,
+                        http_client=http_client,
+                    ),
+                    model,
+                )
+                for base, model in endpoints
+            ],
+            hedge,
+        )
+
+    def identity(self) -> list[str]:
+        """Get the models and base URLs of the backends, which identify where the pool's responses come from."""
+        return [part for backend in self.backends for part in (backend.model, backend.name)]
+
+    def choose(self, exclude: Collection[Backend] = ()) -> Backend:
+        """Choose the backend to send a request to, avoiding the excluded ones if there's a healthy backend left.
+
+        Healthy backends with the fewest outstanding requests are preferred (with ties going to the backend that's had
+        the fewest requests overall). If every backend has been ejected, the one that's due back soonest is used.
+        """
+        healthy = [backend for backend in self.backends if not backend.ejected()]
+        untried = [backend for backend in healthy if backend not in exclude]
+        if len(untried) != 0:
+            return min(untried, key=lambda backend: (backend.outstanding, backend.requests))
+        if len(healthy) != 0:
+            return min(healthy, key=lambda backend: (backend.outstanding, backend.requests))
+        return min(self.backends, key=lambda backend: backend.ejected_until)
+
+    def lease(self, mode: str, exclude: Collection[Backend] = ()) -> Lease:
+        """Start a lease for a request, with `mode` being what sort of request it is (for the latency metrics)."""
+        return Lease(self, mode, exclude)
+
+    def hedge_delay(self) -> float | None:
+        """Get how long to wait for a completion before hedging it, or `None` if it shouldn't be hedged."""
+        if not self.hedge or metrics.OPENAI_BACKEND_SECONDS.count(mode="complete") < HEDGE_MIN_SAMPLES:
+            return None
+        return metrics.OPENAI_BACKEND_SECONDS.quantile(HEDGE_QUANTILE, mode="complete")
+
+    async def complete(self, request: Callable[[Lease], Awaitable[T]]) -> T:
+        """Make a completion request with a lease, hedging it on another backend if it's slow and hedging is enabled.
+
+        If either the original or the hedge fails, the other's result is still used.
+        """
+        original = self.lease("complete")
+        delay = self.hedge_delay()
+        if delay is None:
+            async with original:
+                return await request(original)
+
+        async def run(lease: Lease) -> T:
+            async with lease:
+                return await request(lease)
+
+        tasks = [asyncio.create_task(run(original))]
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=delay)
+            if len(done) == 0:
+                tasks.append(asyncio.create_task(run(self.lease("complete", original.tried))))
+                pending.add(tasks[-1])
+
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            metrics.OPENAI_HEDGES.inc("original" if task is tasks[0] else "hedge")
+                        return task.result()
+                if len(pending) == 0:
+                    # Everything failed, so raise the original's error.
+                    return tasks[0].result()
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
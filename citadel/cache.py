@@ -0,0 +1,213 @@
+"""A content-addressed cache for LLM completions.
+
+Completions are keyed by the model, the API's base URL, and a hash of the rendered prompt. Lookups go through an
+in-memory LRU first and then a SQLite table, both of which expire entries after a TTL. Concurrent requests for the same
+key are coalesced, so only one of them goes to the model.
+"""
+
+__all__ = ["CACHE", "CacheStats", "ResponseCache"]
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from dataclasses import dataclass
+
+from sqlalchemy import delete
+from sqlmodel import Session
+
+from citadel import database, globals, metrics
+from citadel.models import CachedCompletion
+
+# The most completions to keep in memory.
+MAX_MEMORY_ENTRIES = 1024
+# How long completions are kept for, in seconds.
+TTL = 7 * 24 * 60 * 60
+
+
+class AbandonedRequestError(Exception):
+    """The in-flight request a coalesced request was waiting on got cancelled before it finished."""
+
+
+@dataclass
+class CacheStats:
+    """Counters for how requests to the cache were served."""
+
+    memory_hits: int = 0
+    db_hits: int = 0
+    misses: int = 0
+    # Requests that were served by waiting on an identical request already in-flight.
+    coalesced: int = 0
+
+    def hit_rate(self) -> float:
+        """Get the fraction of requests that didn't need to go to the model."""
+        total = self.memory_hits + self.db_hits + self.misses + self.coalesced
+        return 0.0 if total == 0 else (total - self.misses) / total
+
+
+class ResponseCache:
+    """A two-tier (memory and SQLite) cache of LLM completions, with single-flight deduplication of misses."""
+
+    def __init__(self, max_memory_entries: int = MAX_MEMORY_ENTRIES, ttl: float = TTL) -> None:
+        self.max_memory_entries = max_memory_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.__memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.__inflight: dict[str, asyncio.Future[str]] = {}
+
+    def key(self, prompt: str) -> str:
+        """Get the cache key for a prompt sent to the current models."""
+        request = json.dumps([*globals.get_openai_pool().identity(), prompt])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def load(self, key: str) -> CachedCompletion | None:
+        """Load a completion from the database tier."""
+        with Session(globals.get_sql_engine()) as session:
+            return session.get(CachedCompletion, key)
+
+    def save(self, entry: CachedCompletion) -> None:
+        """Save a completion to the database tier, removing any entries that have expired."""
+        with Session(globals.get_sql_engine()) as session:
+            session.merge(entry)
+            session.connection().execute(delete(CachedCompletion).where(CachedCompletion.expires_at <= time.time()))  # type: ignore[arg-type]
+            session.commit()
+
+    def remove(self, key: str) -> None:
+        """Remove a completion from the database tier."""
+        with Session(globals.get_sql_engine()) as session:
+            session.connection().execute(delete(CachedCompletion).where(CachedCompletion.key == key))  # type: ignore[arg-type]
+            session.commit()
+
+    async def lookup(self, key: str) -> str | None:
+        """Look up a completion in the cache, returning `None` if it isn't present (or has expired)."""
+        now = time.time()
+
+        if key in self.__memory:
+            content, expires_at = self.__memory[key]
+            if expires_at > now:
+                self.__memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return content
+            del self.__memory[key]
+
+        entry = await database.run(self.load, key)
+        if entry is None or entry.expires_at <= now:
+            return None
+
+        self.__remember(key, entry.content, entry.expires_at)
+        self.stats.db_hits += 1
+        return entry.content
+
+    async def store(self, key: str, content: str) -> None:
+        """Store a completion in the cache."""
+        expires_at = time.time() + self.ttl
+        self.__remember(key, content, expires_at)
+        await database.run(self.save, CachedCompletion(key=key, content=content, expires_at=expires_at))
+
+    async def invalidate(self, prompt: str) -> None:
+        """Remove the completion for a prompt from the cache (e.g. because it turned out to be unusable)."""
+        key = self.key(prompt)
+        self.__memory.pop(key, None)
+        await database.run(self.remove, key)
+
+    def __remember(self, key: str, content: str, expires_at: float) -> None:
+        self.__memory[key] = (content, expires_at)
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_memory_entries:
+            self.__memory.popitem(last=False)
+
+    def __start(self, key: str) -> asyncio.Future[str]:
+        future = asyncio.get_running_loop().create_future()
+        self.__inflight[key] = future
+        self.stats.misses += 1
+        globals.LOGGER.debug("Completion cache miss (%s, hit rate %.2f)", self.stats, self.stats.hit_rate())
+        return future
+
+    async def __succeed(self, key: str, future: asyncio.Future[str], content: str) -> None:
+        del self.__inflight[key]
+        future.set_result(content)
+        await self.store(key, content)
+
+    def __fail(self, key: str, future: asyncio.Future[str], error: BaseException) -> None:
+        del self.__inflight[key]
+
+        # A cancelled request (e.g. a command the user gave up on) doesn't mean the requests waiting on it should be
+        # cancelled too, so they're told to make the request themselves instead.
+        if isinstance(error, asyncio.CancelledError | GeneratorExit):
+            future.set_exception(AbandonedRequestError())
+        else:
+            future.set_exception(error)
+        # Nobody might be waiting on the future, so mark the exception as retrieved to avoid asyncio warnings.
+        future.exception()
+
+    async def get(self, prompt: str, create: Callable[[], Awaitable[str]]) -> str:
+        """Get the completion for a prompt, calling `create` to get it from the model on a cache miss."""
+        key = self.key(prompt)
+        while True:
+            content = await self.lookup(key)
+            if content is not None:
+                return content
+            if key not in self.__inflight:
+                break
+            try:
+                content = await asyncio.shield(self.__inflight[key])
+            except AbandonedRequestError:
+                # Look again, as another waiting request may have taken over making it.
+                continue
+            self.stats.coalesced += 1
+            return content
+
+        future = self.__start(key)
+        try:
+            content = await create()
+        except BaseException as err:
+            self.__fail(key, future, err)
+            raise
+        await self.__succeed(key, future, content)
+        return content
+
+    async def stream(self, prompt: str, create: Callable[[], AsyncGenerator[str, None]]) -> AsyncGenerator[str, None]:
+        """Stream the completion for a prompt, calling `create` to stream it from the model on a cache miss.
+
+        Cache hits (and requests coalesced into one that's already in-flight) get the whole completion at once.
+        """
+        key = self.key(prompt)
+        while True:
+            content = await self.lookup(key)
+            if content is not None:
+                yield content
+                return
+            if key not in self.__inflight:
+                break
+            try:
+                content = await asyncio.shield(self.__inflight[key])
+            except AbandonedRequestError:
+                # Look again, as another waiting request may have taken over making it.
+                continue
+            self.stats.coalesced += 1
+            yield content
+            return
+
+        future = self.__start(key)
+        chunks = []
+        try:
+            async with contextlib.aclosing(create()) as stream:
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+        except BaseException as err:
+            self.__fail(key, future, err)
+            raise
+        await self.__succeed(key, future, "".join(chunks))
+
+
+CACHE = ResponseCache()
+
+metrics.Gauge(
+    "citadel_llm_cache_hit_ratio",
+    "The fraction of LLM requests that were served without going to the model.",
+    lambda: CACHE.stats.hit_rate(),
+)
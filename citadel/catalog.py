@@ -0,0 +1,121 @@
+"""An in-memory index of test names, used for autocompletion and looking tests up by name.
+
+Names are kept in a sorted array (case-folded), so prefix searches are a binary search followed by a scan of only the
+matching names. The index is loaded from the database on first use, and kept up to date as tests are created. Tests
+created by other processes (such as other shards) are picked up by periodically loading any tests newer than the
+newest one seen, and the whole index is reloaded every so often to drop tests that were deleted or renamed elsewhere.
+"""
+
+__all__ = ["CATALOG", "TestCatalog"]
+
+import asyncio
+import bisect
+import time
+
+import sqlmodel
+from sqlmodel import Session
+
+from citadel import database, globals
+from citadel.models import Test
+
+# The most autocompletion choices Discord allows.
+MAX_CHOICES = 25
+# How often to check for tests created by other processes, in seconds.
+REFRESH_INTERVAL = 5.0
+# How often to reload the whole catalog, so tests deleted or renamed by other processes get dropped, in seconds.
+RELOAD_INTERVAL = 60.0
+
+
+def load_test_names(after: int = 0) -> list[tuple[int, str]]:
+    """Load the ID and name of every test with an ID greater than `after`."""
+    with Session(globals.get_sql_engine()) as session:
+        statement = (
+            sqlmodel.select(Test.id, Test.name)
+            .where(Test.id > after)  # type: ignore[operator]
+            .order_by(Test.id)  # type: ignore[arg-type]
+        )
+        return [(test_id, name) for test_id, name in session.exec(statement) if test_id is not None]
+
+
+class TestCatalog:
+    """A prefix index over test names."""
+
+    def __init__(self) -> None:
+        # The case-folded names, and the (case-folded name, name) pairs they belong to, both sorted.
+        self.__keys: list[str] = []
+        self.__names: list[tuple[str, str]] = []
+        # Test IDs by name. If multiple tests share a name, the oldest one wins.
+        self.__ids: dict[str, int] = {}
+        # The newest test loaded from the database, and when we last checked for newer ones and last reloaded every
+        # test (from `time.monotonic`).
+        self.__last_id = 0
+        self.__refreshed_at = 0.0
+        self.__reloaded_at = 0.0
+        self.__loaded = False
+        self.__lock = asyncio.Lock()
+
+    async def load(self) -> None:
+        """Load the catalog from the database if it isn't loaded or is due a reload, or else load any new tests."""
+        if self.__loaded and time.monotonic() - self.__refreshed_at < REFRESH_INTERVAL:
+            return
+
+        async with self.__lock:
+            if not self.__loaded or time.monotonic() - self.__reloaded_at >= RELOAD_INTERVAL:
+                reloaded_at = time.monotonic()
+                tests = await database.run(load_test_names)
+                ids: dict[str, int] = {}
+                for test_id, name in tests:
+                    ids.setdefault(name, test_id)
+                # Everything's swapped in at once, replacing any tests added while it was loading. Those are newer
+                # than the newest test it loaded, so they're picked up again by the next refresh.
+                self.__ids = ids
+                self.__names = sorted((name.casefold(), name) for name in ids)
+                self.__keys = [key for key, _ in self.__names]
+                self.__last_id = 0
+                self.__reloaded_at = reloaded_at
+                self.__loaded = True
+                globals.LOGGER.debug("Loaded %s test names into the catalog", len(self.__names))
+            elif time.monotonic() - self.__refreshed_at >= REFRESH_INTERVAL:
+                tests = await database.run(load_test_names, self.__last_id)
+                for test_id, name in tests:
+                    self.add(test_id, name)
+            else:
+                # Someone else refreshed the catalog while we were waiting for the lock.
+                return
+
+            if len(tests) != 0:
+                self.__last_id = tests[-1][0]
+            self.__refreshed_at = time.monotonic()
+
+    def add(self, test_id: int, name: str) -> None:
+        """Add a newly created test to the catalog.
+
+        This leaves the newest loaded test as-is, so tests created by other processes in the meantime still get loaded.
+        """
+        if not self.__loaded or name in self.__ids:
+            return
+        self.__ids[name] = test_id
+        index = bisect.bisect_left(self.__names, (name.casefold(), name))
+        self.__names.insert(index, (name.casefold(), name))
+        self.__keys.insert(index, name.casefold())
+
+    async def search(self, prefix: str, limit: int = MAX_CHOICES) -> list[str]:
+        """Get the names of tests starting with `prefix` (ignoring case), in alphabetical order."""
+        await self.load()
+        key = prefix.casefold()
+        start = bisect.bisect_left(self.__keys, key)
+
+        names = []
+        for index in range(start, min(start + limit, len(self.__keys))):
+            if not self.__keys[index].startswith(key):
+                break
+            names.append(self.__names[index][1])
+        return names
+
+    async def get(self, name: str) -> int | None:
+        """Get the ID of the test with the given name, or `None` if there isn't one."""
+        await self.load()
+        return self.__ids.get(name)
+
+
+CATALOG = TestCatalog()
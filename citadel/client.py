@@ -0,0 +1,136 @@
+"""The Discord client that runs the bot."""
+
+__all__ = ["CitadelClient", "client_options", "preload"]
+
+import asyncio
+import time
+from typing import Any
+
+import discord
+from discord import app_commands
+
+from citadel import analytics, database, globals, history, jobs, memory, metrics, monitor, sync
+from citadel.commands.generate import confirm_test, generate_questions
+from citadel.defaults import MemoryProfile
+
+
+def preload() -> None:
+    """Set up the globals that are slow to create, so the first command to use them doesn't have to wait."""
+    globals.get_inflect()
+    globals.compile_templates()
+
+
+def client_options(profile: MemoryProfile) -> dict[str, Any]:
+    """Get the intents and cache settings for a memory profile, as keyword arguments for the client.
+
+    The bot only needs what comes with each interaction, and raw message edits and deletions (to keep the message
+    store up to date), so the low profile subscribes to nothing else and caches nothing. Without the guilds intent,
+    discord.py builds each interaction's guild and channel from its payload rather than from its cache.
+    """
+    if profile == MemoryProfile.LOW:
+        # Needed for message edits and deletions, and to see the content of edited messages.
+        intents = discord.Intents.none()
+        intents.guild_messages = True
+        intents.message_content = True
+        return {
+            "intents": intents,
+            "member_cache_flags": discord.MemberCacheFlags.none(),
+            "max_messages": None,
+            "chunk_guilds_at_startup": False,
+        }
+
+    intents = discord.Intents.default()
+    # Needed to see the content of edited messages, to keep the message store up to date.
+    intents.message_content = True
+    return {"intents": intents}
+
+
+class CitadelClient(discord.AutoShardedClient):
+    """The Citadel Discord Client.
+
+    When `shard_ids` isn't given, this connects every shard (as many as Discord recommends if `shard_count` isn't given
+    either). Otherwise only the given shards are connected, so that the rest can be run in other processes.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        *,
+        guilds: list[discord.Object],
+        shard_ids: list[int] | None = None,
+        shard_count: int | None = None,
+        force_sync: bool = False,
+        started: float | None = None,
+        metrics_server: metrics.MetricsServer | None = None,
+        memory_profile: MemoryProfile = MemoryProfile.DEFAULT,
+    ) -> None:
+        self.guilds_to_sync = guilds
+        self.force_sync = force_sync
+        self.metrics_server = metrics_server
+        # When startup began, as a `time.perf_counter` value.
+        self.started = time.perf_counter() if started is None else started
+        self.ready = False
+        self.preloading: asyncio.Task[None] | None = None
+        self.memory_profile = memory_profile
+        options = client_options(memory_profile)
+        if shard_ids is None:
+            super().__init__(shard_count=shard_count, **options)
+        else:
+            super().__init__(shard_ids=shard_ids, shard_count=shard_count, **options)
+        self.tree = app_commands.CommandTree(self)
+        self.tree.error(self.on_app_command_error)
+
+    async def setup_hook(self) -> None:
+        """Ensure the slash commands have been synced to our guilds, or globally if there aren't any."""
+        # Commands only need syncing once, so when sharded over several processes, only the one with the first shard
+        # does it.
+        if self.shard_ids is None or 0 in self.shard_ids:
+            for guild in self.guilds_to_sync:
+                self.tree.copy_global_to(guild=guild)
+                await sync.sync_commands(self.tree, guild, force=self.force_sync)
+            if len(self.guilds_to_sync) == 0:
+                await sync.sync_commands(self.tree, None, force=self.force_sync)
+        monitor.MONITOR.start()
+        memory.REPORTER.start(self)
+        # Picks up any test generation jobs left over from before a restart.
+        await jobs.QUEUE.start(self, generate_questions, confirm_test)
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        # Loaded in the background while connecting to the gateway, rather than delaying startup.
+        self.preloading = asyncio.create_task(asyncio.to_thread(preload))
+
+    async def close(self) -> None:
+        """Stop background work and write any buffered quiz analytics, then disconnect."""
+        memory.REPORTER.stop()
+        jobs.QUEUE.stop()
+        await analytics.WRITER.close()
+        await super().close()
+
+    async def on_ready(self) -> None:
+        """Log how long startup took."""
+        # This also gets called after reconnecting, which isn't startup.
+        if not self.ready:
+            self.ready = True
+            globals.LOGGER.info("Ready in %.2fs", time.perf_counter() - self.started)
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """Keep the stored copy of edited messages up to date."""
+        if "content" in payload.data:
+            await database.run(history.edit_message, payload.message_id, payload.data["content"])
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        """Remove deleted messages from the message store."""
+        await database.run(history.delete_messages, [payload.message_id])
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        """Remove deleted messages from the message store."""
+        await database.run(history.delete_messages, payload.message_ids)
+
+    async def on_app_command_error(
+        self,
+        interaction: discord.Interaction,
+        error: app_commands.AppCommandError,  # noqa: ARG002
+    ) -> None:
+        """Let the user know that their command failed."""
+        await interaction.followup.send(
+            "An unknown error has occurred. Please check server logs for more information."
+        )
@@ -1,5 +1,6 @@
-__all__ = ["generate", "hello", "quiz"]
+__all__ = ["generate", "hello", "quiz", "stats"]
 
 from .generate import generate
 from .hello import hello
 from .quiz import quiz
+from .stats import stats
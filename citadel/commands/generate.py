@@ -1,17 +1,19 @@
-import json
+import contextlib
+import time
 from enum import Enum
 
 import discord
 from discord import app_commands, ui
+from sqlalchemy import insert
 from sqlmodel import Session
 
-from citadel import globals, utils
-from citadel.models import Question, Test
+from citadel import catalog, database, dedupe, distractors, generation, globals, history, jobs, similarity, utils
+from citadel.models import Distractor, GenerationJob, Question, Test, hash_content
+from citadel.render import MessageRenderer
 
-NOTES_PROMPT = globals.JINJA.get_template("prompts/NOTES.md")
-EDITOR_CONFIRM_PROMPT = globals.JINJA.get_template("prompts/EDITOR-CONFIRM.md")
-NOTES_CONFIRMATION = globals.JINJA.get_template("messages/NOTES-CONFIRMATION.md")
-NOTES_CONFIRMATION_EDITOR = globals.JINJA.get_template("messages/NOTES-CONFIRMATION-EDITOR.md")
+EDITOR_CONFIRM_PROMPT = globals.get_template("prompts/EDITOR-CONFIRM.md")
+NOTES_CONFIRMATION = globals.get_template("messages/NOTES-CONFIRMATION.md")
+NOTES_CONFIRMATION_EDITOR = globals.get_template("messages/NOTES-CONFIRMATION-EDITOR.md")
 
 
 class ButtonChoice(Enum):
@@ -25,8 +27,11 @@ class ButtonChoice(Enum):
 class Buttons(ui.View):
     """The buttons we show in the test generation message."""
 
-    __button: ButtonChoice | None = None
-    __interaction: discord.Interaction | None = None
+    def __init__(self) -> None:
+        super().__init__()
+        # Shared with any `QuestionEditor` opened from these buttons, so a single queue carries both button clicks and
+        # editor submissions (as `str`s).
+        self.responses: utils.Responses[ButtonChoice | str] = utils.Responses()
 
     async def set_reactive(self, interaction: discord.Interaction, reactive: bool) -> None:  # noqa: FBT001
         """Set if the buttons should be reactive (i.e. they can be clicked."""
@@ -44,8 +49,7 @@ class Buttons(ui.View):
         button: ui.Button,  # type: ignore[type-arg]  # noqa: ARG002
     ) -> None:
         """Handle clicking of the create test button."""
-        self.__interaction = interaction
-        self.__button = ButtonChoice.CREATE
+        self.responses.put(ButtonChoice.CREATE, interaction)
 
     @ui.button(label="Edit Questions", style=discord.ButtonStyle.red)
     async def edit_callback(
@@ -54,8 +58,7 @@ class Buttons(ui.View):
         button: ui.Button,  # type: ignore[type-arg]  # noqa: ARG002
     ) -> None:
         """Handle clicking of the edit questions button."""
-        self.__interaction = interaction
-        self.__button = ButtonChoice.EDIT
+        self.responses.put(ButtonChoice.EDIT, interaction)
 
     @ui.button(label="Cancel", style=discord.ButtonStyle.grey)
     async def cancel_callback(
@@ -64,30 +67,30 @@ class Buttons(ui.View):
         button: ui.Button,  # type: ignore[type-arg]  # noqa: ARG002
     ) -> None:
         """Handle clicking of the cancel button."""
-        self.__interaction = interaction
-        self.__button = ButtonChoice.CANCEL
+        self.responses.put(ButtonChoice.CANCEL, interaction)
+
+    async def on_timeout(self) -> None:
+        """Release the waiting command once the buttons stop being interactive."""
+        self.responses.close()
 
-    def get_resp(self) -> tuple[ButtonChoice, discord.Interaction] | None:
-        """Get the clicked button and it's related interaction. Returns `None` if no button has been clicked."""
-        if self.__button is None or self.__interaction is None:
-            return None
+    async def get_resp(self) -> tuple[ButtonChoice | str, discord.Interaction] | None:
+        """Wait for a button click or editor submission, and get it alongside it's related interaction.
 
-        button = self.__button
-        interaction = self.__interaction
-        self.__button = None
-        self.__interaction = None
-        return (button, interaction)
+        Returns `None` if the buttons timed out before anything was clicked.
+        """
+        return await self.responses.get()
 
 
 class QuestionEditor(ui.Modal, title="Question Editor"):
     """Editor for the AI-generated questions."""
 
-    __done: bool = False
-    __interaction: discord.Interaction | None = None
+    def __init__(self, question_text: str, responses: utils.Responses[ButtonChoice | str]) -> None:
+        """Create the editor UI, pre-filling it with the specified question list.
 
-    def __init__(self, question_text: str) -> None:
-        """Create the editor UI, pre-filling it with the specified question list."""
+        Submissions get sent to `responses`, which should be the queue of the buttons that opened the editor.
+        """
         super().__init__()
+        self.responses = responses
         self.editor = ui.TextInput(
             label="Questions",
             style=discord.TextStyle.paragraph,
@@ -97,18 +100,162 @@ class QuestionEditor(ui.Modal, title="Question Editor"):
 
     async def on_submit(self, interaction: discord.Interaction) -> None:
         """Handle the editor form being submitted."""
-        self.__done = True
-        self.__interaction = interaction
+        self.responses.put(self.editor.value, interaction)
+
+
+def create_test(test_name: str, questions: list[dict[str, str]]) -> int:
+    """Create a test with the given questions, returning the test's ID.
+
+    Near-duplicate questions (such as the same fact phrased slightly differently in two chunks) are only created once.
+    Questions that duplicate one already in the database get a copy of its distractors, so they don't need generating.
+    """
+    unique = similarity.drop_duplicates(questions)
+    if len(unique) != len(questions):
+        globals.LOGGER.info("Dropped %s near-duplicate questions from %r", len(questions) - len(unique), test_name)
+    questions = unique
+
+    with Session(globals.get_sql_engine()) as session:
+        test = Test(name=test_name)
+        session.add(test)
+        # Get the test's ID without committing, so the test and its questions are created in a single transaction.
+        session.flush()
+
+        if test.id is None:
+            raise RuntimeError("Unexpected test without an ID")  # noqa: TRY003,EM101
+
+        # An empty insert would be run as `INSERT ... DEFAULT VALUES`, which the question's columns don't allow.
+        if len(questions) != 0:
+            question_signatures = similarity.signatures([item["question"] for item in questions])
+            # Looked up before the questions are inserted, so they don't just find themselves.
+            copies = dedupe.find_copies(session.connection(), questions, question_signatures)
+
+            question_ids = session.scalars(
+                insert(Question).returning(Question.id, sort_by_parameter_order=True),  # type: ignore[call-overload]
+                [{"question": item["question"], "answer": item["answer"], "test_id": test.id} for item in questions],
+            ).all()
+
+            shared = [index for index, incorrect_answers in enumerate(copies) if incorrect_answers is not None]
+            if len(shared) != 0:
+                session.execute(
+                    insert(Distractor),
+                    [
+                        {
+                            "question_id": question_ids[index],
+                            "content_hash": hash_content(questions[index]["question"], questions[index]["answer"]),
+                            "correct_answer": questions[index]["answer"],
+                            "incorrect_answers": copies[index],
+                        }
+                        for index in shared
+                    ],
+                )
+                # Having distractors now, they can be copied from in turn.
+                dedupe.index_questions(
+                    session.connection(),
+                    [question_ids[index] for index in shared],
+                    question_signatures[shared],
+                )
+                globals.LOGGER.info("Shared distractors with %s existing questions in %r", len(shared), test_name)
+        session.commit()
+        return test.id
+
+
+async def generate_questions(client: discord.Client, job: GenerationJob) -> list[dict[str, str]]:
+    """Generate the questions for a job, showing them on its message as they're generated."""
+    message = jobs.job_message(client, job)
+    renderer = MessageRenderer(message)
+    renderer.update(content=f'Reading the messages for "{job.test_name}" :books:')
+
+    output: list[dict[str, str]] = []
+    try:
+        channel = client.get_partial_messageable(job.channel_id, guild_id=job.guild_id)
+        bot_user = client.user
+        messages = [
+            msg.content
+            for msg in await history.get_history(channel)
+            if not msg.content.startswith("/") and (bot_user is None or msg.author_id != bot_user.id)
+        ]
+
+        async with contextlib.aclosing(generation.stream_questions(messages, job.msg_filter)) as items:
+            async for item in items:
+                output.append(item)
+                renderer.update(
+                    content=NOTES_CONFIRMATION.render(notes=output, test_name=job.test_name, generating=True),
+                )
+    finally:
+        await renderer.close()
+    return output
+
+
+async def confirm_test(client: discord.Client, job: GenerationJob) -> None:  # noqa: C901
+    """Show a job's questions with buttons to create the test, edit its questions, or cancel it."""
+    if job.id is None or job.questions is None:
+        raise RuntimeError("Unexpected job without questions")  # noqa: TRY003,EM101
+    message = jobs.job_message(client, job)
+    test_name = job.test_name
+    output = job.questions
+
+    if len(output) == 0:
+        await message.edit(
+            content=f'No questions could be generated for "{test_name}" :x: Try a different filter, or send more '
+            "notes first.",
+            view=None,
+        )
+        return
+
+    buttons = Buttons()
+    await message.edit(
+        content=NOTES_CONFIRMATION.render(notes=output, test_name=test_name, generating=False),
+        view=buttons,
+    )
 
-    def get_resp(self) -> tuple[str, discord.Interaction] | None:
-        """Get the submitted text from the editor form. Returns `None` if it hasn't been submitted yet."""
-        if not self.__done or self.__interaction is None:
-            return None
-        interaction = self.__interaction
-        self.__done = False
-        self.__interaction = None
+    # The last interaction from clicking one of the buttons. Used to toggle the buttons while processing edits.
+    buttons_interaction: discord.Interaction | None = None
+
+    while True:
+        # Wait until we get a button click or an editor submission. If the user closes out of the editor without
+        # submitting it, we'll just get their next button click instead.
+        resp = await buttons.get_resp()
+        if resp is None:
+            await message.edit(view=None)
+            break
 
-        return (self.editor.value, interaction)
+        match resp:
+            case (ButtonChoice.CREATE, create_interaction) if len(output) == 0:
+                await create_interaction.response.send_message(
+                    "A test needs at least one question. Edit the questions to add some, or cancel.",
+                    ephemeral=True,
+                )
+
+            case (ButtonChoice.CREATE, _):
+                test_id = await database.run(create_test, test_name, output)
+                catalog.CATALOG.add(test_id, test_name)
+                distractors.fill_in_background(test_id)
+
+                await message.edit(content=f'The test for "{test_name}" has been created :pencil:', view=None)
+                break
+
+            case (ButtonChoice.EDIT, buttons_interaction):
+                editor = QuestionEditor(NOTES_CONFIRMATION_EDITOR.render(notes=output), buttons.responses)
+                await buttons_interaction.response.send_modal(editor)
+
+            case (ButtonChoice.CANCEL, _):
+                await message.delete()
+                break
+
+            case (str() as editor_output, editor_interaction):
+                if buttons_interaction is None:
+                    raise RuntimeError("Unexpected editor submission without an edit button click")  # noqa: TRY003,EM101
+                await buttons.set_reactive(buttons_interaction, False)  # noqa: FBT003
+                await message.edit(content="Processing question list...")
+                await editor_interaction.response.defer()
+
+                output = await utils.get_openai_json(EDITOR_CONFIRM_PROMPT.render(question_data=editor_output))
+                # Stored, so the edits aren't lost if the bot restarts before the test is created.
+                await database.run(jobs.store_questions, job.id, output)
+                await message.edit(
+                    content=NOTES_CONFIRMATION.render(notes=output, test_name=test_name, generating=False),
+                )
+                await buttons.set_reactive(buttons_interaction, True)  # noqa: FBT003
 
 
 @app_commands.command()
@@ -117,7 +264,7 @@ class QuestionEditor(ui.Modal, title="Question Editor"):
     '(e.g. "Shakespeare Texts")',
     test_name='The name you want to assign the generated test (e.g. "The Renaissance")',
 )
-async def generate(  # noqa: C901
+async def generate(
     interaction: discord.Interaction,
     msg_filter: str,
     test_name: str,
@@ -125,77 +272,22 @@ async def generate(  # noqa: C901
     """Generate test questions"""  # noqa: D400
     await interaction.response.defer()
 
-    if type(interaction.channel) is not discord.TextChannel:
-        raise RuntimeError("Unexpected channel type")  # noqa: TRY003,EM101
-    messages = [
-        msg.content
-        async for msg in interaction.channel.history()
-        if not msg.content.startswith("/") and interaction.user != interaction.client.user
-    ]
-
-    completion = await utils.get_openai_resp(NOTES_PROMPT.render(messages=messages, msg_filter=msg_filter))
-    output = json.loads(completion)
+    if not isinstance(interaction.channel, discord.TextChannel):
+        raise TypeError("Unexpected channel type")  # noqa: TRY003,EM101
 
-    buttons = Buttons()
+    # Generation happens in the background, so the interaction is done with once the job has been queued.
+    ahead = jobs.QUEUE.waiting + jobs.QUEUE.running
     message = await interaction.followup.send(
-        NOTES_CONFIRMATION.render(notes=output, test_name=test_name),
-        view=buttons,
+        f'The test for "{test_name}" will be generated shortly :hourglass: ({ahead} other tests are being generated)',
         wait=True,
     )
-
-    buttons_resp = None
-    while True:
-        # Wait until we get a button click.
-        while buttons_resp is None:
-            await utils.sleep()
-            buttons_resp = buttons.get_resp()
-
-        # Parse buttons, blah blah we'll add better comments in a bit
-        chosen_button, buttons_interaction = buttons_resp
-        buttons_resp = None
-        if chosen_button == ButtonChoice.CREATE:
-            with Session(globals.get_sql_engine()) as session:
-                test = Test(name=test_name)
-                session.add(test)
-                session.commit()
-
-                for item in output:
-                    question = Question(question=item["question"], answer=item["answer"], test_id=test.id)
-                    session.add(question)
-                session.commit()
-
-            await message.edit(content=f'The test for "{test_name}" has been created :pencil:', view=None)
-
-        elif chosen_button == ButtonChoice.EDIT:
-            editor = QuestionEditor(NOTES_CONFIRMATION_EDITOR.render(notes=output))
-            await buttons_interaction.response.send_modal(editor)
-
-            # Wait until the user clicks submit, or they click a different button (which would happen if they closed
-            # out of the model)
-            editor_resp = None
-            while editor_resp is None:
-                await utils.sleep()
-                buttons_resp = buttons.get_resp()
-
-                # If a new button has been pressed, we need to break the loop so we can process it
-                if buttons_resp is not None:
-                    break
-                editor_resp = editor.get_resp()
-
-            # If a new button was pressed, we need to continue the main `while` loop so we can process it
-            if buttons_resp is not None:
-                continue
-
-            editor_output, editor_interaction = editor_resp
-            await buttons.set_reactive(buttons_interaction, False)  # noqa: FBT003
-            await message.edit(content="Processing question list...")
-            await editor_interaction.response.defer()
-
-            completion = await utils.get_openai_resp(EDITOR_CONFIRM_PROMPT.render(question_data=editor_output))
-            output = json.loads(completion)
-            await message.edit(content=NOTES_CONFIRMATION.render(notes=output, test_name=test_name))
-            await buttons.set_reactive(buttons_interaction, True)  # noqa: FBT003
-
-        elif chosen_button == ButtonChoice.CANCEL:
-            await message.delete()
-            break
+    await jobs.QUEUE.submit(
+        GenerationJob(
+            guild_id=interaction.guild_id,
+            channel_id=interaction.channel.id,
+            message_id=message.id,
+            msg_filter=msg_filter,
+            test_name=test_name,
+            created_at=time.time(),
+        ),
+    )
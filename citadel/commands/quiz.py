@@ -1,29 +1,26 @@
-import json
-import math
+import asyncio
 import random
-from dataclasses import dataclass
+from collections.abc import Coroutine
 from enum import StrEnum
+from typing import Any
 
-import dacite
 import discord
-import sqlmodel
 from discord import app_commands
-from sqlmodel import Session
 
-from citadel import globals, utils
-from citadel.models import Question, Test
+from citadel import analytics, catalog, distractors, globals, governor, timers, utils
+from citadel.game import AnswerOutcome, JoinResult, LeaveResult, Phase, QuizSession, StartResult
+from citadel.render import MessageRenderer
 
-QUIZ_PROMPT = globals.JINJA.get_template("prompts/QUIZ.md")
-QUIZ_PLAYERS = globals.JINJA.get_template("messages/QUIZ-PLAYERS.md")
-QUIZ_QUESTION = globals.JINJA.get_template("messages/QUIZ-QUESTION.md")
-QUIZ_OVERVIEW = globals.JINJA.get_template("messages/QUIZ-OVERVIEW.md")
-QUIZ_RESULTS = globals.JINJA.get_template("messages/QUIZ-RESULTS.md")
+QUIZ_PLAYERS = globals.get_template("messages/QUIZ-PLAYERS.md")
+QUIZ_QUESTION = globals.get_template("messages/QUIZ-QUESTION.md")
+QUIZ_OVERVIEW = globals.get_template("messages/QUIZ-OVERVIEW.md")
+QUIZ_RESULTS = globals.get_template("messages/QUIZ-RESULTS.md")
 
+# The most players to list in the quiz launcher.
+MAX_LISTED_PLAYERS = 20
 
-LOBBY_STARTING_TIME = 10
-QUESTION_TIME = 30
-OVERVIEW_TIME = 10
-MAX_POINTS = 1000
+
+Player = discord.User | discord.Member
 
 
 class TestLauncherButtons(StrEnum):
@@ -34,54 +31,147 @@ class TestLauncherButtons(StrEnum):
     LEAVE = "Leave"
 
 
-@dataclass
-class GameQuestion:
-    """The format for game questions from ChatGPT."""
-
-    question: str
-    incorrect_answers: list[str]
-    correct_answer: str
-
+async def quiz_options(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:  # noqa: ARG001
+    """Filter the autocompletions to any quizzes that start with the user's query."""
+    return [app_commands.Choice(name=name, value=name) for name in await catalog.CATALOG.search(current)]
 
-class PlayerStats:
-    """The stastistics of a player during a quiz session."""
 
-    points = 0
-    correct = 0
+def render_quiz(session: QuizSession[Player], name: str, now: float) -> discord.Embed:  # noqa: PLR0911
+    """Render the embed for the current state of a quiz."""
+    title = f"Quiz Launcher: {name}"
+    match session.phase:
+        case Phase.LOBBY | Phase.ABANDONED:
+            players = session.players
+            listed = [player.display_name for player, _ in zip(players, range(MAX_LISTED_PLAYERS), strict=False)]
+            return discord.Embed(
+                title=title, description=QUIZ_PLAYERS.render(players=listed, players_total=len(players))
+            )
+        case Phase.TIMED_OUT:
+            return discord.Embed(title=title, description="*The quiz launcher timed out.*")
+        case Phase.STARTING:
+            countdown = session.seconds_left(now)
+            return discord.Embed(
+                title=title,
+                description="***Starting quiz in {countdown} {second}...***".format(
+                    countdown=countdown,
+                    second="seconds" if countdown != 1 else "second",
+                ),
+            )
+        case Phase.QUESTION if session.question is not None:
+            return discord.Embed(
+                description=QUIZ_QUESTION.render(
+                    question=session.question.question,
+                    seconds_left=session.seconds_left(now),
+                    players_answered=len(session.answered),
+                    players_total=len(session.leaderboard),
+                ),
+            )
+        case Phase.QUESTION:
+            return discord.Embed(description="*Getting the next question ready...*")
+        case Phase.OVERVIEW if session.question is not None:
+            return discord.Embed(
+                description=QUIZ_OVERVIEW.render(
+                    question_number=session.question_index + 1,
+                    question_total=session.total_questions,
+                    correct_answer=session.question.correct_answer,
+                    leaderboard=session.leaderboard.top(),
+                    seconds=session.seconds_left(now),
+                ),
+            )
+        case _:
+            return discord.Embed(
+                description=QUIZ_RESULTS.render(
+                    leaderboard=session.leaderboard.top(),
+                    question_total=session.total_questions,
+                ),
+            )
 
 
-def generate_leaderboard(
-    game_players: dict[discord.User | discord.Member, PlayerStats],
-) -> list[list[tuple[discord.User | discord.Member, PlayerStats]]]:
-    """Generate the leaderboards from the list of game statistics."""
-    leaderboard: list[list[tuple[discord.User | discord.Member, PlayerStats]]] = [[], [], [], [], []]
-    player_placement = list(game_players.items())
-    player_placement.sort(reverse=True, key=lambda player: player[1].points)
+def handle_launcher_click(
+    session: QuizSession[Player],
+    button: str,
+    interaction: discord.Interaction,
+    now: float,
+) -> Coroutine[Any, Any, Any]:
+    """Apply a click on the quiz launcher's buttons, returning the reply to send for it."""
+    match button:
+        case TestLauncherButtons.START.value:
+            if session.start(interaction.user, now) == StartResult.NOT_HOST:
+                return interaction.response.send_message(
+                    f"Only {session.host.display_name} can start the quiz.",
+                    ephemeral=True,
+                )
+        case TestLauncherButtons.JOIN.value:
+            if session.join(interaction.user) == JoinResult.ALREADY_JOINED:
+                return interaction.response.send_message(
+                    content="You've already joined the quiz. Make sure you're ready to win!",
+                    ephemeral=True,
+                )
+        case TestLauncherButtons.LEAVE.value:
+            if session.leave(interaction.user) == LeaveResult.NOT_JOINED:
+                return interaction.response.send_message(
+                    content="You're not in the quiz right now.",
+                    ephemeral=True,
+                )
+
+    # The launcher gets updated through the renderer, so we only need to acknowledge the click.
+    return interaction.response.defer()
+
+
+def handle_answer(
+    session: QuizSession[Player],
+    button: str,
+    interaction: discord.Interaction,
+    now: float,
+    events: analytics.QuizEvents,
+) -> Coroutine[Any, Any, Any]:
+    """Apply a click on a question's answers, recording it and returning the reply to send for it."""
+    result = session.answer(interaction.user, button, now)
+    if result.outcome in {AnswerOutcome.CORRECT, AnswerOutcome.INCORRECT} and session.question is not None:
+        events.answer(
+            interaction.user.id,
+            session.question.question_id,
+            session.question_index,
+            result.outcome == AnswerOutcome.CORRECT,
+            result.response_time,
+        )
+    guess_position = globals.get_inflect().ordinal(str(result.position))
+    guess_position_phrase = f"You were the {guess_position} person to pick an answer."
 
-    for player in player_placement:
-        for leaderboard_index in range(5):
-            points = [player[1].points for player in leaderboard[leaderboard_index]]
+    match result.outcome:
+        case AnswerOutcome.CORRECT:
+            message = f"You chose correctly :partying_face:! {guess_position_phrase}"
+        case AnswerOutcome.INCORRECT:
+            message = f"You chose incorrectly :pensive:. {guess_position_phrase}"
+        case AnswerOutcome.ALREADY_ANSWERED:
+            message = f'You already submitted your answer of "{result.previous}".'
+        case AnswerOutcome.NOT_PLAYING:
+            message = "You're not in this quiz."
+        case AnswerOutcome.CLOSED:
+            message = "Time's up for this question."
 
-            if len(leaderboard[leaderboard_index]) == 0 or player[1].points in points:
-                leaderboard[leaderboard_index].append(player)
-                break
+    return interaction.response.send_message(message, ephemeral=True)
 
-    return leaderboard
 
+async def send_reply(reply: Coroutine[Any, Any, Any]) -> None:
+    """Send the reply to a click, logging it if it fails (e.g. because the interaction expired).
 
-def get_tests() -> list[Test]:
-    """Get the list of tests in the database."""
-    with Session(globals.SQL_ENGINE) as session:
-        statement = sqlmodel.select(Test)
-        tests = session.exec(statement)
-        return list(tests)
+    One player's reply failing shouldn't end the quiz for everyone, which it would do by failing the task group.
+    """
+    try:
+        await reply
+    except discord.HTTPException:
+        globals.LOGGER.exception("Failed to reply to a quiz click")
 
 
-async def quiz_options(interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:  # noqa: ARG001
-    """Filter the autocompletions to any quizzes that start with the user's query."""
-    return [
-        app_commands.Choice(name=test.name, value=test.name) for test in get_tests() if test.name.startswith(current)
-    ]
+async def wait_for_click(view: utils.Buttons, wakeup: float | None) -> tuple[str, discord.Interaction] | None:
+    """Wait for a click on `view`, or until `wakeup` (on the loop's clock) passes, in which case `None` is returned."""
+    timer = None if wakeup is None else timers.TIMERS.call_at(wakeup, view.responses.wake)
+    try:
+        return await view.get_response()
+    finally:
+        if timer is not None:
+            timer.cancel()
 
 
 @app_commands.command()
@@ -92,191 +182,84 @@ async def quiz(  # noqa: C901,PLR0912,PLR0915
     name: str,
 ) -> None:
     """Compete with friends on knowledge of a test"""  # noqa: D400
-    test = next((test for test in get_tests() if test.name == name), None)
-    if test is None:
+    governor.GUILD.set(interaction.guild_id)
+    test_id = await catalog.CATALOG.get(name)
+    if test_id is None:
         await interaction.response.send_message(f'The test for "{name}" doesn\'t exist.')
         return
+    # Questions get ready in the background while the lobby is open, and each question only waits for its own batch.
+    preparing = asyncio.create_task(distractors.get_game_questions(test_id))
     await interaction.response.defer()
+    test_questions = await preparing
 
-    with Session(globals.SQL_ENGINE) as session:
-        statement = sqlmodel.select(Question).where(Question.test_id == test.id)
-        db_questions = [
-            {"question": question.question, "answer": question.answer} for question in session.exec(statement)
-        ]
-
-    completion = await utils.get_openai_resp(QUIZ_PROMPT.render(questions=json.dumps(db_questions)))
-    test_questions = [dacite.from_dict(data_class=GameQuestion, data=question) for question in json.loads(completion)]
-
-    test_title = f"Quiz Launcher: {name}"
-    players = [interaction.user]
-
-    def render_launcher_waiting() -> discord.Embed:
-        return discord.Embed(
-            title=test_title,
-            description=QUIZ_PLAYERS.render(players=[player.display_name for player in players]),
-        )
-
-    def render_launcher_starting(countdown: int) -> discord.Embed:
-        return discord.Embed(
-            title=test_title,
-            description="***Starting quiz in {countdown} {second}...***".format(
-                countdown=countdown,
-                second="seconds" if countdown != 1 else "second",
-            ),
-        )
-
-    test_buttons = utils.Buttons(
+    # The game itself is run by the session, with this just passing it events and showing its state. Countdowns are
+    # driven by the shared timer wheel, against the session's deadlines.
+    loop = asyncio.get_running_loop()
+    session: QuizSession[Player] = QuizSession(interaction.user, test_questions.total, loop.time())
+    launcher_buttons = utils.Buttons(
         [
             (TestLauncherButtons.START.value, discord.ButtonStyle.primary),
             (TestLauncherButtons.JOIN.value, discord.ButtonStyle.green),
             (TestLauncherButtons.LEAVE.value, discord.ButtonStyle.red),
         ],
+        timeout=None,
     )
-    message = await interaction.followup.send(embed=render_launcher_waiting(), view=test_buttons, wait=True)
-
-    quiz_confirmed = False
-    countdown = LOBBY_STARTING_TIME
-
-    while True:
-        if quiz_confirmed:
-            break
-        await utils.sleep()
-
-        for button, button_interaction in test_buttons.get_responses():
-            match button:
-                case TestLauncherButtons.START.value:
-                    if button_interaction.user != players[0]:
-                        await button_interaction.response.send_message(
-                            f"Only {players[0].display_name} can start the quiz.",
-                            ephemeral=True,
-                        )
-                    else:
-                        await button_interaction.response.edit_message(
-                            embed=render_launcher_starting(countdown),
-                            view=None,
-                        )
-                        quiz_confirmed = True
-                        break
-                case TestLauncherButtons.JOIN.value:
-                    if button_interaction.user in players:
-                        await button_interaction.response.send_message(
-                            content="You've already joined the quiz. Make sure you're ready to win!",
-                            ephemeral=True,
-                        )
-                    else:
-                        players.append(button_interaction.user)
-                        await button_interaction.response.edit_message(embed=render_launcher_waiting())
-                case TestLauncherButtons.LEAVE.value:
-                    if button_interaction.user not in players:
-                        await button_interaction.response.send_message(
-                            content="You're not in the quiz right now.",
-                            ephemeral=True,
-                        )
+    message = await interaction.followup.send(
+        embed=render_quiz(session, name, loop.time()),
+        view=launcher_buttons,
+        wait=True,
+    )
+    view: utils.Buttons | None = launcher_buttons
+    renderer = MessageRenderer(message)
+    events = analytics.QuizEvents(message.id, test_id, interaction.guild_id)
+    shown = (session.phase, session.question_index, session.question is None)
+
+    try:
+        # Replies to clicks are sent in the background, so a burst of clicks doesn't queue up behind each other.
+        async with asyncio.TaskGroup() as replies:
+            while not session.done:
+                wakeup = session.next_wakeup(loop.time())
+
+                if session.phase == Phase.QUESTION and session.question is None:
+                    question = await test_questions.get(session.question_index)
+                    choices = [*question.incorrect_answers, question.correct_answer]
+                    random.shuffle(choices)
+                    session.show_question(question, choices, loop.time())
+                elif view is None:
+                    if wakeup is not None:
+                        await timers.TIMERS.sleep_until(wakeup)
+                    session.tick(loop.time())
+                elif (response := await wait_for_click(view, wakeup)) is None:
+                    session.tick(loop.time())
+                else:
+                    button, button_interaction = response
+                    if session.phase == Phase.LOBBY:
+                        reply = handle_launcher_click(session, button, button_interaction, loop.time())
                     else:
-                        players.remove(button_interaction.user)
-                        await button_interaction.response.defer()
-                        await message.edit(embed=render_launcher_waiting())
-
-                        if len(players) == 0:
-                            await utils.sleep(1)
-
-                            if button_interaction.message is None:
-                                raise RuntimeError("Unexpected empty message")  # noqa: TRY003,EM101
-                            await button_interaction.message.delete()
-                            quiz_confirmed = True
-                            return
-
-    while countdown > 0:
-        await utils.sleep(1)
-        countdown -= 1
-        await message.edit(embed=render_launcher_starting(countdown))
-
-    # Start the game.
-    game_players = {player: PlayerStats() for player in players}
-
-    match len(players):
-        case 1:
-            points = MAX_POINTS
-        case n if n > MAX_POINTS:
-            points = 1
-        case _:
-            points = math.floor(MAX_POINTS / len(players))
-
-    for question_index, question in enumerate(test_questions):
-        answers = question.incorrect_answers
-        answers.append(question.correct_answer)
-        random.shuffle(answers)
+                        reply = handle_answer(session, button, button_interaction, loop.time(), events)
+                    replies.create_task(send_reply(reply))
 
-        question_buttons = utils.Buttons(answers)
-        seconds_left = QUESTION_TIME
-        answered: dict[discord.User | discord.Member, str] = {}
-
-        def render_question() -> discord.Embed:
-            return discord.Embed(
-                description=QUIZ_QUESTION.render(
-                    question=question.question,  # noqa: B023
-                    seconds_left=seconds_left,  # noqa: B023
-                    players_answered=len(answered),  # noqa: B023
-                    players_total=len(players),
-                ),
-            )
-
-        while seconds_left > 0 and len(answered) != len(game_players):
-            for button, button_interaction in question_buttons.get_responses():
-                if button_interaction.user in answered:
-                    await button_interaction.response.send_message(
-                        f'You already submitted your answer of "{answered[button_interaction.user]}".',
-                        ephemeral=True,
-                    )
+                # Swap out the buttons whenever we move on to another phase or question.
+                state = (session.phase, session.question_index, session.question is None)
+                if state == shown:
+                    renderer.update(embed=render_quiz(session, name, loop.time()))
                     continue
 
-                guess_position = globals.INFLECT.ordinal(str(len(answered) + 1))
-                guess_position_phrase = f"You were the {guess_position} person to pick an answer."
-                if button == question.correct_answer:
-                    await button_interaction.response.send_message(
-                        f"You chose correctly :partying_face:! {guess_position_phrase}",
-                        ephemeral=True,
-                    )
-                    game_players[button_interaction.user].points += points * (len(players) - len(answered))
-                    game_players[button_interaction.user].correct += 1
-                else:
-                    await button_interaction.response.send_message(
-                        f"You chose incorrectly :pensive:. {guess_position_phrase}",
-                        ephemeral=True,
-                    )
-
-                answered[button_interaction.user] = button
-                await message.edit(embed=render_question())
-
-            await utils.sleep(1)
-            seconds_left -= 1
-            await message.edit(embed=render_question(), view=question_buttons)
-
-        leaderboard = generate_leaderboard(game_players)
-        countdown = OVERVIEW_TIME
-
-        question_number = question_index + 1
-        if question_number == len(test_questions):
-            await message.edit(
-                embed=discord.Embed(
-                    description=QUIZ_RESULTS.render(leaderboard=leaderboard, question_total=len(test_questions)),
-                ),
-                view=None,
-            )
-            break
-
-        while countdown > 0:
-            await message.edit(
-                embed=discord.Embed(
-                    description=QUIZ_OVERVIEW.render(
-                        question_number=question_index + 1,
-                        question_total=len(test_questions),
-                        correct_answer=question.correct_answer,
-                        leaderboard=leaderboard,
-                        seconds=countdown,
-                    ),
-                ),
-                view=None,
-            )
-            await utils.sleep(1)
-            countdown -= 1
+                shown = state
+                if view is not None:
+                    view.stop()
+                    view = None
+                if session.phase == Phase.QUESTION and session.question is not None:
+                    view = utils.Buttons(session.choices, timeout=None)
+                renderer.update(embed=render_quiz(session, name, loop.time()), view=view)
+    finally:
+        await renderer.close()
+
+    if session.phase == Phase.FINISHED:
+        events.finish(
+            {player.id: stats for player, stats in session.leaderboard.stats.items()},
+            session.total_questions,
+        )
+    if session.phase == Phase.ABANDONED:
+        await timers.TIMERS.sleep_until(loop.time() + 1)
+        await message.delete()
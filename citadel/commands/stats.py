@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+
+import discord
+from discord import app_commands
+
+from citadel import globals, metrics
+
+STATS = globals.get_template("messages/STATS.md")
+
+
+@dataclass
+class HistogramRow:
+    """A summary of a histogram in the stats message."""
+
+    name: str
+    count: int
+    p50: str
+    p99: str
+
+
+@dataclass
+class ValueRow:
+    """The value of a counter or gauge in the stats message."""
+
+    name: str
+    value: str
+
+
+def display_name(metric: metrics.Counter | metrics.Gauge | metrics.Histogram) -> str:
+    """Get the name to show for a metric, without the parts that are the same for every metric."""
+    return metric.name.removeprefix("citadel_").removesuffix("_total").removesuffix("_seconds")
+
+
+def format_seconds(seconds: float) -> str:
+    """Format a duration for the stats message."""
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def render_stats(registry: metrics.Registry) -> str:
+    """Render the stats message for the metrics in a registry."""
+    histograms = []
+    values = []
+    for metric in registry.metrics:
+        match metric:
+            case metrics.Histogram():
+                histograms.append(
+                    HistogramRow(
+                        display_name(metric),
+                        metric.count(),
+                        format_seconds(metric.quantile(0.5)),
+                        format_seconds(metric.quantile(0.99)),
+                    ),
+                )
+                # Backends get a row each too, so a slow one stands out.
+                if "backend" in metric.labels:
+                    position = metric.labels.index("backend")
+                    histograms.extend(
+                        HistogramRow(
+                            f"{display_name(metric)} ({backend})",
+                            metric.count(backend=backend),
+                            format_seconds(metric.quantile(0.5, backend=backend)),
+                            format_seconds(metric.quantile(0.99, backend=backend)),
+                        )
+                        for backend in sorted({labels[position] for labels in metric.series})
+                    )
+            case metrics.Counter():
+                values.append(ValueRow(display_name(metric), f"{metric.total():.0f}"))
+            case metrics.Gauge():
+                values.append(ValueRow(display_name(metric), f"{metric.read():.3g}"))
+    return STATS.render(histograms=histograms, values=values)
+
+
+@app_commands.command()
+@app_commands.guild_only()
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction) -> None:
+    """Show how the bot is performing (for this process, when sharded over several)"""  # noqa: D400
+    await interaction.response.send_message(
+        embed=discord.Embed(title="Citadel Stats", description=render_stats(metrics.REGISTRY)),
+        ephemeral=True,
+    )
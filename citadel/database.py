@@ -0,0 +1,106 @@
+"""Database access that doesn't block the event loop.
+
+SQLite calls are synchronous, so running them directly inside of coroutines stalls everything else on the event loop
+(including the gateway's heartbeats). Instead, database work is run on a small, dedicated thread pool via `run`.
+"""
+
+__all__ = ["create_engine", "ensure_indexes", "run", "setup"]
+
+import asyncio
+import sqlite3
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, ParamSpec, TypeVar
+
+import sqlmodel
+from sqlalchemy import Engine, event
+from sqlmodel import SQLModel
+
+# Imported so every table is registered with `SQLModel.metadata` before `setup` creates them.
+from citadel import defaults, globals, metrics, models  # noqa: F401
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+DB_THREADS = defaults.DB_THREADS
+
+PRAGMAS = {
+    # Let readers keep going while something is being written.
+    "journal_mode": "WAL",
+    # WAL is still crash-safe with this, it just doesn't sync on every commit.
+    "synchronous": "NORMAL",
+    # Wait for locks instead of failing, as writes from other threads (or processes) can briefly hold them.
+    "busy_timeout": "5000",
+    "temp_store": "MEMORY",
+    # In KiB when negative, so 64 MiB.
+    "cache_size": "-65536",
+    "mmap_size": str(256 * 1024 * 1024),
+}
+
+# The executor database work gets run on. Set in `create_engine`.
+EXECUTOR: ThreadPoolExecutor | None = None
+
+
+def set_pragmas(connection: sqlite3.Connection, _connection_record: Any) -> None:  # noqa: ANN401
+    """Configure new SQLite connections."""
+    cursor = connection.cursor()
+    for pragma, value in PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def create_engine(db_path: str, threads: int = DB_THREADS) -> Engine:
+    """Create the engine for the database at `db_path`, along with the thread pool used to access it."""
+    global EXECUTOR  # noqa: PLW0603
+
+    engine = sqlmodel.create_engine(
+        f"sqlite:///{db_path}",
+        # Connections get handed between the pool's threads, though only ever used by one at a time.
+        connect_args={"check_same_thread": False},
+        pool_size=threads,
+    )
+    event.listen(engine, "connect", set_pragmas)
+
+    EXECUTOR = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="citadel-db")
+    return engine
+
+
+def ensure_indexes(engine: Engine) -> None:
+    """Create any indexes that are missing from the database.
+
+    `SQLModel.metadata.create_all` only creates indexes alongside new tables, so this adds ones defined after a table
+    was first created.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+def setup(db_path: str, threads: int = DB_THREADS) -> Engine:
+    """Create the engine for the database at `db_path`, creating any tables and indexes that are missing."""
+    engine = create_engine(db_path, threads)
+    SQLModel.metadata.create_all(engine)
+    ensure_indexes(engine)
+    return engine
+
+
+async def run(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """Run a function that accesses the database on the database thread pool, returning its result."""
+    if EXECUTOR is None:
+        raise NameError(globals.UNINITIALIZED_ERR)
+
+    # Timings are taken on the database thread, but recorded back on the event loop so metrics stay single-threaded.
+    queued = time.perf_counter()
+    started: list[float] = []
+
+    def call() -> T:
+        started.append(time.perf_counter())
+        return func(*args, **kwargs)
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(EXECUTOR, call)
+    finally:
+        if len(started) != 0:
+            metrics.DB_WAIT_SECONDS.observe(started[0] - queued)
+            metrics.DB_QUERY_SECONDS.observe(time.perf_counter() - started[0], getattr(func, "__name__", "unknown"))
@@ -0,0 +1,256 @@
+"""Batch deduplication of the questions in the database.
+
+Near-duplicate questions within a test get deleted (keeping the oldest), along with their distractors, so quizzes
+don't ask the same thing twice. Near-duplicates in different tests are kept, as each test needs its own copy, but they
+share distractors: copies that are missing them (or whose are stale) get them from a copy with fresh ones, so they
+don't cost LLM tokens to generate again.
+
+The band keys of the signatures of questions with distractors are kept in the database (as `QuestionBand`s), so new
+questions can find a near-duplicate to copy distractors from by looking up their own keys, rather than by loading every
+question. Questions are indexed when they get distractors, and deduplicating indexes any that are missing.
+"""
+
+__all__ = ["DedupeStats", "dedupe", "find_copies", "index_questions"]
+
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from citadel import defaults
+
+if TYPE_CHECKING:
+    import numpy as np
+    import numpy.typing as npt
+    from sqlalchemy import Connection, Engine
+
+# The most IDs (or keys) to put in a single statement, keeping under SQLite's limit on query parameters.
+BATCH_SIZE = 1000
+
+
+@dataclass
+class DedupeStats:
+    """Statistics about a deduplication."""
+
+    questions: int = 0
+    deleted: int = 0
+    shared: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def elapsed(self) -> float:
+        """Get how long the deduplication has been running for, in seconds."""
+        return time.perf_counter() - self.started
+
+
+def index_questions(
+    connection: "Connection",
+    question_ids: Sequence[int],
+    question_signatures: "npt.NDArray[np.uint32]",
+) -> None:
+    """Add questions to the index of band keys, given their signatures, skipping any that are already in it."""
+    from sqlalchemy.dialects import sqlite
+
+    from citadel import similarity
+    from citadel.models import QuestionBand
+
+    if len(question_ids) == 0:
+        return
+    keys = similarity.band_keys(question_signatures).tolist()
+    connection.execute(
+        sqlite.insert(QuestionBand).on_conflict_do_nothing(),
+        [
+            {"question_id": question_id, "band": band, "key": key}
+            for question_id, question_keys in zip(question_ids, keys, strict=True)
+            for band, key in enumerate(question_keys)
+        ],
+    )
+
+
+def find_copies(
+    connection: "Connection",
+    questions: Sequence[dict[str, str]],
+    question_signatures: "npt.NDArray[np.uint32]",
+    threshold: float = defaults.SIMILARITY_THRESHOLD,
+) -> list[list[str] | None]:
+    """Find the existing questions with fresh distractors that new questions are near-duplicates of, using the index.
+
+    New questions have `question` and `answer` keys. Returns the incorrect answers of the question each new question
+    duplicates, or `None` for questions that don't duplicate one.
+    """
+    import sqlmodel
+
+    from citadel import similarity
+    from citadel.models import Distractor, Question, QuestionBand, hash_content
+
+    keys = similarity.band_keys(question_signatures).tolist()
+    wanted = {(band, key) for question_keys in keys for band, key in enumerate(question_keys)}
+    # Keys are looked up on their own (which the index covers), and then checked for being in the same band.
+    unique_keys = sorted({key for _, key in wanted})
+    candidates: set[int] = set()
+    for start in range(0, len(unique_keys), BATCH_SIZE):
+        lookup = sqlmodel.select(QuestionBand.question_id, QuestionBand.band, QuestionBand.key).where(
+            QuestionBand.key.in_(unique_keys[start : start + BATCH_SIZE]),  # type: ignore[attr-defined]
+        )
+        candidates.update(row.question_id for row in connection.execute(lookup) if (row.band, row.key) in wanted)
+
+    # Only questions with distractors are worth matching, as that's all that gets copied from them.
+    ordered = sorted(candidates)
+    rows: list[Any] = []
+    for start in range(0, len(ordered), BATCH_SIZE):
+        statement = (
+            sqlmodel.select(
+                Question.question,
+                Question.answer,
+                Distractor.content_hash,
+                Distractor.incorrect_answers,
+            )
+            .join(Distractor, Distractor.question_id == Question.id)  # type: ignore[arg-type]
+            .where(Question.id.in_(ordered[start : start + BATCH_SIZE]))  # type: ignore[union-attr]
+        )
+        rows.extend(connection.execute(statement))
+    fresh = [row for row in rows if row.content_hash == hash_content(row.question, row.answer)]
+    if len(fresh) == 0:
+        return [None] * len(questions)
+
+    # The existing questions come first, so new questions are matched to them (rather than the other way around).
+    duplicates = similarity.find_duplicates(
+        [row.question for row in fresh] + [item["question"] for item in questions],
+        [row.answer for row in fresh] + [item["answer"] for item in questions],
+        None,
+        threshold,
+    )
+    return [
+        list(fresh[duplicate].incorrect_answers) if 0 <= duplicate < len(fresh) else None
+        for duplicate in duplicates[len(fresh) :].tolist()
+    ]
+
+
+def dedupe(
+    engine: "Engine",
+    threshold: float = defaults.SIMILARITY_THRESHOLD,
+    dry_run: bool = False,  # noqa: FBT001,FBT002
+) -> DedupeStats:
+    """Delete near-duplicate questions within each test, and share distractors between near-duplicates across tests.
+
+    With `dry_run`, the stats are worked out without changing anything.
+    """
+    # Imported here, so the CLI only loads the database layer (and NumPy) for the commands that use it.
+    import sqlmodel
+    from sqlalchemy import delete
+    from sqlalchemy.dialects import sqlite
+
+    from citadel import similarity
+    from citadel.models import Distractor, Question, QuestionBand, hash_content
+
+    stats = DedupeStats()
+
+    with engine.connect() as connection:
+        statement = (
+            sqlmodel.select(  # type: ignore[call-overload]
+                Question.id,
+                Question.question,
+                Question.answer,
+                Question.test_id,
+                Distractor.content_hash,
+            )
+            .join(Distractor, Distractor.question_id == Question.id, isouter=True)
+            .order_by(Question.id)
+        )
+        rows = list(connection.execute(statement))
+    stats.questions = len(rows)
+
+    questions = [row.question for row in rows]
+    question_signatures = similarity.signatures(questions)
+    within = similarity.find_duplicates(
+        questions,
+        [row.answer for row in rows],
+        [row.test_id for row in rows],
+        threshold,
+        question_signatures,
+    )
+    deleted = [row.id for row, duplicate in zip(rows, within, strict=True) if duplicate != -1]
+    kept = [row for row, duplicate in zip(rows, within, strict=True) if duplicate == -1]
+    stats.deleted = len(deleted)
+
+    # Group the remaining questions with the copies of them in other tests.
+    across = similarity.find_duplicates(
+        [row.question for row in kept],
+        [row.answer for row in kept],
+        None,
+        threshold,
+        question_signatures[within == -1],
+    )
+    copies: dict[int, list[Any]] = {}
+    for index, original in enumerate(across):
+        if original != -1:
+            copies.setdefault(int(original), [kept[original]]).append(kept[index])
+
+    # The questions missing fresh distractors, and the question with fresh ones to copy them from.
+    targets: list[tuple[Any, str, int]] = []
+    for group in copies.values():
+        hashes = [hash_content(row.question, row.answer) for row in group]
+        fresh = [row for row, content_hash in zip(group, hashes, strict=True) if row.content_hash == content_hash]
+        if len(fresh) != 0:
+            targets.extend(
+                (row, content_hash, fresh[0].id)
+                for row, content_hash in zip(group, hashes, strict=True)
+                if row.content_hash != content_hash
+            )
+
+    incorrect_answers: dict[int, list[str]] = {}
+    with engine.connect() as connection:
+        sources = sorted({target[2] for target in targets})
+        for start in range(0, len(sources), BATCH_SIZE):
+            statement = sqlmodel.select(Distractor.question_id, Distractor.incorrect_answers).where(
+                Distractor.question_id.in_(sources[start : start + BATCH_SIZE]),  # type: ignore[attr-defined]
+            )
+            incorrect_answers.update(connection.execute(statement).tuples().all())
+
+        indexed = set(connection.execute(sqlmodel.select(QuestionBand.question_id).distinct()).scalars())
+    # The kept questions that have fresh distractors (or are about to), which should be in the index.
+    with_distractors = {target[0].id for target in targets} | {
+        row.id for row in kept if row.content_hash == hash_content(row.question, row.answer)
+    }
+    unindexed = [
+        index
+        for index, row in enumerate(rows)
+        if within[index] == -1 and row.id in with_distractors and row.id not in indexed
+    ]
+
+    shared = [
+        {
+            "question_id": row.id,
+            "content_hash": content_hash,
+            "correct_answer": row.answer,
+            "incorrect_answers": incorrect_answers[source],
+        }
+        for row, content_hash, source in targets
+    ]
+    stats.shared = len(shared)
+
+    if dry_run:
+        return stats
+
+    with engine.begin() as connection:
+        for start in range(0, len(deleted), BATCH_SIZE):
+            batch = deleted[start : start + BATCH_SIZE]
+            connection.execute(delete(Distractor).where(Distractor.question_id.in_(batch)))  # type: ignore[attr-defined]
+            connection.execute(delete(QuestionBand).where(QuestionBand.question_id.in_(batch)))  # type: ignore[attr-defined]
+            connection.execute(delete(Question).where(Question.id.in_(batch)))  # type: ignore[union-attr]
+
+        index_questions(connection, [rows[index].id for index in unindexed], question_signatures[unindexed])
+
+        if len(shared) != 0:
+            upsert = sqlite.insert(Distractor)
+            connection.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=["question_id"],
+                    set_={
+                        "content_hash": upsert.excluded.content_hash,
+                        "correct_answer": upsert.excluded.correct_answer,
+                        "incorrect_answers": upsert.excluded.incorrect_answers,
+                    },
+                ),
+                shared,
+            )
+    return stats
@@ -0,0 +1,25 @@
+"""Default settings that the CLI shows in its help, kept free of heavy imports so the CLI can start quickly."""
+
+__all__ = ["DB_THREADS", "GENERATE_WORKERS", "OPENAI_CONCURRENCY", "SIMILARITY_THRESHOLD", "MemoryProfile"]
+
+from enum import Enum
+
+# The default amount of threads to run database work on. SQLite only allows one writer at a time (even with WAL), so
+# there's not much to gain from going higher.
+DB_THREADS = 4
+# The default amount of requests to have in-flight with the OpenAI API at once.
+OPENAI_CONCURRENCY = 8
+# The default amount of tests to generate at once. The governor already shares the OpenAI slots fairly between guilds,
+# so this mostly bounds the channel histories being worked on at once, while still being enough to keep the slots busy.
+GENERATE_WORKERS = 8
+# The estimated Jaccard similarity (of character trigrams) needed for two questions to count as duplicates.
+SIMILARITY_THRESHOLD = 0.8
+
+
+class MemoryProfile(str, Enum):
+    """How much of Discord's state the bot keeps in memory."""
+
+    # discord.py's default intents and caches.
+    DEFAULT = "default"
+    # Only the events the bot uses, without caching guilds, members or messages.
+    LOW = "low"
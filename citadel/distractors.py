@@ -0,0 +1,267 @@
+"""Generation and storage of the incorrect answers (distractors) used in quizzes.
+
+Distractors are stored next to their questions, keyed by a hash of the question's content, so quizzes only need the
+LLM for questions that are new or have changed since their distractors were generated.
+"""
+
+__all__ = ["GameQuestion", "GameQuestions", "fill_in_background", "get_game_questions"]
+
+import asyncio
+import contextlib
+import json
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
+from typing import cast
+
+import dacite
+import sqlmodel
+from sqlmodel import Session
+
+from citadel import database, dedupe, globals, similarity, utils
+from citadel.models import Distractor, Question
+
+QUIZ_PROMPT = globals.get_template("prompts/QUIZ.md")
+
+# How many questions get their distractors generated in each LLM request.
+BATCH_SIZE = 5
+# The most batches to have in-flight with the model at once, for each test.
+MAX_CONCURRENCY = 4
+
+# The background fills that are currently running, keyed by test ID.
+FILLS: dict[int, asyncio.Task[None]] = {}
+# The rows each running fill is generating distractors for, keyed by test ID. Quizzes started during a fill use the
+# same rows, so their batches make the same requests as the fill's, which the completion cache coalesces (or serves,
+# for batches the fill has finished) rather than sending to the model twice.
+FILL_ROWS: dict[int, list[tuple[Question, Distractor | None]]] = {}
+
+
+@dataclass
+class GeneratedDistractors:
+    """The format for a question's incorrect answers from the LLM."""
+
+    # The question's position in the batch, echoed back so the answers get matched to the right question.
+    index: int
+    incorrect_answers: list[str]
+
+
+@dataclass
+class GameQuestion:
+    """A question played in quizzes, with its answers."""
+
+    question: str
+    incorrect_answers: list[str]
+    correct_answer: str
+    # The ID of the stored question this was made from.
+    question_id: int | None = None
+
+
+class GameQuestions:
+    """The questions for a quiz, which can be played while the rest of them are still being generated."""
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.__questions: dict[int, GameQuestion] = {}
+        self.__added = asyncio.Event()
+        self.__error: BaseException | None = None
+        self.__task: asyncio.Task[None] | None = None
+
+    def add(self, index: int, question: GameQuestion) -> None:
+        """Add a question that's finished generating, waking up anyone waiting on it."""
+        self.__questions[index] = question
+        self.__added.set()
+        self.__added = asyncio.Event()
+
+    def fail(self, error: BaseException) -> None:
+        """Mark the questions as failed, so anyone waiting on a question that isn't ready gets the error instead."""
+        self.__error = error
+        self.__added.set()
+
+    async def get(self, index: int) -> GameQuestion:
+        """Get a question, waiting for it to be generated if needed."""
+        while index not in self.__questions:
+            if self.__error is not None:
+                raise self.__error
+            await self.__added.wait()
+        return self.__questions[index]
+
+    def fill_from(self, questions: AsyncGenerator[tuple[int, GameQuestion], None]) -> None:
+        """Start adding questions (along with their index) from `questions` in the background."""
+
+        async def fill() -> None:
+            try:
+                async with contextlib.aclosing(questions):
+                    async for index, question in questions:
+                        self.add(index, question)
+            except Exception as err:  # noqa: BLE001
+                self.fail(err)
+            else:
+                self.fail(RuntimeError("Unexpected missing question"))
+
+        self.__task = asyncio.create_task(fill())
+
+
+def load_rows(test_id: int) -> list[tuple[Question, Distractor | None]]:
+    """Load a test's questions, along with their stored distractors."""
+    with Session(globals.get_sql_engine()) as session:
+        statement = (
+            sqlmodel.select(Question, Distractor)
+            .join(Distractor, Distractor.question_id == Question.id, isouter=True)  # type: ignore[arg-type]
+            .where(Question.test_id == test_id)
+            .order_by(Question.id)  # type: ignore[arg-type]
+        )
+        # Questions without distractors come back with `None` for them, due to the outer join.
+        return cast(list[tuple[Question, Distractor | None]], list(session.exec(statement)))
+
+
+def store_distractor(question: Question, distractor: Distractor) -> None:
+    """Store a question's distractor, replacing any existing ones for it.
+
+    The question gets added to the index of questions with distractors, so near-duplicates of it created later can
+    copy them instead of generating their own.
+    """
+    with Session(globals.get_sql_engine()) as session:
+        session.merge(distractor)
+        dedupe.index_questions(
+            session.connection(),
+            [distractor.question_id],
+            similarity.signatures([question.question]),
+        )
+        session.commit()
+
+
+async def stream_distractors(questions: list[Question]) -> AsyncGenerator[tuple[Question, Distractor], None]:
+    """Generate distractors for the given questions, storing each in the database as soon as it comes in.
+
+    The answers are matched to questions by the index the LLM echoes back, rather than by the order they come in, and
+    the question's own answer is always stored as the correct one.
+    """
+    db_questions = [
+        {"index": index, "question": question.question, "answer": question.answer}
+        for index, question in enumerate(questions)
+    ]
+    remaining = set(range(len(questions)))
+
+    items = utils.stream_openai_json(QUIZ_PROMPT.render(questions=json.dumps(db_questions)))
+    async with contextlib.aclosing(items):
+        async for item in items:
+            generated = dacite.from_dict(data_class=GeneratedDistractors, data=item)
+            if generated.index not in remaining:
+                raise RuntimeError("Unexpected question from OpenAI")  # noqa: TRY003,EM101
+            question = questions[generated.index]
+            if question.id is None:
+                raise RuntimeError("Unexpected question without an ID")  # noqa: TRY003,EM101
+
+            distractor = Distractor(
+                question_id=question.id,
+                content_hash=question.content_hash(),
+                correct_answer=question.answer,
+                incorrect_answers=generated.incorrect_answers,
+            )
+            await database.run(store_distractor, question, distractor)
+
+            remaining.remove(generated.index)
+            yield question, distractor
+
+    if len(remaining) != 0:
+        raise RuntimeError("Unexpected amount of questions from OpenAI")  # noqa: TRY003,EM101
+
+
+def to_game_question(question: Question, distractor: Distractor) -> GameQuestion:
+    """Get the quiz question for a question and its distractors."""
+    return GameQuestion(
+        question=question.question,
+        incorrect_answers=list(distractor.incorrect_answers),
+        correct_answer=distractor.correct_answer,
+        question_id=question.id,
+    )
+
+
+async def stream_game_questions(
+    rows: list[tuple[Question, Distractor | None]],
+) -> AsyncGenerator[tuple[int, GameQuestion], None]:
+    """Get the quiz questions for a test's questions (as returned by `load_rows`), along with their index in the quiz.
+
+    Stored distractors are used where they're still fresh, and the LLM is only called for questions that are missing
+    them (or whose content has changed since they were generated). Questions with fresh distractors come first. The
+    rest are split into batches that are generated concurrently, so a question is ready as soon as its own batch gets
+    to it, rather than after every question before it.
+    """
+    stale = []
+    index = 0
+
+    for question, distractor in rows:
+        if distractor is None or distractor.content_hash != question.content_hash():
+            stale.append(question)
+        else:
+            yield index, to_game_question(question, distractor)
+            index += 1
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # The questions generated by each batch, with `None` marking the end of a batch.
+    results: asyncio.Queue[tuple[int, GameQuestion] | None] = asyncio.Queue()
+
+    async def generate_batch(offset: int, batch: list[Question]) -> None:
+        try:
+            # Batches wait for the semaphore in order, so the earliest questions get generated first.
+            async with semaphore, contextlib.aclosing(stream_distractors(batch)) as distractors:
+                position = offset
+                async for question, distractor in distractors:
+                    await results.put((position, to_game_question(question, distractor)))
+                    position += 1
+        finally:
+            await results.put(None)
+
+    tasks = [
+        asyncio.create_task(generate_batch(index + start, stale[start : start + BATCH_SIZE]))
+        for start in range(0, len(stale), BATCH_SIZE)
+    ]
+    remaining = len(tasks)
+
+    try:
+        while remaining != 0:
+            item = await results.get()
+            if item is None:
+                remaining -= 1
+            else:
+                yield item
+
+        # Raise any errors from the batches.
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_game_questions(test_id: int) -> GameQuestions:
+    """Get the quiz questions for a test, which get generated in the background while the quiz is played.
+
+    This returns as soon as the test's questions are loaded, with each question only waiting on its own batch. If a
+    background fill of the test's distractors is running, its batches are shared rather than waited on as a whole.
+    """
+    rows = FILL_ROWS.get(test_id)
+    if rows is None:
+        rows = await database.run(load_rows, test_id)
+
+    game_questions = GameQuestions(len(rows))
+    game_questions.fill_from(stream_game_questions(rows))
+    return game_questions
+
+
+async def fill(test_id: int) -> None:
+    """Generate any missing distractors for a test, logging (instead of raising) any errors."""
+    try:
+        rows = FILL_ROWS[test_id] = await database.run(load_rows, test_id)
+        async with contextlib.aclosing(stream_game_questions(rows)) as questions:
+            async for _ in questions:
+                pass
+    except Exception:  # noqa: BLE001
+        globals.LOGGER.exception("Failed to generate distractors for test %s", test_id)
+    finally:
+        FILLS.pop(test_id, None)
+        FILL_ROWS.pop(test_id, None)
+
+
+def fill_in_background(test_id: int) -> None:
+    """Start generating the distractors for a test in the background, so they're ready when a quiz starts."""
+    if test_id not in FILLS:
+        FILLS[test_id] = asyncio.create_task(fill(test_id))
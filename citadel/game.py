@@ -0,0 +1,246 @@
+"""The rules of a quiz, as a state machine that doesn't do any I/O.
+
+A `QuizSession` is driven by events (players joining, starting the quiz, answering, and the clock passing deadlines),
+with the current time passed in to each of them. Deadlines are absolute times on a monotonic clock, so how long it
+takes to show anything to players never shifts them.
+"""
+
+__all__ = ["AnswerOutcome", "AnswerResult", "JoinResult", "LeaveResult", "Phase", "QuizSession", "StartResult"]
+
+import math
+from collections.abc import Hashable
+from dataclasses import dataclass
+from enum import Enum, auto
+from typing import Generic, TypeVar
+
+from citadel.distractors import GameQuestion
+from citadel.leaderboard import Leaderboard
+
+P = TypeVar("P", bound=Hashable)
+
+# How long the lobby stays open for without the quiz being started, in seconds.
+LOBBY_TIME = 180
+LOBBY_STARTING_TIME = 10
+QUESTION_TIME = 30
+OVERVIEW_TIME = 10
+MAX_POINTS = 1000
+
+
+class Phase(Enum):
+    """The phases a quiz goes through."""
+
+    # Waiting for players to join, and for the host to start the quiz.
+    LOBBY = auto()
+    # Counting down to the first question.
+    STARTING = auto()
+    # Showing a question, or waiting for it to be given with `show_question` if `QuizSession.question` is `None`.
+    QUESTION = auto()
+    # Showing the correct answer and the leaderboard.
+    OVERVIEW = auto()
+    FINISHED = auto()
+    # Everyone left the lobby.
+    ABANDONED = auto()
+    # The lobby wasn't started in time.
+    TIMED_OUT = auto()
+
+
+class JoinResult(Enum):
+    """The result of a player trying to join the quiz."""
+
+    JOINED = auto()
+    ALREADY_JOINED = auto()
+    CLOSED = auto()
+
+
+class LeaveResult(Enum):
+    """The result of a player trying to leave the quiz."""
+
+    LEFT = auto()
+    NOT_JOINED = auto()
+    CLOSED = auto()
+
+
+class StartResult(Enum):
+    """The result of a player trying to start the quiz."""
+
+    STARTED = auto()
+    NOT_HOST = auto()
+    CLOSED = auto()
+
+
+class AnswerOutcome(Enum):
+    """The outcome of a player answering a question."""
+
+    CORRECT = auto()
+    INCORRECT = auto()
+    ALREADY_ANSWERED = auto()
+    NOT_PLAYING = auto()
+    CLOSED = auto()
+
+
+@dataclass
+class AnswerResult:
+    """The result of a player answering a question."""
+
+    outcome: AnswerOutcome
+    # How many players answered before this one (including this one), if the answer was accepted.
+    position: int = 0
+    # The answer the player already gave, if they'd already answered.
+    previous: str | None = None
+    # How long the player took to answer since the question was shown, in seconds, if the answer was accepted.
+    response_time: float = 0.0
+
+
+class QuizSession(Generic[P]):
+    """The state of a single quiz."""
+
+    def __init__(self, host: P, total_questions: int, now: float) -> None:
+        self.total_questions = total_questions
+        # Used as an ordered set, with the first player being the one who can start the quiz.
+        self.players: dict[P, None] = {host: None}
+        self.phase = Phase.LOBBY
+        # When the current phase ends, on the same clock as the times passed in.
+        self.deadline: float | None = now + LOBBY_TIME
+        self.leaderboard: Leaderboard[P] = Leaderboard([])
+        self.question_index = 0
+        self.question: GameQuestion | None = None
+        self.choices: list[str] = []
+        # When the current question was shown, on the same clock as the times passed in.
+        self.shown_at = now
+        # The answers given to the current question, by player.
+        self.answered: dict[P, str] = {}
+        self.points = MAX_POINTS
+
+    @property
+    def host(self) -> P:
+        """The player who can start the quiz."""
+        return next(iter(self.players))
+
+    @property
+    def done(self) -> bool:
+        """Whether the quiz is over, either by finishing or by never being started."""
+        return self.phase in {Phase.FINISHED, Phase.ABANDONED, Phase.TIMED_OUT}
+
+    @property
+    def last_question(self) -> bool:
+        """Whether the current question is the last one."""
+        return self.question_index + 1 >= self.total_questions
+
+    def seconds_left(self, now: float) -> int:
+        """Get the amount of whole seconds left until the current phase's deadline (rounded up)."""
+        if self.deadline is None:
+            return 0
+        return max(math.ceil(self.deadline - now), 0)
+
+    def next_wakeup(self, now: float) -> float | None:
+        """Get when the session next needs a `tick`: when `seconds_left` next changes, or `None` if it's waiting."""
+        if self.deadline is None or self.done:
+            return None
+        if self.phase == Phase.LOBBY:
+            return self.deadline
+        return self.deadline - max(self.seconds_left(now) - 1, 0)
+
+    def join(self, player: P) -> JoinResult:
+        """Add a player to the lobby."""
+        if self.phase != Phase.LOBBY:
+            return JoinResult.CLOSED
+        if player in self.players:
+            return JoinResult.ALREADY_JOINED
+        self.players[player] = None
+        return JoinResult.JOINED
+
+    def leave(self, player: P) -> LeaveResult:
+        """Remove a player from the lobby, abandoning the quiz if nobody is left."""
+        if self.phase != Phase.LOBBY:
+            return LeaveResult.CLOSED
+        if player not in self.players:
+            return LeaveResult.NOT_JOINED
+
+        del self.players[player]
+        if len(self.players) == 0:
+            self.phase = Phase.ABANDONED
+            self.deadline = None
+        return LeaveResult.LEFT
+
+    def start(self, player: P, now: float) -> StartResult:
+        """Start counting down to the first question, if `player` is the host."""
+        if self.phase != Phase.LOBBY:
+            return StartResult.CLOSED
+        if player != self.host:
+            return StartResult.NOT_HOST
+
+        self.leaderboard = Leaderboard(self.players)
+        match len(self.players):
+            case 1:
+                self.points = MAX_POINTS
+            case n if n > MAX_POINTS:
+                self.points = 1
+            case n:
+                self.points = math.floor(MAX_POINTS / n)
+
+        self.phase = Phase.STARTING
+        self.deadline = now + LOBBY_STARTING_TIME
+        if self.total_questions == 0:
+            self.phase = Phase.FINISHED
+            self.deadline = None
+        return StartResult.STARTED
+
+    def show_question(self, question: GameQuestion, choices: list[str], now: float) -> None:
+        """Show the current question (once it's available), starting its countdown."""
+        self.question = question
+        self.choices = choices
+        self.answered = {}
+        self.shown_at = now
+        self.deadline = now + QUESTION_TIME
+
+    def answer(self, player: P, choice: str, now: float) -> AnswerResult:
+        """Record a player's answer to the current question."""
+        self.tick(now)
+        if self.phase != Phase.QUESTION or self.question is None:
+            return AnswerResult(AnswerOutcome.CLOSED)
+        if player not in self.leaderboard:
+            return AnswerResult(AnswerOutcome.NOT_PLAYING)
+        if player in self.answered:
+            return AnswerResult(AnswerOutcome.ALREADY_ANSWERED, previous=self.answered[player])
+
+        correct = choice == self.question.correct_answer
+        if correct:
+            self.leaderboard.score(player, self.points * (len(self.leaderboard) - len(self.answered)))
+        self.answered[player] = choice
+        outcome = AnswerOutcome.CORRECT if correct else AnswerOutcome.INCORRECT
+        result = AnswerResult(outcome, position=len(self.answered), response_time=now - self.shown_at)
+
+        # Move on as soon as everyone has answered.
+        if len(self.answered) == len(self.leaderboard):
+            self.end_question(now)
+        return result
+
+    def end_question(self, ended_at: float) -> None:
+        """End the current question, moving on to its overview (or the results, if it was the last one)."""
+        if self.last_question:
+            self.phase = Phase.FINISHED
+            self.deadline = None
+        else:
+            self.phase = Phase.OVERVIEW
+            self.deadline = ended_at + OVERVIEW_TIME
+
+    def tick(self, now: float) -> None:
+        """Move on from any phases whose deadlines have passed."""
+        while self.deadline is not None and now >= self.deadline:
+            match self.phase:
+                case Phase.LOBBY:
+                    self.phase = Phase.TIMED_OUT
+                    self.deadline = None
+                case Phase.STARTING:
+                    self.phase = Phase.QUESTION
+                    self.deadline = None
+                case Phase.QUESTION:
+                    # Measured from the deadline rather than `now`, so being late to notice doesn't stretch things.
+                    self.end_question(self.deadline)
+                case Phase.OVERVIEW:
+                    self.question_index += 1
+                    self.question = None
+                    self.phase = Phase.QUESTION
+                    self.deadline = None
+                case _:
+                    self.deadline = None
@@ -0,0 +1,121 @@
+"""Generation of test questions from channel messages.
+
+Channel histories can easily be larger than a model's context, so messages are split into token-budgeted chunks that
+are sent to the model concurrently (map), with the resulting questions then being merged and deduplicated (reduce).
+Large histories are first narrowed down to the messages most relevant to the test's filter (see `citadel.relevance`),
+so irrelevant messages don't cost tokens.
+"""
+
+__all__ = ["chunk_messages", "stream_questions"]
+
+import asyncio
+import contextlib
+import re
+from collections.abc import AsyncGenerator, Sequence
+
+from citadel import globals, metrics, relevance, utils
+
+NOTES_PROMPT = globals.get_template("prompts/NOTES.md")
+
+# The amount of tokens (including the prompt itself) to send to the model in each chunk.
+CHUNK_TOKENS = 6000
+# The most tokens of messages to send to the model for a test, over every chunk.
+MESSAGE_TOKENS = 24000
+# The most chunks to have in-flight with the model at once.
+MAX_CONCURRENCY = 4
+
+
+def chunk_messages(messages: Sequence[str], budget: int) -> list[list[str]]:
+    """Split messages into consecutive chunks, each estimated to fit inside of `budget` tokens.
+
+    Messages that don't fit in the budget on their own get a chunk to themselves.
+    """
+    chunks: list[list[str]] = []
+    chunk: list[str] = []
+    chunk_tokens = 0
+
+    for msg in messages:
+        tokens = utils.estimate_tokens(msg)
+        if len(chunk) != 0 and chunk_tokens + tokens > budget:
+            chunks.append(chunk)
+            chunk = []
+            chunk_tokens = 0
+        chunk.append(msg)
+        chunk_tokens += tokens
+
+    if len(chunk) != 0:
+        chunks.append(chunk)
+    return chunks
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings (casing, spacing, punctuation) compare equal."""
+    return " ".join(re.sub(r"[^\w\s]", "", question.casefold()).split())
+
+
+def render_prompts(messages: Sequence[str], msg_filter: str) -> tuple[list[str], int]:
+    """Render the prompts for each chunk of the messages most relevant to the message filter.
+
+    Returns the prompts, along with the amount of tokens saved by leaving out the irrelevant messages. This ranks and
+    renders every message, so it's best run in a thread for large histories.
+    """
+    selection = relevance.select_messages(messages, msg_filter, MESSAGE_TOKENS)
+    globals.LOGGER.info(
+        "Kept %s of %s messages relevant to %r, saving %s of %s tokens",
+        len(selection.messages),
+        len(messages),
+        msg_filter,
+        selection.saved_tokens,
+        selection.total_tokens,
+    )
+    messages = selection.messages
+
+    prompt_tokens = utils.estimate_tokens(NOTES_PROMPT.render(messages=[], msg_filter=msg_filter))
+    chunks = chunk_messages(messages, max(CHUNK_TOKENS - prompt_tokens, 1))
+    globals.LOGGER.debug("Generating questions from %s messages in %s chunks", len(messages), len(chunks))
+    return [NOTES_PROMPT.render(messages=chunk, msg_filter=msg_filter) for chunk in chunks], selection.saved_tokens
+
+
+async def stream_questions(messages: Sequence[str], msg_filter: str) -> AsyncGenerator[dict[str, str], None]:
+    """Generate test questions from channel messages, matching the given message filter.
+
+    Questions are yielded as soon as the model outputs them, from whichever chunk produces them first. Duplicates of
+    already yielded questions are dropped, so a question asked by several chunks keeps the answer that came first,
+    rather than the one from the most recent messages.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # The questions generated by each chunk, with `None` marking the end of a chunk.
+    results: asyncio.Queue[dict[str, str] | None] = asyncio.Queue()
+
+    async def generate_chunk(prompt: str) -> None:
+        try:
+            async with semaphore, contextlib.aclosing(utils.stream_openai_json(prompt)) as items:
+                async for item in items:
+                    await results.put(item)
+        finally:
+            await results.put(None)
+
+    prompts, saved_tokens = await asyncio.to_thread(render_prompts, messages, msg_filter)
+    # Recorded back on the event loop, so metrics stay single-threaded.
+    metrics.PREFILTER_SAVED_TOKENS.inc(amount=saved_tokens)
+    tasks = [asyncio.create_task(generate_chunk(prompt)) for prompt in prompts]
+    seen = set()
+    remaining = len(tasks)
+
+    try:
+        while remaining != 0:
+            item = await results.get()
+            if item is None:
+                remaining -= 1
+                continue
+
+            key = normalize_question(item["question"])
+            if key not in seen:
+                seen.add(key)
+                yield {"question": item["question"], "answer": item["answer"]}
+
+        # Raise any errors from the chunks.
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
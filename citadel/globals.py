@@ -1,15 +1,33 @@
-"""Global values that can be used throughout the program."""
+"""Global values that can be used throughout the program.
 
+Values that are slow to set up (the inflect engine, and the Jinja environment with its compiled templates) are only
+created the first time they're used, so CLI commands that don't need them (such as `citadel --help`) start quickly.
+"""
+
+import functools
 import logging
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
-import inflect
-from jinja2 import Environment, FileSystemLoader, StrictUndefined
-from openai import AsyncOpenAI
 from rich.logging import RichHandler
-from sqlalchemy import Engine
 
-_all_ = ["LOGGER", "INFLECT", "JINJA", "get_openai_client", "get_openai_model", "get_sql_engine"]
+if TYPE_CHECKING:
+    import inflect
+    from jinja2 import Environment, Template
+    from sqlalchemy import Engine
+
+    from citadel.backends import BackendPool
+
+_all_ = [
+    "LOGGER",
+    "LazyTemplate",
+    "compile_templates",
+    "get_inflect",
+    "get_jinja",
+    "get_openai_pool",
+    "get_sql_engine",
+    "get_template",
+]
 
 # Logger
 logging.basicConfig(
@@ -19,35 +37,27 @@ logging.basicConfig(
 )
 LOGGER = logging.getLogger("rich")
 
-# OpenAI client
+# OpenAI backends
 #
-# The API key and model name get set in `main::main`
-OPENAI_CLIENT: AsyncOpenAI | None = None
-OPENAI_MODEL: str | None = None
+# The API key, endpoints and models get set in `main::main`
+OPENAI_POOL: "BackendPool | None" = None
 UNINITIALIZED_ERR = "Variable hasn't been initalized yet"
 
 
-def get_openai_client() -> AsyncOpenAI:
-    """Get the global OpenAI client."""
-    if OPENAI_CLIENT is None:
-        raise NameError(UNINITIALIZED_ERR)
-    return OPENAI_CLIENT
-
-
-def get_openai_model() -> str:
-    """Get the global OpenAI model."""
-    if OPENAI_MODEL is None:
+def get_openai_pool() -> "BackendPool":
+    """Get the global pool of OpenAI backends."""
+    if OPENAI_POOL is None:
         raise NameError(UNINITIALIZED_ERR)
-    return OPENAI_MODEL
+    return OPENAI_POOL
 
 
 # SQLModel engine
 #
 # The engine gets set in `main::main`
-SQL_ENGINE: Engine | None = None
+SQL_ENGINE: "Engine | None" = None
 
 
-def get_sql_engine() -> Engine:
+def get_sql_engine() -> "Engine":
     """Get the global SQLAlchemy engine."""
     if SQL_ENGINE is None:
         raise NameError(UNINITIALIZED_ERR)
@@ -56,7 +66,57 @@ def get_sql_engine() -> Engine:
 
 # Jinja2
 TEMPLATE_PATH = Path(__file__).parent / "templates"
-JINJA = Environment(loader=FileSystemLoader(TEMPLATE_PATH), undefined=StrictUndefined)  # noqa: S701
+
+
+@functools.cache
+def get_jinja() -> "Environment":
+    """Get the Jinja environment for the templates in `TEMPLATE_PATH`.
+
+    Compiled templates are kept in a bytecode cache (in the system's temporary directory), so after the first run they
+    don't need compiling again. Templates aren't checked for changes once loaded, as they only change between releases.
+    """
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, StrictUndefined
+
+    return Environment(  # noqa: S701
+        loader=FileSystemLoader(TEMPLATE_PATH),
+        undefined=StrictUndefined,
+        bytecode_cache=FileSystemBytecodeCache(),
+        auto_reload=False,
+    )
+
+
+class LazyTemplate:
+    """A template that only gets loaded (and compiled, if it isn't in the bytecode cache) when it's first rendered."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.__template: Template | None = None
+
+    def render(self, *args: Any, **kwargs: Any) -> str:  # noqa: ANN401
+        """Render the template, taking the same arguments as `jinja2.Template.render`."""
+        if self.__template is None:
+            self.__template = get_jinja().get_template(self.name)
+        return self.__template.render(*args, **kwargs)
+
+
+def get_template(name: str) -> LazyTemplate:
+    """Get a template by its path in `TEMPLATE_PATH`, to be loaded the first time it's rendered."""
+    return LazyTemplate(name)
+
+
+def compile_templates() -> int:
+    """Load every template, compiling any that aren't in the bytecode cache yet, and return how many there are."""
+    jinja = get_jinja()
+    names = jinja.list_templates()
+    for name in names:
+        jinja.get_template(name)
+    return len(names)
+
 
 # Inflect
-INFLECT = inflect.engine()
+@functools.cache
+def get_inflect() -> "inflect.engine":
+    """Get the inflect engine, which takes a few seconds to import."""
+    import inflect
+
+    return inflect.engine()
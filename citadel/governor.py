@@ -0,0 +1,201 @@
+"""Client-side concurrency control and rate limiting for requests to the OpenAI API.
+
+Every request goes through the `RequestGovernor`, which:
+- Caps the amount of requests in-flight, handing out free slots round-robin between guilds so a busy guild can't
+  starve the others.
+- Keeps request and token buckets that are corrected from the API's rate limit headers, waiting for them to refill
+  instead of sending requests that would just get a 429.
+- Retries failed requests with jittered exponential backoff, until a deadline passes.
+"""
+
+__all__ = ["GOVERNOR", "GUILD", "FairSemaphore", "RequestGovernor"]
+
+import asyncio
+import random
+import re
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import TypeVar
+
+import httpx
+import openai
+from openai._legacy_response import LegacyAPIResponse
+
+from citadel import defaults, globals, metrics
+
+T = TypeVar("T")
+
+# The guild that requests are currently being made for. Set by commands, and inherited by any tasks they start.
+GUILD: ContextVar[int | None] = ContextVar("GUILD", default=None)
+
+MAX_CONCURRENCY = defaults.OPENAI_CONCURRENCY
+# How long to keep retrying a request for, in seconds.
+DEADLINE = 120.0
+# The base and maximum delays between retries, in seconds.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+# The amount of tokens we expect a completion to output, counted against the token bucket alongside the prompt.
+EXPECTED_OUTPUT_TOKENS = 1000
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(duration: str) -> float | None:
+    """Parse a duration in the format used by OpenAI's rate limit headers (e.g. `6m0s` or `20ms`) into seconds."""
+    parts = DURATION_PART.findall(duration)
+    if len(parts) == 0:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class FairSemaphore:
+    """A semaphore that hands out free slots round-robin between keys, instead of in arrival order."""
+
+    def __init__(self, value: int) -> None:
+        self.value = value
+        self.__waiters: OrderedDict[int | None, deque[asyncio.Future[None]]] = OrderedDict()
+
+    async def acquire(self, key: int | None) -> None:
+        """Wait for a free slot, queueing behind other requests with the same key."""
+        if self.value > 0 and len(self.__waiters) == 0:
+            self.value -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.__waiters.setdefault(key, deque()).append(future)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We got the slot just as we were cancelled, so pass it on.
+                self.release()
+            else:
+                waiters = self.__waiters.get(key)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if len(waiters) == 0:
+                        del self.__waiters[key]
+            raise
+
+    def release(self) -> None:
+        """Release a slot, giving it to the next key in line that's waiting for one."""
+        while len(self.__waiters) != 0:
+            key, waiters = next(iter(self.__waiters.items()))
+            future = waiters.popleft()
+
+            # Move the key to the back of the line, so every other key gets a turn first.
+            if len(waiters) == 0:
+                del self.__waiters[key]
+            else:
+                self.__waiters.move_to_end(key)
+
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.value += 1
+
+
+class Bucket:
+    """A rate limit bucket (i.e. requests or tokens per minute), kept in sync with the API's rate limit headers."""
+
+    def __init__(self) -> None:
+        # These are unknown until we get our first response.
+        self.remaining: float | None = None
+        self.reset_at = 0.0
+
+    def update(self, remaining: str | None, reset: str | None) -> None:
+        """Update the bucket from the remaining amount and reset duration given in a response's headers."""
+        loop = asyncio.get_running_loop()
+        if remaining is not None and remaining.isdigit():
+            self.remaining = float(remaining)
+        if reset is not None and (seconds := parse_duration(reset)) is not None:
+            self.reset_at = loop.time() + seconds
+
+    def delay(self, amount: float) -> float:
+        """Get how long to wait before `amount` can be taken from the bucket."""
+        now = asyncio.get_running_loop().time()
+        if self.remaining is None or now >= self.reset_at or self.remaining >= amount:
+            return 0.0
+        return self.reset_at - now
+
+    def take(self, amount: float) -> None:
+        """Take `amount` out of the bucket."""
+        if self.remaining is not None:
+            self.remaining = max(self.remaining - amount, 0)
+
+
+class RequestGovernor:
+    """Governs the requests made to the OpenAI API."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, deadline: float = DEADLINE) -> None:
+        self.deadline = deadline
+        self.semaphore = FairSemaphore(max_concurrency)
+        self.requests = Bucket()
+        self.tokens = Bucket()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the request slots, for the guild in `GUILD`."""
+        await self.semaphore.acquire(GUILD.get())
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+    def update(self, headers: httpx.Headers) -> None:
+        """Update the rate limit buckets from a response's headers."""
+        self.requests.update(headers.get("x-ratelimit-remaining-requests"), headers.get("x-ratelimit-reset-requests"))
+        self.tokens.update(headers.get("x-ratelimit-remaining-tokens"), headers.get("x-ratelimit-reset-tokens"))
+
+    async def request(self, prompt_tokens: int, call: Callable[[], Awaitable[LegacyAPIResponse[T]]]) -> T:
+        """Make a request, waiting for room in the rate limit buckets and retrying it if it fails.
+
+        Callers should be holding a `slot` while making the request.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        tokens = prompt_tokens + EXPECTED_OUTPUT_TOKENS
+        attempt = 0
+
+        while True:
+            # Wait for the buckets to refill, if we know they're empty.
+            delay = max(self.requests.delay(1), self.tokens.delay(tokens))
+            if delay > 0:
+                globals.LOGGER.debug("Waiting %.2fs for OpenAI rate limits to reset", delay)
+                await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            self.requests.take(1)
+            self.tokens.take(tokens)
+
+            retry_after = None
+            try:
+                response = await call()
+            except openai.APIStatusError as err:
+                self.update(err.response.headers)
+                if not isinstance(err, openai.RateLimitError | openai.InternalServerError):
+                    raise
+                error: openai.APIError = err
+                retry_after = parse_duration(err.response.headers.get("retry-after", "") + "s")
+            except openai.APIConnectionError as err:
+                error = err
+            else:
+                self.update(response.headers)
+                return response.parse()
+
+            # Back off with full jitter, though never for less than the server asked us to.
+            backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))  # noqa: S311
+            backoff = max(backoff, retry_after or 0)
+            attempt += 1
+
+            if loop.time() + backoff > deadline:
+                raise error
+            globals.LOGGER.warning("OpenAI request failed (%s), retrying in %.2fs", type(error).__name__, backoff)
+            metrics.OPENAI_RETRIES.inc(type(error).__name__)
+            await asyncio.sleep(backoff)
+
+
+GOVERNOR = RequestGovernor()
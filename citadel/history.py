@@ -0,0 +1,108 @@
+"""A local store of channel messages.
+
+Each channel has a watermark recording the newest message we've stored from it, so only messages sent after it need to
+be fetched from Discord. Edits and deletions are picked up from gateway events, and a retention policy caps how many
+messages are kept for each channel.
+"""
+
+__all__ = ["delete_messages", "edit_message", "get_history"]
+
+import datetime
+from collections.abc import Iterable
+
+import discord
+import sqlmodel
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import sqlite
+from sqlmodel import Session
+
+from citadel import database, globals
+from citadel.models import ChannelMessage, ChannelWatermark
+
+# The most messages to keep for each channel. Older messages get removed once a channel goes above this.
+MAX_MESSAGES_PER_CHANNEL = 10_000
+# How long to keep messages for.
+MAX_MESSAGE_AGE = datetime.timedelta(days=365)
+
+
+def compact(session: Session, channel_id: int) -> None:
+    """Remove the messages in a channel that fall outside of the retention policy."""
+    # Snowflakes start with their creation timestamp, so message age can be checked from the ID alone.
+    cutoff = discord.utils.time_snowflake(discord.utils.utcnow() - MAX_MESSAGE_AGE)
+
+    statement = (
+        sqlmodel.select(ChannelMessage.id)
+        .where(ChannelMessage.channel_id == channel_id)
+        .order_by(ChannelMessage.id.desc())  # type: ignore[attr-defined]
+        .offset(MAX_MESSAGES_PER_CHANNEL - 1)
+        .limit(1)
+    )
+    oldest_kept = session.exec(statement).first()
+    if oldest_kept is not None:
+        cutoff = max(cutoff, oldest_kept)
+
+    session.connection().execute(
+        delete(ChannelMessage).where(ChannelMessage.channel_id == channel_id, ChannelMessage.id < cutoff),  # type: ignore[arg-type]
+    )
+
+
+def load_watermark(channel_id: int) -> int | None:
+    """Load the ID of the newest message stored from a channel, if any have been stored."""
+    with Session(globals.get_sql_engine()) as session:
+        watermark = session.get(ChannelWatermark, channel_id)
+        return None if watermark is None else watermark.last_message_id
+
+
+def store_messages(channel_id: int, messages: list[discord.Message]) -> list[ChannelMessage]:
+    """Store newly fetched messages from a channel (newest first), returning all of the channel's stored messages."""
+    with Session(globals.get_sql_engine()) as session:
+        if len(messages) != 0:
+            # A single bulk upsert, as merging each message on its own holds the write lock for long enough on large
+            # channels that concurrent writers time out waiting for it.
+            upsert = sqlite.insert(ChannelMessage)
+            session.execute(
+                upsert.on_conflict_do_update(index_elements=["id"], set_={"content": upsert.excluded.content}),
+                [
+                    {"id": msg.id, "channel_id": channel_id, "author_id": msg.author.id, "content": msg.content}
+                    for msg in messages
+                ],
+            )
+            session.merge(ChannelWatermark(channel_id=channel_id, last_message_id=messages[0].id))
+            compact(session, channel_id)
+        session.commit()
+
+        statement = (
+            sqlmodel.select(ChannelMessage)
+            .where(ChannelMessage.channel_id == channel_id)
+            .order_by(ChannelMessage.id.desc())  # type: ignore[attr-defined]
+        )
+        return list(session.exec(statement))
+
+
+async def get_history(channel: discord.TextChannel | discord.PartialMessageable) -> list[ChannelMessage]:
+    """Get the messages in a channel, newest first.
+
+    Only the messages sent since the last call are fetched from Discord, with the rest being read from the store.
+    """
+    watermark = await database.run(load_watermark, channel.id)
+    after = None if watermark is None else discord.Object(id=watermark)
+    new_messages = [
+        msg async for msg in channel.history(limit=MAX_MESSAGES_PER_CHANNEL, after=after, oldest_first=False)
+    ]
+    globals.LOGGER.debug("Fetched %s new messages from channel %s", len(new_messages), channel.id)
+
+    return await database.run(store_messages, channel.id, new_messages)
+
+
+def edit_message(message_id: int, content: str) -> None:
+    """Update the content of a stored message, after it's been edited."""
+    with globals.get_sql_engine().begin() as connection:
+        connection.execute(
+            update(ChannelMessage).where(ChannelMessage.id == message_id).values(content=content),  # type: ignore[arg-type]
+        )
+
+
+def delete_messages(message_ids: Iterable[int]) -> None:
+    """Remove stored messages, after they've been deleted."""
+    with globals.get_sql_engine().begin() as connection:
+        connection.execute(delete(ChannelMessage).where(ChannelMessage.id.in_(message_ids)))  # type: ignore[attr-defined]
@@ -0,0 +1,181 @@
+"""A persistent queue of test generation jobs, run in the background by a bounded pool of workers.
+
+Generating a test can take longer than Discord lets an interaction be followed up for, so `/generate` only records a
+job and posts a message for it, with the rest happening here. Jobs are stored in the database until they're done with,
+and at most `WORKERS` of them generate at once, with free workers handed out round-robin between guilds (by the
+governor's `FairSemaphore`) so a guild queueing lots of tests can't hold up everyone else. Jobs report their progress
+by editing their message through its channel, rather than through the interaction, so this works however long they
+take.
+
+Once a job's questions have been generated, they're stored with it and shown for confirmation, which doesn't take up a
+worker. Jobs that were left over when the bot stopped (whether queued, part way through generating, or waiting for
+confirmation) are picked up again when it next starts.
+"""
+
+__all__ = ["QUEUE", "JobQueue", "job_message"]
+
+import asyncio
+import contextlib
+import time
+from collections.abc import Awaitable, Callable
+
+import discord
+import sqlmodel
+from sqlalchemy import delete, update
+from sqlmodel import Session
+
+from citadel import database, defaults, globals, governor, metrics
+from citadel.models import GenerationJob
+
+WORKERS = defaults.GENERATE_WORKERS
+
+Questions = list[dict[str, str]]
+
+
+def store_job(job: GenerationJob) -> GenerationJob:
+    """Store a new job, returning it with its ID."""
+    with Session(globals.get_sql_engine(), expire_on_commit=False) as session:
+        session.add(job)
+        session.commit()
+        return job
+
+
+def store_questions(job_id: int, questions: Questions) -> None:
+    """Store the questions generated (or edited) for a job."""
+    with globals.get_sql_engine().begin() as connection:
+        connection.execute(
+            update(GenerationJob).where(GenerationJob.id == job_id).values(questions=questions),  # type: ignore[arg-type]
+        )
+
+
+def delete_job(job_id: int) -> None:
+    """Delete a job that's done with."""
+    with globals.get_sql_engine().begin() as connection:
+        connection.execute(delete(GenerationJob).where(GenerationJob.id == job_id))  # type: ignore[arg-type]
+
+
+def load_jobs() -> list[GenerationJob]:
+    """Load every stored job, oldest first."""
+    with Session(globals.get_sql_engine()) as session:
+        return list(session.exec(sqlmodel.select(GenerationJob).order_by(GenerationJob.id)))  # type: ignore[arg-type]
+
+
+def job_message(client: discord.Client, job: GenerationJob) -> discord.PartialMessage:
+    """Get the message a job shows its progress on."""
+    return client.get_partial_messageable(job.channel_id, guild_id=job.guild_id).get_partial_message(job.message_id)
+
+
+def owns(client: discord.Client, job: GenerationJob) -> bool:
+    """Check whether a job's guild is on one of the client's shards, so processes don't pick up each other's jobs."""
+    if not isinstance(client, discord.AutoShardedClient) or client.shard_ids is None or client.shard_count is None:
+        return True
+    # Direct messages are always on the first shard.
+    shard = 0 if job.guild_id is None else (job.guild_id >> 22) % client.shard_count
+    return shard in client.shard_ids
+
+
+class JobQueue:
+    """Runs generation jobs, at most `workers` at once.
+
+    How jobs are run is given to `start`: `generate` generates a job's questions (with a worker), and `confirm` shows
+    them for confirmation (without one).
+    """
+
+    def __init__(self, workers: int = WORKERS) -> None:
+        self.workers = workers
+        # The jobs waiting for a worker, and the jobs with one.
+        self.waiting = 0
+        self.running = 0
+        self.__slots = governor.FairSemaphore(workers)
+        self.__tasks: set[asyncio.Task[None]] = set()
+        self.__client: discord.Client | None = None
+        self.__generate: Callable[[discord.Client, GenerationJob], Awaitable[Questions]] | None = None
+        self.__confirm: Callable[[discord.Client, GenerationJob], Awaitable[None]] | None = None
+
+    async def start(
+        self,
+        client: discord.Client,
+        generate: Callable[[discord.Client, GenerationJob], Awaitable[Questions]],
+        confirm: Callable[[discord.Client, GenerationJob], Awaitable[None]],
+    ) -> None:
+        """Start running jobs, resuming the client's stored jobs from before a restart."""
+        self.__client = client
+        self.__generate = generate
+        self.__confirm = confirm
+
+        jobs = [job for job in await database.run(load_jobs) if owns(client, job)]
+        for job in jobs:
+            self.__schedule(job)
+        if len(jobs) != 0:
+            globals.LOGGER.info("Resuming %s test generation jobs", len(jobs))
+
+    async def submit(self, job: GenerationJob) -> GenerationJob:
+        """Store a new job, and queue it to be run."""
+        job = await database.run(store_job, job)
+        self.__schedule(job)
+        return job
+
+    def stop(self) -> None:
+        """Stop running jobs, leaving them stored so they're resumed on the next start."""
+        for task in self.__tasks:
+            task.cancel()
+
+    async def join(self) -> None:
+        """Wait until every job has been run, including any that get submitted in the meantime."""
+        while len(self.__tasks) != 0:
+            await asyncio.wait(self.__tasks)
+
+    def __schedule(self, job: GenerationJob) -> None:
+        task = asyncio.create_task(self.__run(job))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __run(self, job: GenerationJob) -> None:
+        if self.__client is None or self.__generate is None or self.__confirm is None or job.id is None:
+            raise RuntimeError("Unexpected job before the queue was started")  # noqa: TRY003,EM101
+        # Requests made for the job are scheduled fairly between guilds too.
+        governor.GUILD.set(job.guild_id)
+
+        # Jobs are left stored if they're cancelled (such as by the bot shutting down), so they get resumed.
+        try:
+            if job.questions is None:
+                queued = time.perf_counter()
+                self.waiting += 1
+                try:
+                    await self.__slots.acquire(job.guild_id)
+                finally:
+                    self.waiting -= 1
+                metrics.GENERATION_WAIT_SECONDS.observe(time.perf_counter() - queued)
+
+                self.running += 1
+                try:
+                    with metrics.GENERATION_JOB_SECONDS.time():
+                        job.questions = await self.__generate(self.__client, job)
+                finally:
+                    self.running -= 1
+                    self.__slots.release()
+                await database.run(store_questions, job.id, job.questions)
+
+            await self.__confirm(self.__client, job)
+        except Exception:  # noqa: BLE001
+            globals.LOGGER.exception("Test generation job %s failed", job.id)
+            with contextlib.suppress(discord.HTTPException):
+                await job_message(self.__client, job).edit(
+                    content="An unknown error has occurred. Please check server logs for more information.",
+                    view=None,
+                )
+        await database.run(delete_job, job.id)
+
+
+QUEUE = JobQueue()
+
+metrics.Gauge(
+    "citadel_generation_jobs_waiting",
+    "The amount of test generation jobs waiting for a free worker.",
+    lambda: QUEUE.waiting,
+)
+metrics.Gauge(
+    "citadel_generation_jobs_running",
+    "The amount of test generation jobs generating their questions.",
+    lambda: QUEUE.running,
+)
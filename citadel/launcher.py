@@ -0,0 +1,146 @@
+"""Running the bot over several processes, each connecting a range of shards.
+
+Each worker is a separate `citadel main` process (so they each get their own CPU core), all sharing the same SQLite
+database. The launcher staggers their startup to stay within Discord's identify rate limit, and restarts any worker
+that exits.
+"""
+
+__all__ = [
+    "GatewayInfo",
+    "recommended_shards",
+    "shard_ranges",
+    "start_delays",
+    "supervise",
+    "worker_command",
+    "worker_options",
+]
+
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from types import FrameType
+
+import httpx
+
+from citadel import globals
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+# How long Discord makes each bucket of shards wait between identifying, in seconds.
+IDENTIFY_INTERVAL = 5.0
+# How long to wait before restarting a worker that exited, in seconds.
+RESTART_DELAY = 5.0
+# The options of `citadel main` that the launcher sets for each worker itself.
+LAUNCHER_OPTIONS = frozenset(("--shard-ids", "--shard-count", "--metrics-port"))
+
+
+@dataclass
+class GatewayInfo:
+    """The sharding information Discord recommends for the bot."""
+
+    shards: int
+    # How many shards can identify at once.
+    max_concurrency: int
+
+
+def recommended_shards(discord_token: str) -> GatewayInfo:
+    """Get the amount of shards Discord recommends for the bot."""
+    response = httpx.get(GATEWAY_URL, headers={"Authorization": f"Bot {discord_token}"})
+    response.raise_for_status()
+    data = response.json()
+    return GatewayInfo(shards=data["shards"], max_concurrency=data["session_start_limit"]["max_concurrency"])
+
+
+def shard_ranges(shard_count: int, processes: int) -> list[range]:
+    """Split the shards into contiguous ranges, as evenly as possible between the processes."""
+    processes = max(min(processes, shard_count), 1)
+    size, extra = divmod(shard_count, processes)
+
+    ranges = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(range(start, end))
+        start = end
+    return ranges
+
+
+def start_delays(ranges: list[range], max_concurrency: int) -> list[float]:
+    """Get how long to wait before starting each worker, so their shards identify in turn (in seconds)."""
+    return [shards.start // max_concurrency * IDENTIFY_INTERVAL for shards in ranges]
+
+
+def worker_options(args: list[str], options: dict[str, bool]) -> list[str]:
+    """Check that the arguments to pass on to the workers are all options of `citadel main`, and return them.
+
+    `options` maps the names of `main`'s options to whether they take a value. Positional arguments aren't allowed, as
+    they'd take the place of `main`'s own (starting with the Discord token), so those settings have to be given to the
+    workers through their environment variables instead.
+    """
+    index = 0
+    while index < len(args):
+        name, separator, _ = args[index].partition("=")
+        if name in LAUNCHER_OPTIONS:
+            raise ValueError(f"{name} is set for each worker by the launcher")  # noqa: TRY003,EM102
+        if name not in options:
+            raise ValueError(f"{args[index]!r} isn't an option of `citadel main`")  # noqa: TRY003,EM102
+        takes_value = options[name] and separator == ""
+        if takes_value and index + 1 >= len(args):
+            raise ValueError(f"{name} needs a value")  # noqa: TRY003,EM102
+        index += 2 if takes_value else 1
+    return args
+
+
+def worker_command(args: list[str], shards: range, shard_count: int, metrics_port: int = 0) -> list[str]:
+    """Get the command that runs a worker for the given shards, passing on the options in `args` to `citadel main`."""
+    shard_ids = ",".join(str(shard) for shard in shards)
+    return [
+        sys.executable,
+        "-m",
+        "citadel.main",
+        "main",
+        *args,
+        "--shard-ids",
+        shard_ids,
+        "--shard-count",
+        str(shard_count),
+        "--metrics-port",
+        str(metrics_port),
+    ]
+
+
+def supervise(commands: list[list[str]], start_delays: list[float]) -> None:
+    """Run the worker commands until interrupted, starting each after its delay and restarting any that exit."""
+    started = time.monotonic()
+    start_at = [started + delay for delay in start_delays]
+    workers: list[subprocess.Popen[bytes] | None] = [None] * len(commands)
+
+    def stop(_signal: int, _frame: FrameType | None) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        while True:
+            now = time.monotonic()
+            for index, command in enumerate(commands):
+                worker = workers[index]
+
+                if worker is None and now >= start_at[index]:
+                    globals.LOGGER.info("Starting worker %s", index)
+                    workers[index] = subprocess.Popen(command)  # noqa: S603
+                elif worker is not None and (code := worker.poll()) is not None:
+                    globals.LOGGER.warning("Worker %s exited with code %s, restarting it", index, code)
+                    workers[index] = None
+                    start_at[index] = now + RESTART_DELAY
+
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        globals.LOGGER.info("Stopping workers")
+    finally:
+        running = [worker for worker in workers if worker is not None]
+        for worker in running:
+            worker.terminate()
+        for worker in running:
+            worker.wait()
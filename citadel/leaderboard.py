@@ -0,0 +1,88 @@
+"""The ranking of players during a quiz.
+
+Players are grouped into tiers by their points, in a dict keyed by point total. Scoring a player moves them between two
+tiers in constant time, however big the lobby gets. The point totals are only sorted when the leaderboard is next read
+after they've changed, which happens once per question (between questions, when nobody is scoring), rather than on
+every answer.
+"""
+
+__all__ = ["Leaderboard", "PlayerStats", "Tier"]
+
+from collections.abc import Hashable, Iterable
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+P = TypeVar("P", bound=Hashable)
+
+# The amount of tiers shown on leaderboards, and the most players shown in each of them.
+TIERS = 5
+PLAYERS_PER_TIER = 10
+
+
+@dataclass(slots=True)
+class PlayerStats:
+    """The statistics of a player during a quiz session."""
+
+    points: int = 0
+    correct: int = 0
+
+
+@dataclass
+class Tier(Generic[P]):
+    """The players that share a place on the leaderboard."""
+
+    points: int
+    # The first players to reach this tier, up to `PLAYERS_PER_TIER` of them.
+    players: list[tuple[P, PlayerStats]]
+    # The amount of players in the tier, including those left out of `players`.
+    size: int
+
+
+class Leaderboard(Generic[P]):
+    """The players in a quiz, ranked by their points."""
+
+    def __init__(self, players: Iterable[P]) -> None:
+        self.stats = {player: PlayerStats() for player in players}
+        # The players on each point total, in the order they reached it (dicts are used as ordered sets).
+        self.__tiers: dict[int, dict[P, None]] = {0: dict.fromkeys(self.stats)} if len(self.stats) != 0 else {}
+        # The distinct point totals, highest first, or `None` if they've changed since they were last sorted.
+        self.__scores: list[int] | None = None
+
+    def __len__(self) -> int:
+        return len(self.stats)
+
+    def __contains__(self, player: object) -> bool:
+        return player in self.stats
+
+    def score(self, player: P, points: int) -> None:
+        """Record a correct answer from `player`, worth `points` points."""
+        stats = self.stats[player]
+        stats.correct += 1
+        if points == 0:
+            return
+
+        tier = self.__tiers[stats.points]
+        del tier[player]
+        if len(tier) == 0:
+            del self.__tiers[stats.points]
+            self.__scores = None
+
+        stats.points += points
+        if stats.points not in self.__tiers:
+            self.__tiers[stats.points] = {}
+            self.__scores = None
+        self.__tiers[stats.points][player] = None
+
+    def top(self, tiers: int = TIERS, players_per_tier: int = PLAYERS_PER_TIER) -> list[Tier[P]]:
+        """Get the top `tiers` tiers, padded with empty tiers if there aren't that many."""
+        if self.__scores is None:
+            self.__scores = sorted(self.__tiers, reverse=True)
+
+        leaderboard = []
+        for score in self.__scores[:tiers]:
+            tier = self.__tiers[score]
+            players = [(player, self.stats[player]) for player, _ in zip(tier, range(players_per_tier), strict=False)]
+            leaderboard.append(Tier(points=score, players=players, size=len(tier)))
+
+        leaderboard.extend(Tier(points=0, players=[], size=0) for _ in range(tiers - len(leaderboard)))
+        return leaderboard
@@ -1,18 +1,22 @@
 import logging
+import os
+import sys
+import time
 from enum import Enum
-from typing import Annotated
+from pathlib import Path
+from typing import Annotated, Optional
 
-import discord
 import typer
-from discord import app_commands
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from sqlmodel import SQLModel, create_engine
 
-from citadel import commands, globals
+from citadel import defaults, globals, transfer
 
+# Commands import the heavier parts of the bot (discord.py, the OpenAI client, the database layer) when they run, so
+# that commands which don't need them (like `--help`) start quickly.
 APP = typer.Typer()
-GUILD_ID = discord.Object(id=1262512524541296640)
+# The guilds to sync slash commands to by default. Commands synced to guilds show up instantly, while global commands
+# can take up to an hour.
+GUILD_IDS = "1262512524541296640"
 
 
 class LogLevel(str, Enum):
@@ -25,22 +29,6 @@ class LogLevel(str, Enum):
     CRITICAL = "CRITICAL"
 
 
-class CitadelClient(discord.Client):
-    """The Citadel Discord Client."""
-
-    def __init__(self) -> None:
-        super().__init__(intents=discord.Intents.default())
-        self.tree = app_commands.CommandTree(self)
-
-    async def setup_hook(self) -> None:
-        """Ensure the slash commands have been synced to our guild.
-
-        Without specifying our guild, it can take up to an hour for slash commands to sync.
-        """
-        self.tree.copy_global_to(guild=GUILD_ID)
-        await self.tree.sync(guild=GUILD_ID)
-
-
 @APP.command()
 def main(  # noqa: PLR0913
     discord_token: Annotated[str, typer.Argument(envvar="CITADEL_DISCORD_TOKEN")],
@@ -49,33 +37,208 @@ def main(  # noqa: PLR0913
     openai_base: Annotated[str, typer.Argument(envvar="OPENAI_BASE")] = "https://api.openai.com/v1",
     db_path: Annotated[str, typer.Argument(envvar="DB_PATH")] = "./citadel.db",
     log_level: Annotated[LogLevel, typer.Argument(case_sensitive=False, envvar="LOG_LEVEL")] = LogLevel.INFO,
+    openai_concurrency: Annotated[int, typer.Argument(envvar="OPENAI_CONCURRENCY")] = defaults.OPENAI_CONCURRENCY,
+    openai_timeout: Annotated[float, typer.Argument(envvar="OPENAI_TIMEOUT")] = 60.0,
+    db_threads: Annotated[int, typer.Argument(envvar="DB_THREADS")] = defaults.DB_THREADS,
+    generate_workers: Annotated[int, typer.Argument(envvar="GENERATE_WORKERS")] = defaults.GENERATE_WORKERS,
+    guild_ids: Annotated[str, typer.Argument(envvar="GUILD_IDS")] = GUILD_IDS,
+    # Sync slash commands even if they haven't changed since they were last synced.
+    force_sync: Annotated[bool, typer.Option(envvar="FORCE_SYNC")] = False,  # noqa: FBT002
+    # The shards to connect (comma-separated), and the total amount of shards. Set by `launch` for its workers.
+    shard_ids: Annotated[str, typer.Option(envvar="SHARD_IDS")] = "",
+    shard_count: Annotated[int, typer.Option(envvar="SHARD_COUNT")] = 0,
+    # Where to serve Prometheus metrics, which is disabled if the port is 0.
+    metrics_port: Annotated[int, typer.Option(envvar="METRICS_PORT")] = 0,
+    metrics_host: Annotated[str, typer.Option(envvar="METRICS_HOST")] = "127.0.0.1",
+    # Send a second copy of completions that are slower than usual to another backend, using whichever finishes first.
+    openai_hedge: Annotated[bool, typer.Option(envvar="OPENAI_HEDGE")] = False,  # noqa: FBT002
+    # How much of Discord's state to keep in memory. The low profile caches no guilds, members or messages.
+    memory_profile: Annotated[
+        defaults.MemoryProfile, typer.Option(case_sensitive=False, envvar="MEMORY_PROFILE")
+    ] = defaults.MemoryProfile.DEFAULT,
 ) -> None:
     """Citadel Discord bot.
 
     Environment variables can be set via the command-line, or in a file named `.env`.
     """
+    started = time.perf_counter()
+    import discord
+
+    from citadel import backends, commands, database, governor, jobs, metrics
+    from citadel.client import CitadelClient
+
     globals.LOGGER.setLevel(logging.getLevelName(log_level.value))
-    globals.OPENAI_CLIENT = AsyncOpenAI(api_key=openai_token, base_url=openai_base)
-    globals.OPENAI_MODEL = openai_model
+    # Several backends can be given as comma-separated base URLs, with either one model for all of them or one each.
+    try:
+        endpoints = backends.parse_endpoints(openai_base, openai_model)
+    except ValueError as err:
+        raise typer.BadParameter(str(err), param_hint="OPENAI_BASE/OPENAI_MODEL") from err
+    globals.OPENAI_POOL = backends.BackendPool.connect(openai_token, endpoints, openai_timeout, openai_hedge)
+    governor.GOVERNOR = governor.RequestGovernor(max_concurrency=openai_concurrency)
 
-    # Set up the database.
-    engine = create_engine(f"sqlite:///{db_path}")
-    SQLModel.metadata.create_all(engine)
-    globals.SQL_ENGINE = engine
+    globals.SQL_ENGINE = database.setup(db_path, db_threads)
+    jobs.QUEUE = jobs.JobQueue(generate_workers)
 
     # Set up the client, add commands, and start.
-    client = CitadelClient()
+    client = CitadelClient(
+        guilds=[discord.Object(id=int(guild_id)) for guild_id in guild_ids.split(",") if guild_id.strip() != ""],
+        shard_ids=[int(shard_id) for shard_id in shard_ids.split(",")] if shard_ids != "" else None,
+        shard_count=shard_count if shard_count != 0 else None,
+        force_sync=force_sync,
+        started=started,
+        metrics_server=metrics.MetricsServer(metrics_host, metrics_port) if metrics_port != 0 else None,
+        memory_profile=memory_profile,
+    )
     client.tree.add_command(commands.hello)
     client.tree.add_command(commands.generate)
     client.tree.add_command(commands.quiz)
+    client.tree.add_command(commands.stats)
+    client.run(discord_token)
 
-    @client.tree.error
-    async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:  # noqa: ARG001
-        await interaction.followup.send(
-            "An unknown error has occurred. Please check server logs for more information."
-        )
 
-    client.run(discord_token)
+@APP.command("launch", context_settings={"allow_extra_args": True, "ignore_unknown_options": True})
+def launch(  # noqa: PLR0913
+    context: typer.Context,
+    discord_token: Annotated[str, typer.Option(envvar="CITADEL_DISCORD_TOKEN")],
+    processes: Annotated[int, typer.Option(envvar="PROCESSES")] = os.cpu_count() or 1,
+    shard_count: Annotated[int, typer.Option(envvar="SHARD_COUNT")] = 0,
+    db_path: Annotated[str, typer.Option(envvar="DB_PATH")] = "./citadel.db",
+    metrics_port: Annotated[int, typer.Option(envvar="METRICS_PORT")] = 0,
+) -> None:
+    """Run the bot over several processes, each connecting a range of shards.
+
+    Any extra options are passed on to `main` in each process. Its arguments can't be, as they're positional, so those
+    settings are given to the workers through their environment variables instead. If the shard count isn't given, the
+    amount Discord recommends is used. When serving metrics, each process serves them on its own port, counting up
+    from the given one.
+    """
+    from citadel import database, launcher
+
+    # Only `main`'s options can be passed on, as anything positional would take the place of its arguments.
+    main_command = typer.main.get_group(APP).get_command(context, "main")
+    params = main_command.params if main_command is not None else []
+    options = {
+        name: not info["is_flag"]
+        for info in (param.to_info_dict() for param in params)
+        if info["param_type_name"] == "option"
+        for name in (*info["opts"], *info["secondary_opts"])
+    }
+    try:
+        args = launcher.worker_options(context.args, options)
+    except ValueError as err:
+        raise typer.BadParameter(str(err), param_hint="extra arguments") from err
+
+    # Create the database up front, so the workers don't race to do it.
+    database.setup(db_path).dispose()
+
+    max_concurrency = 1
+    if shard_count == 0:
+        gateway = launcher.recommended_shards(discord_token)
+        shard_count, max_concurrency = gateway.shards, gateway.max_concurrency
+
+    ranges = launcher.shard_ranges(shard_count, processes)
+    for index, shards in enumerate(ranges):
+        globals.LOGGER.info("Worker %s runs shards %s-%s of %s", index, shards.start, shards.stop - 1, shard_count)
+
+    # The workers get these from the environment, as they might not have been given that way.
+    os.environ["CITADEL_DISCORD_TOKEN"] = discord_token
+    os.environ["DB_PATH"] = db_path
+    launcher.supervise(
+        [
+            launcher.worker_command(args, shards, shard_count, metrics_port + index if metrics_port != 0 else 0)
+            for index, shards in enumerate(ranges)
+        ],
+        launcher.start_delays(ranges, max_concurrency),
+    )
+
+
+@APP.command("compile-templates")
+def compile_templates() -> None:
+    """Compile the message and prompt templates into the bytecode cache, so the bot doesn't need to when it starts."""
+    count = globals.compile_templates()
+    typer.echo(f"Compiled {count} templates", err=True)
+
+
+def infer_format(path: Path, format: transfer.Format | None) -> transfer.Format:
+    """Get the format of a test bank file, inferring it from the file's extension if it wasn't given."""
+    if format is not None:
+        return format
+    if path.suffix.lower() == ".csv":
+        return transfer.Format.CSV
+    return transfer.Format.NDJSON
+
+
+@APP.command("import")
+def import_(
+    path: Annotated[Path, typer.Argument(help="The file to import from, or `-` for stdin.")],
+    format: Annotated[Optional[transfer.Format], typer.Option(case_sensitive=False)] = None,  # noqa: UP007
+    db_path: Annotated[str, typer.Option(envvar="DB_PATH")] = "./citadel.db",
+    batch_size: Annotated[int, typer.Option()] = transfer.BATCH_SIZE,
+) -> None:
+    """Import questions from an NDJSON or CSV file, with `test`, `question` and `answer` fields."""
+    from citadel import database
+
+    engine = database.setup(db_path)
+    format = infer_format(path, format)
+
+    if str(path) == "-":
+        stats = transfer.import_questions(engine, transfer.read_rows(sys.stdin, format), batch_size)
+    else:
+        with path.open(newline="") as file:
+            stats = transfer.import_questions(engine, transfer.read_rows(file, format), batch_size)
+
+    typer.echo(
+        f"Imported {stats.rows} questions ({stats.tests_created} new tests) in {stats.elapsed():.2f}s "
+        f"({stats.throughput():.0f} rows/s)",
+        err=True,
+    )
+
+
+@APP.command("export")
+def export(
+    path: Annotated[Path, typer.Argument(help="The file to export to, or `-` for stdout.")],
+    format: Annotated[Optional[transfer.Format], typer.Option(case_sensitive=False)] = None,  # noqa: UP007
+    db_path: Annotated[str, typer.Option(envvar="DB_PATH")] = "./citadel.db",
+    batch_size: Annotated[int, typer.Option()] = transfer.BATCH_SIZE,
+) -> None:
+    """Export every question to an NDJSON or CSV file."""
+    from citadel import database
+
+    engine = database.setup(db_path)
+    format = infer_format(path, format)
+    stats = transfer.TransferStats()
+
+    if str(path) == "-":
+        transfer.write_rows(sys.stdout, format, transfer.export_questions(engine, stats, batch_size))
+    else:
+        with path.open("w", newline="") as file:
+            transfer.write_rows(file, format, transfer.export_questions(engine, stats, batch_size))
+
+    typer.echo(
+        f"Exported {stats.rows} questions in {stats.elapsed():.2f}s ({stats.throughput():.0f} rows/s)",
+        err=True,
+    )
+
+
+@APP.command()
+def dedupe(
+    db_path: Annotated[str, typer.Option(envvar="DB_PATH")] = "./citadel.db",
+    threshold: Annotated[float, typer.Option(min=0.0, max=1.0)] = defaults.SIMILARITY_THRESHOLD,
+    dry_run: Annotated[bool, typer.Option(help="Only report what would change.")] = False,  # noqa: FBT002
+) -> None:
+    """Delete near-duplicate questions within tests, and share distractors between near-duplicates across tests."""
+    from citadel import database
+    from citadel import dedupe as dedupe_
+
+    engine = database.setup(db_path)
+    stats = dedupe_.dedupe(engine, threshold, dry_run)
+
+    delete, share = ("Would delete", "share") if dry_run else ("Deleted", "shared")
+    typer.echo(
+        f"{delete} {stats.deleted} of {stats.questions} questions and {share} distractors with {stats.shared} "
+        f"questions in {stats.elapsed():.2f}s",
+        err=True,
+    )
 
 
 def entrypoint() -> None:
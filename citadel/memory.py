@@ -0,0 +1,80 @@
+"""Reporting of the bot's memory use, and of the Discord caches that make up most of it."""
+
+__all__ = ["REPORTER", "MemoryReporter", "cache_sizes", "resident_memory"]
+
+import asyncio
+import gc
+import os
+import resource
+import sys
+
+import discord
+
+from citadel import globals, metrics
+
+# How often to log memory use, in seconds.
+REPORT_INTERVAL = 300.0
+
+
+def resident_memory() -> int:
+    """Get the process's resident set size, in bytes.
+
+    This is read from `/proc` where there is one, and otherwise falls back on the peak resident set size.
+    """
+    try:
+        with open("/proc/self/statm") as statm:  # noqa: PTH123
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS gives this in bytes, and everything else in kilobytes.
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def cache_sizes(client: discord.Client) -> dict[str, int]:
+    """Count what's in a client's caches."""
+    return {
+        "guilds": len(client.guilds),
+        "channels": sum(len(guild.channels) for guild in client.guilds),
+        "members": sum(len(guild.members) for guild in client.guilds),
+        "users": len(client.users),
+        "messages": len(client.cached_messages),
+    }
+
+
+class MemoryReporter:
+    """Periodically logs the resident memory, the amount of objects, and the size of a client's caches."""
+
+    def __init__(self, interval: float = REPORT_INTERVAL) -> None:
+        self.interval = interval
+        self.__task: asyncio.Task[None] | None = None
+
+    def start(self, client: discord.Client) -> None:
+        """Start reporting on a client."""
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run(client))
+
+    def stop(self) -> None:
+        """Stop reporting."""
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    def report(self, client: discord.Client) -> None:
+        """Log the current memory use."""
+        caches = ", ".join(f"{count} {name}" for name, count in cache_sizes(client).items())
+        globals.LOGGER.info(
+            "Memory: %.1fMiB resident, %s objects, caching %s",
+            resident_memory() / (1 << 20),
+            len(gc.get_objects()),
+            caches,
+        )
+
+    async def __run(self, client: discord.Client) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.report(client)
+
+
+REPORTER = MemoryReporter()
+
+metrics.Gauge("citadel_resident_memory_bytes", "The resident memory of the process, in bytes.", resident_memory)
@@ -0,0 +1,367 @@
+"""Counters and histograms about how the bot is performing, exposed in the Prometheus text format.
+
+Metrics are module-level values that hot paths record into directly, so recording one is just a dictionary lookup and
+an addition (histograms add a bisect over their buckets). They're served from a small HTTP endpoint for Prometheus to
+scrape, and summarized by the `/stats` command.
+"""
+
+__all__ = [
+    "ANALYTICS_DROPPED",
+    "ANALYTICS_WRITTEN",
+    "DB_QUERY_SECONDS",
+    "DB_WAIT_SECONDS",
+    "DISCORD_EDIT_SECONDS",
+    "DISCORD_RATE_LIMITS",
+    "GENERATION_JOB_SECONDS",
+    "GENERATION_WAIT_SECONDS",
+    "LOOP_LAG_SECONDS",
+    "OPENAI_BACKEND_EJECTIONS",
+    "OPENAI_BACKEND_FAILURES",
+    "OPENAI_BACKEND_SECONDS",
+    "OPENAI_FIRST_TOKEN_SECONDS",
+    "OPENAI_HEDGES",
+    "OPENAI_REQUEST_SECONDS",
+    "OPENAI_RETRIES",
+    "OPENAI_TOKENS",
+    "PREFILTER_SAVED_TOKENS",
+    "REGISTRY",
+    "RESPONSE_SECONDS",
+    "VIEW_DISPATCH_SECONDS",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsServer",
+    "Registry",
+]
+
+import asyncio
+import bisect
+import math
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from citadel import globals
+
+# Bucket upper bounds for latencies, in seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Bucket upper bounds for slow operations (such as LLM completions), in seconds.
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# How long to wait for a scrape's request to come in, in seconds.
+REQUEST_TIMEOUT = 5.0
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    """Format a set of labels for the text format, e.g. `{mode="stream"}`."""
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra != "":
+        labels.append(extra)
+    return "" if len(labels) == 0 else "{" + ",".join(labels) + "}"
+
+
+def escape(value: str) -> str:
+    """Escape a label value for the text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    """Format a sample's value for the text format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """The metrics to expose."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Counter | Gauge | Histogram] = []
+
+    def register(self, metric: "Counter | Gauge | Histogram") -> None:
+        """Add a metric to the registry."""
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    """A count of events, which only ever goes up."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), registry: Registry = REGISTRY) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple[str, ...], float] = {}
+        registry.register(self)
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """Add to the count for the given label values."""
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def total(self) -> float:
+        """Get the count over all label values."""
+        return sum(self.values.values())
+
+    def render(self) -> list[str]:
+        """Render the counter's samples."""
+        return [
+            f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge:
+    """A value that's read when the metrics are collected, such as the size of a queue."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], registry: Registry = REGISTRY) -> None:
+        self.name = name
+        self.help = help
+        self.read = read
+        registry.register(self)
+
+    def render(self) -> list[str]:
+        """Render the gauge's sample."""
+        return [f"{self.name} {format_value(self.read())}"]
+
+
+class HistogramSeries:
+    """The observations of a histogram for one set of label values."""
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, buckets: int) -> None:
+        # The count in each bucket (not cumulative), with the last being for values above every bucket.
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+
+
+class Histogram:
+    """A distribution of values (usually latencies), counted into buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        registry: Registry = REGISTRY,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: dict[tuple[str, ...], HistogramSeries] = {}
+        registry.register(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Record a value for the given label values."""
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Record how long the body of a `with` block takes, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def matching(self, **labels: str) -> list[HistogramSeries]:
+        """Get the series with the given label values (e.g. `backend="..."`), or every series if none are given."""
+        positions = [(self.labels.index(name), value) for name, value in labels.items()]
+        return [
+            series
+            for values, series in self.series.items()
+            if all(values[position] == value for position, value in positions)
+        ]
+
+    def merged(self, **labels: str) -> HistogramSeries:
+        """Get the observations over all label values, or only those with the given label values."""
+        merged = HistogramSeries(len(self.buckets))
+        for series in self.matching(**labels):
+            merged.counts = [total + count for total, count in zip(merged.counts, series.counts, strict=True)]
+            merged.sum += series.sum
+        return merged
+
+    def count(self, **labels: str) -> int:
+        """Get the amount of observations over all label values, or only those with the given label values."""
+        return sum(sum(series.counts) for series in self.matching(**labels))
+
+    def quantile(self, quantile: float, **labels: str) -> float:
+        """Estimate a quantile over all label values (or only those given), interpolating within its bucket."""
+        counts = self.merged(**labels).counts
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+
+        rank = quantile * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count != 0 and seen + count >= rank:
+                if index == len(self.buckets):
+                    # Past the last bucket, so the best we can say is that it's above it.
+                    return self.buckets[-1]
+                lower = 0.0 if index == 0 else self.buckets[index - 1]
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        """Render the histogram's samples."""
+        lines = []
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], series.counts, strict=True):
+                cumulative += count
+                bucket = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, bucket)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(series.sum)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class MetricsServer:
+    """A minimal HTTP server, serving the registry's metrics on any path for Prometheus to scrape."""
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.__server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        """Start serving, logging (instead of raising) if the port can't be bound."""
+        try:
+            self.__server = await asyncio.start_server(self.__handle, self.host, self.port)
+        except OSError:
+            globals.LOGGER.exception("Failed to serve metrics on %s:%s", self.host, self.port)
+            return
+        globals.LOGGER.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    def stop(self) -> None:
+        """Stop serving."""
+        if self.__server is not None:
+            self.__server.close()
+            self.__server = None
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Only the end of the request's headers matters, as every request gets the metrics.
+            async with asyncio.timeout(REQUEST_TIMEOUT):
+                await reader.readuntil(b"\r\n\r\n")
+            body = self.registry.render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body,
+            )
+            await writer.drain()
+        except (TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+OPENAI_REQUEST_SECONDS = Histogram(
+    "citadel_openai_request_seconds",
+    "How long requests to the OpenAI API took, including retries.",
+    ("mode",),
+    SLOW_BUCKETS,
+)
+OPENAI_FIRST_TOKEN_SECONDS = Histogram(
+    "citadel_openai_first_token_seconds",
+    "How long streamed requests to the OpenAI API took to output their first token.",
+    buckets=SLOW_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "citadel_openai_tokens_total",
+    "Tokens sent to and received from the OpenAI API (estimated where the API doesn't report them).",
+    ("kind",),
+)
+PREFILTER_SAVED_TOKENS = Counter(
+    "citadel_prefilter_saved_tokens_total",
+    "Estimated tokens of channel messages that the relevance filter kept from being sent for test generation.",
+)
+OPENAI_RETRIES = Counter("citadel_openai_retries_total", "Retried requests to the OpenAI API, by error.", ("error",))
+OPENAI_BACKEND_SECONDS = Histogram(
+    "citadel_openai_backend_seconds",
+    "How long successful requests took on each OpenAI backend, by backend and mode.",
+    ("backend", "mode"),
+    SLOW_BUCKETS,
+)
+OPENAI_BACKEND_FAILURES = Counter(
+    "citadel_openai_backend_failures_total",
+    "Requests that failed on each OpenAI backend from connection or server errors.",
+    ("backend",),
+)
+OPENAI_BACKEND_EJECTIONS = Counter(
+    "citadel_openai_backend_ejections_total",
+    "Times each OpenAI backend was taken out of rotation for failing too often.",
+    ("backend",),
+)
+OPENAI_HEDGES = Counter(
+    "citadel_openai_hedges_total",
+    "Hedge requests sent for slow OpenAI completions, by which request finished first.",
+    ("winner",),
+)
+RESPONSE_SECONDS = Histogram(
+    "citadel_llm_response_seconds",
+    "How long getting an LLM response took, including responses served from the cache.",
+    buckets=SLOW_BUCKETS,
+)
+DB_WAIT_SECONDS = Histogram(
+    "citadel_db_wait_seconds",
+    "How long database work waited for a free database thread.",
+)
+DB_QUERY_SECONDS = Histogram(
+    "citadel_db_query_seconds",
+    "How long database work took to run, by function.",
+    ("function",),
+)
+ANALYTICS_WRITTEN = Counter(
+    "citadel_analytics_written_total",
+    "Quiz answer events and results written to the database.",
+)
+ANALYTICS_DROPPED = Counter(
+    "citadel_analytics_dropped_total",
+    "Quiz answer events and results dropped, as the buffer was full or writing them failed.",
+)
+GENERATION_WAIT_SECONDS = Histogram(
+    "citadel_generation_wait_seconds",
+    "How long test generation jobs waited for a free worker.",
+    buckets=SLOW_BUCKETS,
+)
+GENERATION_JOB_SECONDS = Histogram(
+    "citadel_generation_job_seconds",
+    "How long test generation jobs took to generate their questions, once they had a worker.",
+    buckets=SLOW_BUCKETS,
+)
+DISCORD_EDIT_SECONDS = Histogram("citadel_discord_edit_seconds", "How long editing a message on Discord took.")
+DISCORD_RATE_LIMITS = Counter("citadel_discord_rate_limits_total", "Message edits that got rate limited by Discord.")
+VIEW_DISPATCH_SECONDS = Histogram(
+    "citadel_view_dispatch_seconds",
+    "How long button clicks and modal submissions waited before their command picked them up.",
+)
+LOOP_LAG_SECONDS = Histogram("citadel_event_loop_lag_seconds", "How late the event loop ran a periodic check.")
@@ -1,11 +1,21 @@
+import hashlib
+import json
+
+from sqlalchemy import JSON, Column, Index
 from sqlmodel import Field, SQLModel
 
 
+def hash_content(question: str, answer: str) -> str:
+    """Get the `Question.content_hash` of a question's content, without needing a `Question`."""
+    content = json.dumps([question, answer])
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
 class Test(SQLModel, table=True):
     """The created tests."""
 
     id: int | None = Field(default=None, primary_key=True)
-    name: str
+    name: str = Field(index=True)
 
 
 class Question(SQLModel, table=True):
@@ -14,4 +24,125 @@ class Question(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
     question: str
     answer: str
+    test_id: int = Field(foreign_key="test.id", index=True)
+
+    def content_hash(self) -> str:
+        """Get a hash of the question's content, used to tell when data generated from it has gone stale."""
+        return hash_content(self.question, self.answer)
+
+
+class Distractor(SQLModel, table=True):
+    """The incorrect answers generated for questions, used as the other choices in quizzes."""
+
+    question_id: int = Field(foreign_key="question.id", primary_key=True)
+    # The `Question.content_hash` of the question when these answers were generated.
+    content_hash: str
+    correct_answer: str
+    incorrect_answers: list[str] = Field(sa_column=Column(JSON, nullable=False))
+
+
+class QuestionBand(SQLModel, table=True):
+    """The LSH band keys of questions' signatures, used to look up near-duplicates of new questions."""
+
+    question_id: int = Field(foreign_key="question.id", primary_key=True)
+    band: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    # The key of the bucket the question is in for the band (see `citadel.similarity.band_keys`).
+    key: int = Field(index=True)
+
+
+class AnswerEvent(SQLModel, table=True):
+    """An answer a player gave to a question in a quiz."""
+
+    # The indexes cover the per-player and per-test aggregates, so they're read without touching the table.
+    __table_args__ = (
+        Index("ix_answerevent_player", "player_id", "test_id", "correct", "response_time"),
+        Index("ix_answerevent_test", "test_id", "question_id", "correct", "response_time"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    # The Discord message ID of the quiz's launcher, which identifies the quiz.
+    quiz_id: int = Field(index=True)
     test_id: int = Field(foreign_key="test.id")
+    question_id: int | None
+    # The question's position in the quiz.
+    question_index: int
+    guild_id: int | None
+    player_id: int
+    correct: bool
+    # How long the player took to answer, from when the question was shown, in seconds.
+    response_time: float
+    # The Unix timestamp the answer was given at.
+    answered_at: float
+
+
+class QuizResult(SQLModel, table=True):
+    """How a player did in a quiz that finished."""
+
+    __table_args__ = (
+        Index("ix_quizresult_player", "player_id", "finished_at"),
+        Index("ix_quizresult_test", "test_id", "player_id", "points"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    quiz_id: int = Field(index=True)
+    test_id: int = Field(foreign_key="test.id")
+    guild_id: int | None
+    player_id: int
+    points: int
+    correct: int
+    # The amount of questions and players in the quiz, and the player's place in it (with tied players sharing one).
+    questions: int
+    players: int
+    rank: int
+    # The Unix timestamp the quiz finished at.
+    finished_at: float
+
+
+class ChannelMessage(SQLModel, table=True):
+    """Messages stored from channels, so their history doesn't need to be fetched from Discord every time."""
+
+    # The Discord message ID.
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    channel_id: int = Field(index=True)
+    author_id: int
+    content: str
+
+
+class ChannelWatermark(SQLModel, table=True):
+    """The newest message that's been stored from each channel."""
+
+    channel_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    last_message_id: int
+
+
+class CachedCompletion(SQLModel, table=True):
+    """Completions from the LLM, cached by a hash of the request that produced them."""
+
+    key: str = Field(primary_key=True)
+    content: str
+    # The Unix timestamp the cache entry expires at.
+    expires_at: float = Field(index=True)
+
+
+class CommandFingerprint(SQLModel, table=True):
+    """A hash of the slash commands last synced to each guild, so unchanged commands don't get synced again."""
+
+    # The guild the commands were synced to, or 0 for global commands.
+    guild_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    fingerprint: str
+
+
+class GenerationJob(SQLModel, table=True):
+    """A `/generate` request, kept until it's done with so it can be picked up again after a restart."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    guild_id: int | None
+    channel_id: int
+    # The message showing the job's progress, and then its questions for confirmation.
+    message_id: int
+    msg_filter: str
+    test_name: str
+    # The generated questions, or `None` if they're still to be generated.
+    questions: list[dict[str, str]] | None = Field(default=None, sa_column=Column(JSON, nullable=True))
+    # The Unix timestamp the job was queued at.
+    created_at: float
@@ -0,0 +1,84 @@
+"""Monitoring of how long the event loop gets blocked for."""
+
+__all__ = ["MONITOR", "LoopMonitor"]
+
+import asyncio
+from dataclasses import dataclass
+
+from citadel import globals, metrics
+
+# How often to check the event loop, in seconds.
+INTERVAL = 0.5
+# How late a check has to be before it gets logged as a stall, in seconds.
+STALL_THRESHOLD = 0.1
+# How often to log a summary of the lag seen, in seconds.
+REPORT_INTERVAL = 300.0
+
+
+@dataclass
+class LagStats:
+    """Statistics about the event loop's lag (how late scheduled callbacks run)."""
+
+    checks: int = 0
+    stalls: int = 0
+    total_lag: float = 0.0
+    max_lag: float = 0.0
+
+    def record(self, lag: float) -> None:
+        """Record the lag from a check."""
+        self.checks += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= STALL_THRESHOLD:
+            self.stalls += 1
+
+    def mean_lag(self) -> float:
+        """Get the average lag over all checks."""
+        return 0.0 if self.checks == 0 else self.total_lag / self.checks
+
+
+class LoopMonitor:
+    """Measures how long the event loop is blocked for, by checking how late a periodic sleep wakes up."""
+
+    def __init__(self, interval: float = INTERVAL) -> None:
+        self.interval = interval
+        self.stats = LagStats()
+        self.__task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        """Start monitoring the running event loop."""
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    def stop(self) -> None:
+        """Stop monitoring."""
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0)
+            self.stats.record(lag)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+
+            if lag >= STALL_THRESHOLD:
+                globals.LOGGER.warning("Event loop was blocked for %.0fms", lag * 1000)
+
+            if loop.time() - last_report >= REPORT_INTERVAL:
+                last_report = loop.time()
+                globals.LOGGER.info(
+                    "Event loop lag: %.1fms mean, %.0fms max, %s stalls over %s checks",
+                    self.stats.mean_lag() * 1000,
+                    self.stats.max_lag * 1000,
+                    self.stats.stalls,
+                    self.stats.checks,
+                )
+
+
+MONITOR = LoopMonitor()
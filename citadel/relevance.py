@@ -0,0 +1,124 @@
+"""Local relevance ranking of channel messages, so only the messages that matter get sent to the model.
+
+Messages are ranked against the test's message filter with BM25, over an inverted index kept in NumPy arrays, so
+scoring a query is a handful of vectorised operations no matter how many messages a channel has. Messages that don't
+match the query are dropped, and the highest ranked of the rest that fit in a token budget are kept, in their original
+order.
+"""
+
+__all__ = ["Index", "Selection", "select_messages", "tokenize"]
+
+import re
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from citadel import utils
+
+# BM25's term frequency saturation, and how much a message's length normalizes its score.
+K1 = 1.5
+B = 0.75
+
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into the terms that get indexed."""
+    return WORD.findall(text.casefold())
+
+
+class Index:
+    """A BM25 index over a list of documents.
+
+    Postings are stored sorted by term, so each term's documents and frequencies are a contiguous slice of the arrays.
+    """
+
+    def __init__(self, documents: Sequence[str]) -> None:
+        self.vocabulary: dict[str, int] = {}
+        term_ids: list[int] = []
+        doc_ids: list[int] = []
+        lengths: list[int] = []
+
+        for doc, text in enumerate(documents):
+            terms = tokenize(text)
+            lengths.append(len(terms))
+            doc_ids.extend([doc] * len(terms))
+            term_ids.extend(self.vocabulary.setdefault(term, len(self.vocabulary)) for term in terms)
+
+        self.size = len(documents)
+        self.lengths = np.array(lengths, dtype=np.float64)
+        average = self.lengths.mean() if self.size != 0 else 0.0
+        # Each document's BM25 length normalization, which is the same for every term.
+        self.norms = K1 * (1 - B + B * self.lengths / max(average, 1.0))
+
+        # Count each (term, document) pair, which also sorts the postings by term, then by document.
+        pairs, counts = np.unique(
+            np.array(term_ids, dtype=np.int64) * max(self.size, 1) + np.array(doc_ids, dtype=np.int64),
+            return_counts=True,
+        )
+        self.docs = pairs % max(self.size, 1)
+        self.frequencies = counts.astype(np.float64)
+        # Where each term's postings start, with an extra entry for where the last term's end.
+        self.starts = np.searchsorted(pairs // max(self.size, 1), np.arange(len(self.vocabulary) + 1))
+        frequencies = np.diff(self.starts)
+        self.idf = np.log(1 + (self.size - frequencies + 0.5) / (frequencies + 0.5))
+
+    def score(self, query: str) -> npt.NDArray[np.float64]:
+        """Score every document against the query, with 0 for documents that share no terms with it."""
+        terms = [self.vocabulary[term] for term in set(tokenize(query)) if term in self.vocabulary]
+        if len(terms) == 0:
+            return np.zeros(self.size)
+
+        # The positions of every posting for the query's terms, and which term each belongs to.
+        starts = self.starts[terms]
+        lengths = self.starts[np.array(terms) + 1] - starts
+        owners = np.repeat(terms, lengths)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        docs = self.docs[positions]
+        frequencies = self.frequencies[positions]
+        weights = self.idf[owners] * frequencies * (K1 + 1) / (frequencies + self.norms[docs])
+        return np.asarray(np.bincount(docs, weights=weights, minlength=self.size), dtype=np.float64)
+
+
+@dataclass
+class Selection:
+    """The messages chosen to send to the model."""
+
+    messages: list[str]
+    # The estimated tokens in every message, and in the chosen ones.
+    total_tokens: int
+    tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        """The estimated tokens that won't be sent to the model."""
+        return self.total_tokens - self.tokens
+
+
+def select_messages(messages: Sequence[str], query: str, budget: int) -> Selection:
+    """Choose the messages most relevant to the query that fit in `budget` tokens, keeping them in their order.
+
+    Messages that share no terms with the query are dropped, however much of the budget is left. The rest are taken by
+    relevance (with ties going to the earlier message, since histories are newest first), skipping any that don't fit
+    in what's left of the budget. If no message matches the query at all (such as for a filter worded differently to
+    the notes), the newest messages that fit are kept instead, rather than generating from nothing.
+    """
+    tokens = np.array([utils.estimate_tokens(msg) for msg in messages], dtype=np.int64)
+    total = int(tokens.sum())
+
+    scores = Index(messages).score(query)
+    order = np.argsort(-scores, kind="stable")
+    if scores.max(initial=0.0) > 0:
+        order = order[scores[order] > 0]
+
+    kept = []
+    remaining = budget
+    for index, cost in zip(order.tolist(), tokens[order].tolist(), strict=True):
+        if cost <= remaining:
+            kept.append(index)
+            remaining -= cost
+    kept.sort()
+    return Selection([messages[index] for index in kept], total, budget - remaining)
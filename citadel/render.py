@@ -0,0 +1,197 @@
+"""Coalescing, rate-limit-aware message rendering.
+
+Live messages (such as the quiz question embed) change far more often than Discord lets us edit them. Instead of
+editing the message for every change, callers hand their latest state to a `MessageRenderer`, which merges everything
+that changed since the last edit into a single `edit` call, at most once per interval. Each channel's edit bucket is
+kept while any renderer in it is open, and dropped once it's refilled after the last one closes.
+"""
+
+__all__ = ["EditBucket", "MessageRenderer", "get_bucket", "release_bucket"]
+
+import asyncio
+from typing import Any
+
+import discord
+
+from citadel import globals, metrics, timers
+
+# Discord allows roughly 5 message edits per 5 seconds in a channel.
+EDIT_BUCKET_CAPACITY = 5
+EDIT_BUCKET_PERIOD = 5.0
+EDIT_INTERVAL = 1.0
+
+
+class EditBucket:
+    """A token bucket tracking the edits we can make in a channel before being rate limited."""
+
+    def __init__(self, capacity: int = EDIT_BUCKET_CAPACITY, period: float = EDIT_BUCKET_PERIOD) -> None:
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.updated = asyncio.get_running_loop().time()
+        self.blocked_until = 0.0
+        # The amount of open renderers using the bucket.
+        self.renderers = 0
+        self.__lock = asyncio.Lock()
+
+    def __refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Wait until an edit can be made without hitting the rate limit, and take a token for it."""
+        loop = asyncio.get_running_loop()
+
+        async with self.__lock:
+            while True:
+                now = loop.time()
+                self.__refill(now)
+
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                elif self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) * self.period / self.capacity)
+                else:
+                    self.tokens -= 1
+                    return
+
+    def refilled_at(self) -> float:
+        """Get when the bucket will be back to full and no longer blocked (on the event loop's clock)."""
+        return max(self.blocked_until, self.updated + (self.capacity - self.tokens) * self.period / self.capacity)
+
+    def block(self, retry_after: float) -> None:
+        """Stop edits in the bucket for `retry_after` seconds, after Discord told us we've been rate limited."""
+        loop = asyncio.get_running_loop()
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, loop.time() + retry_after)
+
+
+# The edit buckets for each channel, keyed by channel ID. Shared between all renderers in a channel, as that's the
+# scope Discord rate limits edits in.
+BUCKETS: dict[int, EditBucket] = {}
+
+
+def get_bucket(channel_id: int) -> EditBucket:
+    """Get the edit bucket for a channel for a renderer to use, creating it if needed, until it's released."""
+    if channel_id not in BUCKETS:
+        BUCKETS[channel_id] = EditBucket()
+    bucket = BUCKETS[channel_id]
+    bucket.renderers += 1
+    return bucket
+
+
+def release_bucket(channel_id: int) -> None:
+    """Release a renderer's use of a channel's edit bucket, dropping the bucket once it's unused and refilled."""
+    bucket = BUCKETS[channel_id]
+    bucket.renderers -= 1
+    loop = asyncio.get_running_loop()
+
+    # A refilled bucket is the same as a new one, so it's only dropped once that's the case (rather than forgetting
+    # about recent edits), and only if no renderer has started using it again in the meantime.
+    def drop() -> None:
+        if BUCKETS.get(channel_id) is not bucket or bucket.renderers != 0:
+            return
+        refilled_at = bucket.refilled_at()
+        if refilled_at > loop.time():
+            timers.TIMERS.call_at(refilled_at, drop)
+        else:
+            del BUCKETS[channel_id]
+
+    drop()
+
+
+class MessageRenderer:
+    """Render state changes to a message, merging pending changes into at most one edit per interval.
+
+    Calling `update` never waits on Discord, so game loops keep their timing regardless of how long edits take.
+    """
+
+    def __init__(
+        self,
+        message: discord.Message | discord.WebhookMessage | discord.PartialMessage,
+        interval: float = EDIT_INTERVAL,
+    ) -> None:
+        self.message = message
+        self.interval = interval
+        self.bucket = get_bucket(message.channel.id)
+        self.__pending: dict[str, Any] = {}
+        self.__changed = asyncio.Event()
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        self.__last_edit = 0.0
+        self.__task: asyncio.Task[None] | None = None
+        self.__closed = False
+
+    def update(self, **kwargs: Any) -> None:  # noqa: ANN401
+        """Queue changes to the message (taking the same arguments as `discord.Message.edit`).
+
+        Later changes to the same argument replace earlier ones that haven't been rendered yet.
+        """
+        self.__pending.update(kwargs)
+        self.__idle.clear()
+        self.__changed.set()
+
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    async def flush(self) -> None:
+        """Wait until all queued changes have been rendered."""
+        await self.__idle.wait()
+
+    async def close(self) -> None:
+        """Render any remaining changes, and then stop the renderer and release its edit bucket.
+
+        The renderer is stopped even if this gets cancelled while waiting for the changes to be rendered.
+        """
+        try:
+            await self.flush()
+        finally:
+            if self.__task is not None:
+                self.__task.cancel()
+                self.__task = None
+            if not self.__closed:
+                self.__closed = True
+                release_bucket(self.message.channel.id)
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        try:
+            while True:
+                # Sleep until something changes, so idle renderers don't wake the event loop up.
+                await self.__changed.wait()
+
+                # Let changes keep coming in until the interval since the last edit has passed, and then render them
+                # all.
+                delay = self.__last_edit + self.interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.bucket.acquire()
+
+                pending = self.__pending
+                self.__pending = {}
+                self.__changed.clear()
+                self.__last_edit = loop.time()
+
+                try:
+                    with metrics.DISCORD_EDIT_SECONDS.time():
+                        await self.message.edit(**pending)
+                except discord.HTTPException as err:
+                    if err.status != 429:  # noqa: PLR2004
+                        globals.LOGGER.exception("Failed to render message %s", self.message.id)
+                    else:
+                        metrics.DISCORD_RATE_LIMITS.inc()
+                        # Put the changes back (unless they've since been replaced), and wait out the rate limit.
+                        self.__pending = pending | self.__pending
+                        self.__changed.set()
+                        retry_after = float(err.response.headers.get("Retry-After", self.bucket.period))
+                        self.bucket.block(retry_after)
+                except Exception:  # noqa: BLE001
+                    # Any other failure (such as a connection error) only loses this edit, rather than the renderer.
+                    globals.LOGGER.exception("Failed to render message %s", self.message.id)
+                finally:
+                    if not self.__changed.is_set():
+                        self.__idle.set()
+        finally:
+            # Don't leave anything waiting on a flush once the renderer has stopped.
+            self.__idle.set()
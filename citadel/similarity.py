@@ -0,0 +1,200 @@
+"""Near-duplicate detection for questions, using MinHash signatures and locality-sensitive hashing.
+
+Each text is reduced to its set of character trigrams (after normalizing it), and summarized by a MinHash signature,
+whose matching positions estimate the Jaccard similarity of two texts' trigrams. Signatures are split into bands, and
+texts sharing any band end up as candidates, so only a small fraction of all pairs ever get compared. Everything (from
+trigrams through to comparing candidates) is vectorised with NumPy, so whole databases can be checked in seconds.
+
+Two questions are duplicates when both their questions and their answers are similar, so questions that only differ
+by what they ask about (e.g. "When did WW1 end?" and "When did WW2 end?") aren't caught by a generous threshold.
+"""
+
+__all__ = [
+    "THRESHOLD",
+    "band_keys",
+    "candidate_pairs",
+    "drop_duplicates",
+    "find_duplicates",
+    "signatures",
+    "similarities",
+]
+
+import re
+from collections.abc import Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from citadel import defaults
+
+THRESHOLD = defaults.SIMILARITY_THRESHOLD
+# Signatures are made of `BANDS * ROWS` hashes, with any band matching making two texts candidates. With 16 bands of
+# 4 rows, texts at the threshold are candidates with a probability of over 99.9%, and ones at 0.3 only about 12%.
+BANDS = 16
+ROWS = 4
+SHINGLE = 3
+# How many trigrams to hash at once, which bounds the memory used (at 4 bytes per hash).
+CHUNK_SHINGLES = 1 << 16
+# How many pairs to compare at once.
+CHUNK_PAIRS = 1 << 14
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+ASCII_PUNCTUATION = str.maketrans("", "", "".join(char for char in map(chr, range(128)) if PUNCTUATION.match(char)))
+
+RNG = np.random.default_rng(0x5EED)
+# The coefficients of each hash function, fixed so signatures are comparable between runs. Hashes are `a * x + b`
+# (wrapping around at 32 bits) with an odd `a`, whose high bits (which decide which hash is the smallest) make a
+# universal multiply-shift hash of `x`.
+MULTIPLIERS = RNG.integers(0, 1 << 32, BANDS * ROWS, dtype=np.uint32) | np.uint32(1)
+INCREMENTS = RNG.integers(0, 1 << 32, BANDS * ROWS, dtype=np.uint32)
+# Odd constants to mix a band's rows into a single key with.
+BAND_MIXERS = RNG.integers(1, 1 << 63, ROWS, dtype=np.uint64) | np.uint64(1)
+
+
+def normalize(texts: Sequence[str]) -> list[bytes]:
+    """Normalize texts so trivially different phrasings (casing, spacing, punctuation) get the same trigrams.
+
+    Texts are normalized together as a single string (one per line), which is much faster than one at a time.
+    """
+    if len(texts) == 0:
+        return []
+    joined = "\n".join(text.replace("\n", " ") for text in texts).casefold()
+    # Translating is much faster than the regex, and gives the same result for ASCII.
+    joined = joined.translate(ASCII_PUNCTUATION) if joined.isascii() else PUNCTUATION.sub("", joined)
+    # Pad short texts so they still have a trigram.
+    return [" ".join(line.split()).ljust(SHINGLE).encode() for line in joined.split("\n")]
+
+
+def signatures(texts: Sequence[str]) -> npt.NDArray[np.uint32]:
+    """Get the MinHash signature of each text's trigrams, as a `(len(texts), BANDS * ROWS)` array."""
+    encoded = normalize(texts)
+    lengths = np.array([len(text) for text in encoded], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint32)
+
+    # Every trigram in the buffer, keeping only the ones that don't cross from one text into the next.
+    shingles = buffer[:-2] << np.uint32(16) | buffer[1:-1] << np.uint32(8) | buffer[2:]
+    owners = np.repeat(np.arange(len(texts)), lengths)[:-2]
+    valid = np.arange(len(shingles)) + SHINGLE <= ends[owners]
+    shingles = shingles[valid]
+    # Where each text's trigrams start, which every text has at least one of.
+    starts = np.concatenate([[0], np.cumsum(lengths - SHINGLE + 1)[:-1]])
+
+    result = np.empty((len(texts), BANDS * ROWS), dtype=np.uint32)
+    text = 0
+    while text < len(texts):
+        # Hash whole texts at a time, up to (roughly) `CHUNK_SHINGLES` trigrams.
+        last = max(int(np.searchsorted(starts, starts[text] + CHUNK_SHINGLES, side="right")), text + 1)
+        end = starts[last] if last < len(texts) else len(shingles)
+        # Laid out with a row per hash function, so each text's trigrams are contiguous when taking their minimum.
+        hashes = MULTIPLIERS[:, None] * shingles[None, starts[text] : end]
+        hashes += INCREMENTS[:, None]
+        result[text:last] = np.minimum.reduceat(hashes, starts[text:last] - starts[text], axis=1).T
+        text = last
+    return result
+
+
+def band_keys(signatures: npt.NDArray[np.uint32]) -> npt.NDArray[np.int64]:
+    """Get the key of each band of the signatures, as a `(len(signatures), BANDS)` array.
+
+    Texts with the same key for a band share a bucket for it. Keys are signed, so they fit in SQLite's integers.
+    """
+    rows = signatures.astype(np.uint64).reshape(len(signatures), BANDS, ROWS)
+    keys: npt.NDArray[np.int64] = np.bitwise_xor.reduce(rows * BAND_MIXERS, axis=2).view(np.int64)
+    return keys
+
+
+def candidate_pairs(signatures: npt.NDArray[np.uint32]) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """Get the pairs of texts that share a band of their signatures, with the earlier text of each pair first.
+
+    Rather than every pair in a bucket, each text is paired with the first text in its bucket and the one before it,
+    which keeps huge buckets (such as from many copies of one question) linear while still connecting every copy.
+    """
+    size = len(signatures)
+    keys = band_keys(signatures)
+    pairs = []
+
+    for band in range(BANDS):
+        key = keys[:, band]
+        order = np.argsort(key, kind="stable")
+        ordered = key[order]
+        # Whether each text is in the same bucket as the one before it, and where each text's bucket starts.
+        same = np.concatenate([[False], ordered[1:] == ordered[:-1]])
+        first = np.maximum.accumulate(np.where(same, 0, np.arange(size)))
+        pairs.append(np.stack([order[first[same]], order[same]]))
+        pairs.append(np.stack([order[:-1][same[1:]], order[1:][same[1:]]]))
+
+    joined = np.concatenate(pairs, axis=1)
+    left = np.minimum(joined[0], joined[1])
+    right = np.maximum(joined[0], joined[1])
+    # Drop duplicate pairs (which come from texts sharing multiple bands) by sorting them.
+    encoded = np.sort(left[left != right] * size + right[left != right])
+    unique = encoded[np.concatenate([encoded[:1] == encoded[:1], encoded[1:] != encoded[:-1]])]
+    return unique // max(size, 1), unique % max(size, 1)
+
+
+def similarities(
+    signatures: npt.NDArray[np.uint32],
+    left: npt.NDArray[np.int64],
+    right: npt.NDArray[np.int64],
+) -> npt.NDArray[np.float64]:
+    """Estimate the Jaccard similarity of each pair of texts."""
+    result = np.empty(len(left), dtype=np.float64)
+    for start in range(0, len(left), CHUNK_PAIRS):
+        pair = slice(start, start + CHUNK_PAIRS)
+        result[pair] = (signatures[left[pair]] == signatures[right[pair]]).mean(axis=1)
+    return result
+
+
+def find_duplicates(
+    questions: Sequence[str],
+    answers: Sequence[str],
+    groups: Sequence[int] | None = None,
+    threshold: float = THRESHOLD,
+    question_signatures: npt.NDArray[np.uint32] | None = None,
+) -> npt.NDArray[np.int64]:
+    """Find the questions that duplicate an earlier question (in the same group, if groups are given).
+
+    Returns the index of the earliest question each question duplicates, or -1 for questions that aren't duplicates.
+    Duplicates are transitive, so a question can be matched to an earlier one through a chain of similar questions.
+    The questions' signatures can be passed in if they've already been computed.
+    """
+    size = len(questions)
+    if size == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if question_signatures is None:
+        question_signatures = signatures(questions)
+    left, right = candidate_pairs(question_signatures)
+    if groups is not None:
+        group_ids = np.asarray(groups)
+        same_group = group_ids[left] == group_ids[right]
+        left, right = left[same_group], right[same_group]
+    similar = similarities(question_signatures, left, right) >= threshold
+    left, right = left[similar], right[similar]
+
+    # Only the answers of similar questions need comparing.
+    involved = np.unique(np.concatenate([left, right]))
+    answer_signatures = np.zeros((size, BANDS * ROWS), dtype=np.uint32)
+    answer_signatures[involved] = signatures([answers[index] for index in involved])
+    similar = similarities(answer_signatures, left, right) >= threshold
+    left, right = left[similar], right[similar]
+
+    # Label each question with the earliest question it's connected to, by propagating labels until they settle.
+    labels = np.arange(size)
+    while True:
+        previous = labels.copy()
+        np.minimum.at(labels, right, labels[left])
+        np.minimum.at(labels, left, labels[right])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    return np.where(labels == np.arange(size), -1, labels)
+
+
+def drop_duplicates(items: Sequence[dict[str, str]], threshold: float = THRESHOLD) -> list[dict[str, str]]:
+    """Drop the questions (with `question` and `answer` keys) that duplicate an earlier one."""
+    duplicates = find_duplicates(
+        [item["question"] for item in items], [item["answer"] for item in items], None, threshold
+    )
+    return [item for item, duplicate in zip(items, duplicates, strict=True) if duplicate == -1]
@@ -0,0 +1,66 @@
+"""Syncing of slash commands to Discord, skipped when nothing has changed.
+
+Discord heavily rate limits syncing commands, so a hash of what was last synced is stored for each guild and compared
+against the current command tree on startup.
+"""
+
+__all__ = ["fingerprint", "sync_commands"]
+
+import hashlib
+import json
+import time
+
+import discord
+from discord import app_commands
+from sqlmodel import Session
+
+from citadel import database, globals
+from citadel.models import CommandFingerprint
+
+
+def fingerprint(tree: app_commands.CommandTree, guild: discord.abc.Snowflake | None) -> str:
+    """Hash the commands that would be synced to `guild` (or globally if it's `None`)."""
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command["type"], command["name"]),
+    )
+    # Switching to another application needs a sync too, even with the same commands.
+    content = json.dumps([tree.client.application_id, payload], sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_fingerprint(guild_id: int) -> str | None:
+    """Load the fingerprint of the commands last synced to a guild."""
+    with Session(globals.get_sql_engine()) as session:
+        stored = session.get(CommandFingerprint, guild_id)
+        return None if stored is None else stored.fingerprint
+
+
+def store_fingerprint(guild_id: int, fingerprint: str) -> None:
+    """Store the fingerprint of the commands just synced to a guild."""
+    with Session(globals.get_sql_engine()) as session:
+        session.merge(CommandFingerprint(guild_id=guild_id, fingerprint=fingerprint))
+        session.commit()
+
+
+async def sync_commands(
+    tree: app_commands.CommandTree,
+    guild: discord.abc.Snowflake | None,
+    *,
+    force: bool = False,
+) -> bool:
+    """Sync the commands to `guild` (or globally if it's `None`) if they've changed, returning if a sync happened."""
+    started = time.perf_counter()
+    guild_id = 0 if guild is None else guild.id
+    current = fingerprint(tree, guild)
+
+    if not force and await database.run(load_fingerprint, guild_id) == current:
+        globals.LOGGER.info(
+            "Slash commands are unchanged, skipping sync (checked in %.0fms)", (time.perf_counter() - started) * 1000
+        )
+        return False
+
+    await tree.sync(guild=guild)
+    await database.run(store_fingerprint, guild_id, current)
+    globals.LOGGER.info("Synced slash commands in %.0fms", (time.perf_counter() - started) * 1000)
+    return True
@@ -0,0 +1,172 @@
+"""A shared timer wheel, for scheduling lots of short timers (such as quiz countdowns) cheaply.
+
+Timers are hashed into a ring of slots by the tick they're due on, and a single task walks the ring, sleeping straight
+to the next tick with a timer due (so a far-off timer doesn't wake the loop up on every tick). Ticks are scheduled
+from a fixed start time on the event loop's monotonic clock, so time spent running callbacks (or waiting on Discord)
+never makes the wheel drift. Scheduling and cancelling a timer are O(1), however many are pending.
+"""
+
+__all__ = ["TIMERS", "Timer", "TimerWheel"]
+
+import asyncio
+import math
+from collections.abc import Callable
+
+from citadel import globals, metrics
+
+# How often the wheel ticks, in seconds. Timers fire on the first tick at or after their deadline.
+TICK = 0.02
+# The amount of slots in the wheel. Timers further out than a full turn just stay in their slot for extra turns.
+SLOTS = 1024
+
+
+class Timer:
+    """A callback scheduled on a `TimerWheel`."""
+
+    __slots__ = ("callback", "cancelled", "discard", "tick")
+
+    def __init__(self, tick: int, callback: Callable[[], None], discard: Callable[[], None]) -> None:
+        self.tick = tick
+        self.callback = callback
+        self.cancelled = False
+        # Takes the timer off its wheel's pending count, or `None` once it's no longer pending.
+        self.discard: Callable[[], None] | None = discard
+
+    def cancel(self) -> None:
+        """Stop the timer from firing."""
+        self.cancelled = True
+        if self.discard is not None:
+            self.discard()
+            self.discard = None
+
+
+class TimerWheel:
+    """Runs callbacks at deadlines on the event loop's monotonic clock (`loop.time()`)."""
+
+    def __init__(self, tick: float = TICK, slots: int = SLOTS) -> None:
+        self.tick = tick
+        self.__slots: list[list[Timer]] = [[] for _ in range(slots)]
+        # The loop time that tick 0 happened at, and the last tick that's been run.
+        self.__start: float | None = None
+        self.__current = 0
+        self.__pending = 0
+        self.__task: asyncio.Task[None] | None = None
+        # The tick the wheel is sleeping until, and the future it's sleeping on (so earlier timers can wake it up).
+        self.__target: int | None = None
+        self.__waiter: asyncio.Future[None] | None = None
+
+    def __len__(self) -> int:
+        return self.__pending
+
+    def call_at(self, deadline: float, callback: Callable[[], None]) -> Timer:
+        """Run `callback` once the loop time reaches `deadline`."""
+        loop = asyncio.get_running_loop()
+        if self.__start is None:
+            self.__start = loop.time()
+
+        idle = self.__task is None or self.__task.done()
+        if idle:
+            # Skip over the ticks that passed while the wheel was idle.
+            self.__current = max(self.__current, math.floor((loop.time() - self.__start) / self.tick))
+
+        tick = max(math.ceil((deadline - self.__start) / self.tick), self.__current + 1)
+        timer = Timer(tick, callback, self.__discard)
+        self.__slots[tick % len(self.__slots)].append(timer)
+        self.__pending += 1
+
+        if idle:
+            self.__task = asyncio.create_task(self.__run())
+        elif self.__target is not None and tick < self.__target:
+            # Due before the tick the wheel is sleeping until, so it needs to pick a new one.
+            self.__retarget()
+        return timer
+
+    async def sleep_until(self, deadline: float) -> None:
+        """Sleep until the loop time reaches `deadline`."""
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+        def wake() -> None:
+            if not future.done():
+                future.set_result(None)
+
+        timer = self.call_at(deadline, wake)
+        try:
+            await future
+        finally:
+            timer.cancel()
+
+    def __discard(self) -> None:
+        self.__pending -= 1
+        if self.__pending == 0:
+            # Let the wheel stop now, rather than when it would have woken up.
+            self.__retarget()
+
+    def __wake(self) -> None:
+        if self.__waiter is not None and not self.__waiter.done():
+            self.__waiter.set_result(None)
+
+    def __retarget(self) -> None:
+        """Wake the wheel up before the tick it's sleeping until, so it looks for the next tick again."""
+        self.__target = None
+        self.__wake()
+
+    def __next_tick(self) -> int:
+        """Find the earliest tick that a pending timer is due on."""
+        size = len(self.__slots)
+        # Timers are usually due within a turn of the wheel, so look for the first slot with one due on this turn.
+        for tick in range(self.__current + 1, self.__current + size + 1):
+            if any(timer.tick <= tick and not timer.cancelled for timer in self.__slots[tick % size]):
+                return tick
+        # Otherwise, every pending timer is at least a turn away.
+        return min(timer.tick for slot in self.__slots for timer in slot if not timer.cancelled)
+
+    async def __run(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.__start is None:
+            return
+
+        # Cancelled timers don't count as pending, so the wheel stops as soon as only they're left.
+        while self.__pending != 0:
+            self.__target = self.__next_tick()
+            # Sleep until when the tick should happen, rather than for a length of time, so lateness doesn't add up.
+            deadline = self.__start + self.__target * self.tick
+            if deadline > loop.time():
+                self.__waiter = loop.create_future()
+                handle = loop.call_at(deadline, self.__wake)
+                try:
+                    await self.__waiter
+                finally:
+                    handle.cancel()
+                    self.__waiter = None
+                if self.__target is None:
+                    continue
+
+            self.__current = self.__target
+            self.__target = None
+            slot = self.__slots[self.__current % len(self.__slots)]
+            due = [timer for timer in slot if timer.tick <= self.__current and not timer.cancelled]
+            slot[:] = [timer for timer in slot if timer.tick > self.__current and not timer.cancelled]
+            self.__pending -= len(due)
+
+            for timer in due:
+                timer.discard = None
+            for timer in due:
+                # Checked again, as an earlier callback might have cancelled it.
+                if not timer.cancelled:
+                    try:
+                        timer.callback()
+                    except Exception:  # noqa: BLE001
+                        globals.LOGGER.exception("Timer callback failed")
+
+        # Drop the cancelled timers that are left, rather than keeping them around until their slots come up again.
+        for slot in self.__slots:
+            slot.clear()
+
+
+TIMERS = TimerWheel()
+
+metrics.Gauge(
+    "citadel_timers_pending",
+    "The amount of timers waiting to fire on the shared timer wheel.",
+    lambda: len(TIMERS),
+)
@@ -0,0 +1,138 @@
+"""Bulk import and export of test banks.
+
+Files are streamed row by row (so they're never held in memory as a whole), with each row holding a test name, a
+question, and its answer. Imports are inserted in batches, with each batch being a single transaction and a single
+executemany-style insert.
+"""
+
+__all__ = ["Format", "TransferStats", "export_questions", "import_questions", "read_rows", "write_rows"]
+
+import csv
+import json
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import TYPE_CHECKING, TextIO
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+# The amount of questions to insert in each transaction.
+BATCH_SIZE = 10_000
+FIELDS = ["test", "question", "answer"]
+
+
+class Format(str, Enum):
+    """The file formats that test banks can be imported from and exported to."""
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+@dataclass
+class TransferStats:
+    """Statistics about an import or export."""
+
+    rows: int = 0
+    tests_created: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    def elapsed(self) -> float:
+        """Get how long the transfer has been running for, in seconds."""
+        return time.perf_counter() - self.started
+
+    def throughput(self) -> float:
+        """Get the amount of rows transferred per second."""
+        elapsed = self.elapsed()
+        return 0.0 if elapsed == 0 else self.rows / elapsed
+
+
+def read_rows(file: TextIO, format: Format) -> Iterator[dict[str, str]]:
+    """Read the rows from a test bank file, one at a time."""
+    if format == Format.CSV:
+        for row in csv.DictReader(file):
+            yield {key: row[key] for key in FIELDS}
+    else:
+        for line in file:
+            if line.strip() != "":
+                row = json.loads(line)
+                yield {key: row[key] for key in FIELDS}
+
+
+def write_rows(file: TextIO, format: Format, rows: Iterable[dict[str, str]]) -> None:
+    """Write rows to a test bank file."""
+    if format == Format.CSV:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            file.write(json.dumps(row))
+            file.write("\n")
+
+
+def import_questions(engine: "Engine", rows: Iterable[dict[str, str]], batch_size: int = BATCH_SIZE) -> TransferStats:
+    """Import questions into the database, creating tests for any test names that don't exist yet.
+
+    Questions for a test name that already exists get added to that test.
+    """
+    # Imported here, so the CLI only loads the database layer for the commands that use it.
+    import sqlmodel
+    from sqlalchemy import insert
+
+    from citadel.models import Question, Test
+
+    stats = TransferStats()
+
+    with engine.connect() as connection:
+        statement = sqlmodel.select(Test.id, Test.name).order_by(Test.id.desc())  # type: ignore[union-attr]
+        # If multiple tests share a name, the oldest one wins (which matches how `/quiz` looks tests up).
+        test_ids = {name: test_id for test_id, name in connection.execute(statement)}
+
+    batch: list[dict[str, str]] = []
+
+    def flush() -> None:
+        with engine.begin() as connection:
+            for name in {row["test"] for row in batch} - test_ids.keys():
+                statement = insert(Test).values(name=name).returning(Test.id)  # type: ignore[call-overload]
+                test_ids[name] = connection.execute(statement).scalar_one()
+                stats.tests_created += 1
+
+            connection.execute(
+                insert(Question),
+                [
+                    {"question": row["question"], "answer": row["answer"], "test_id": test_ids[row["test"]]}
+                    for row in batch
+                ],
+            )
+        stats.rows += len(batch)
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            flush()
+
+    if len(batch) != 0:
+        flush()
+    return stats
+
+
+def export_questions(engine: "Engine", stats: TransferStats, batch_size: int = BATCH_SIZE) -> Iterator[dict[str, str]]:
+    """Export every question in the database, streaming them from the database in batches."""
+    import sqlmodel
+
+    from citadel.models import Question, Test
+
+    statement = (
+        sqlmodel.select(Test.name, Question.question, Question.answer)
+        .join(Question, Question.test_id == Test.id)  # type: ignore[arg-type]
+        .order_by(Question.id)  # type: ignore[arg-type]
+    )
+
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(statement)
+        for name, question, answer in result:
+            stats.rows += 1
+            yield {"test": name, "question": question, "answer": answer}
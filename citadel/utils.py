@@ -1,26 +1,104 @@
-__all__ = ["sleep"]
+__all__ = [
+    "Buttons",
+    "JSONArrayParser",
+    "Responses",
+    "estimate_tokens",
+    "get_openai_json",
+    "get_openai_resp",
+    "sleep",
+    "stream_openai_json",
+]
 
 import asyncio
-from collections.abc import Callable, Coroutine, Sequence
-from typing import Any, ClassVar
+import contextlib
+import json
+import time
+from collections.abc import AsyncGenerator, Callable, Coroutine, Sequence
+from typing import Any, Generic, TypeVar
 
 import discord
 from discord import ui
+from openai import AsyncStream
+from openai.types.chat import ChatCompletion
 
-from citadel import globals
+from citadel import backends, cache, globals, governor, metrics
+
+T = TypeVar("T")
+
+# A rough estimate of how many characters make up a token. It doesn't need to be exact, just close enough to budget
+# requests with.
+CHARS_PER_TOKEN = 4
+
+
+class Responses(Generic[T]):
+    """A queue of the responses submitted to a view (i.e. button clicks or modal submissions).
+
+    Each view gets its own queue, and callbacks push into it as they fire. This lets commands await the next response
+    directly instead of polling for it, resuming the moment a callback runs.
+    """
+
+    def __init__(self) -> None:
+        # Responses are queued alongside when they were submitted, to measure how long they wait to be picked up.
+        self.__queue: asyncio.Queue[tuple[T, discord.Interaction, float] | None] = asyncio.Queue()
+        self.__closed = False
+
+    def put(self, value: T, interaction: discord.Interaction) -> None:
+        """Submit a response, waking up whoever is waiting for one."""
+        if not self.__closed:
+            self.__queue.put_nowait((value, interaction, time.perf_counter()))
+
+    def close(self) -> None:
+        """Stop accepting responses. Anyone waiting (now or later) will receive `None`."""
+        if not self.__closed:
+            self.__closed = True
+            self.__queue.put_nowait(None)
+
+    @property
+    def closed(self) -> bool:
+        """Whether the queue has stopped accepting responses."""
+        return self.__closed
+
+    def wake(self) -> None:
+        """Wake up whoever is waiting for a response without giving them one, so they receive `None`."""
+        if not self.__closed:
+            self.__queue.put_nowait(None)
+
+    async def get(self, timeout: float | None = None) -> tuple[T, discord.Interaction] | None:
+        """Wait for the next response.
+
+        Returns `None` if no response arrives within `timeout` seconds, or if the queue has been closed.
+        """
+        try:
+            async with asyncio.timeout(timeout):
+                response = await self.__queue.get()
+        except TimeoutError:
+            return None
+
+        if response is None:
+            # Keep the sentinel around so every later call sees the closed queue too.
+            if self.__closed:
+                self.__queue.put_nowait(None)
+            return None
+
+        value, interaction, submitted = response
+        metrics.VIEW_DISPATCH_SECONDS.observe(time.perf_counter() - submitted)
+        return value, interaction
 
 
 class Buttons(ui.View):
-    __output: ClassVar[list[tuple[str, discord.Interaction]]] = []
+    """A row of buttons, with clicks being sent to the view's `Responses` queue."""
 
     def create_callback(self, button: str) -> Callable[[discord.Interaction], Coroutine[Any, Any, None]]:
+        """Create the callback for a button, which submits the button's label as the response."""
+
         async def callback(interaction: discord.Interaction) -> None:
-            self.__output.append((button, interaction))
+            self.responses.put(button, interaction)
 
         return callback
 
-    def __init__(self, buttons: Sequence[str | tuple[str, discord.ButtonStyle]]) -> None:
-        super().__init__()
+    def __init__(self, buttons: Sequence[str | tuple[str, discord.ButtonStyle]], timeout: float | None = 180) -> None:
+        super().__init__(timeout=timeout)
+        self.responses: Responses[str] = Responses()
 
         for button in buttons:
             if isinstance(button, str):
@@ -34,25 +112,179 @@ class Buttons(ui.View):
             ui_button.callback = self.create_callback(label)  # type: ignore[assignment]
             self.add_item(ui_button)
 
-    def get_responses(self) -> list[tuple[str, discord.Interaction]]:
-        output = []
-        while len(self.__output) > 0:
-            output.append(self.__output.pop(0))
-        return output
+    async def on_timeout(self) -> None:
+        """Release anyone waiting on the buttons once they stop being interactive."""
+        self.responses.close()
 
+    async def get_response(self, timeout: float | None = None) -> tuple[str, discord.Interaction] | None:
+        """Wait for the next button click. Returns `None` on a timeout, or if the view itself has timed out."""
+        return await self.responses.get(timeout)
 
-async def get_openai_resp(msg: str) -> str:
-    completion = await globals.get_openai_client().chat.completions.create(
-        model=globals.get_openai_model(),
-        messages=[{"role": "user", "content": msg}],
-    )
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the amount of tokens in a piece of text."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+async def request_openai_resp(msg: str) -> str:
+    """Get the response from OpenAI for the given prompt, bypassing the cache."""
+    prompt_tokens = estimate_tokens(msg)
+
+    async def attempt(lease: backends.Lease) -> ChatCompletion:
+        return await governor.GOVERNOR.request(
+            prompt_tokens,
+            lambda: lease.call(
+                lambda backend: backend.client.chat.completions.with_raw_response.create(
+                    model=backend.model,
+                    messages=[{"role": "user", "content": msg}],
+                ),
+            ),
+        )
+
+    async with governor.GOVERNOR.slot():
+        with metrics.OPENAI_REQUEST_SECONDS.time("complete"):
+            completion = await globals.get_openai_pool().complete(attempt)
+
+    if not isinstance(completion, ChatCompletion):
+        raise TypeError("Unexpected response type from OpenAI")  # noqa: TRY003,EM101
     content = completion.choices[0].message.content
 
     if content is None:
         raise RuntimeError("Unexpected empty output from OpenAI")  # noqa: TRY003,EM101
+
+    if completion.usage is not None:
+        metrics.OPENAI_TOKENS.inc("prompt", amount=completion.usage.prompt_tokens)
+        metrics.OPENAI_TOKENS.inc("completion", amount=completion.usage.completion_tokens)
+    else:
+        metrics.OPENAI_TOKENS.inc("prompt", amount=prompt_tokens)
+        metrics.OPENAI_TOKENS.inc("completion", amount=estimate_tokens(content))
     return content
 
 
+async def get_openai_resp(msg: str) -> str:
+    """Get the response from OpenAI for the given prompt."""
+    with metrics.RESPONSE_SECONDS.time():
+        return await cache.CACHE.get(msg, lambda: request_openai_resp(msg))
+
+
+async def get_openai_json(msg: str) -> Any:  # noqa: ANN401
+    """Get the response from OpenAI for a prompt that outputs JSON, parsing it."""
+    try:
+        return json.loads(await get_openai_resp(msg))
+    except json.JSONDecodeError:
+        # Don't keep serving the same unusable response.
+        await cache.CACHE.invalidate(msg)
+        raise
+
+
+class JSONArrayParser:
+    """An incremental parser for JSON arrays, returning each item in the array as soon as it's been fully received."""
+
+    def __init__(self) -> None:
+        self.__decoder = json.JSONDecoder()
+        self.__buffer = ""
+        self.__started = False
+        self.__finished = False
+
+    def feed(self, text: str) -> list[Any]:
+        """Add more text to the parser, returning any items that were completed by it."""
+        self.__buffer += text
+        items = []
+        pos = 0
+
+        while not self.__finished:
+            # Skip over anything between items.
+            while pos < len(self.__buffer) and (self.__buffer[pos].isspace() or self.__buffer[pos] == ","):
+                pos += 1
+            if pos == len(self.__buffer):
+                break
+
+            if not self.__started:
+                # Models sometimes add text (such as a code fence) before the array, so skip until the array starts.
+                start = self.__buffer.find("[", pos)
+                if start == -1:
+                    pos = len(self.__buffer)
+                    break
+                self.__started = True
+                pos = start + 1
+            elif self.__buffer[pos] == "]":
+                self.__finished = True
+                pos += 1
+            else:
+                try:
+                    item, end = self.__decoder.raw_decode(self.__buffer, pos)
+                except json.JSONDecodeError:
+                    # The item hasn't been fully received yet.
+                    break
+                # Numbers (and other literals) at the end of the buffer might still have more characters coming.
+                if end == len(self.__buffer) and self.__buffer[pos] not in '{["':
+                    break
+                items.append(item)
+                pos = end
+
+        self.__buffer = self.__buffer[pos:]
+        return items
+
+    def close(self) -> None:
+        """Check that the full array was received, raising a `ValueError` if it wasn't."""
+        if not self.__finished:
+            raise ValueError("Unexpected end of JSON array")  # noqa: TRY003,EM101
+
+
+async def request_openai_stream(msg: str) -> AsyncGenerator[str, None]:
+    """Stream the response from OpenAI for the given prompt, bypassing the cache."""
+    prompt_tokens = estimate_tokens(msg)
+    output_chars = 0
+
+    # The slot and backend are held until the stream finishes, as that's how long the request is really in-flight for.
+    async with governor.GOVERNOR.slot(), globals.get_openai_pool().lease("stream") as lease:
+        started = time.perf_counter()
+        stream = await governor.GOVERNOR.request(
+            prompt_tokens,
+            lambda: lease.call(
+                lambda backend: backend.client.chat.completions.with_raw_response.create(
+                    model=backend.model,
+                    messages=[{"role": "user", "content": msg}],
+                    stream=True,
+                ),
+            ),
+        )
+        if not isinstance(stream, AsyncStream):
+            raise TypeError("Unexpected response type from OpenAI")  # noqa: TRY003,EM101
+
+        # Closing the stream closes its HTTP response, so a request that's abandoned partway (or fails) doesn't keep
+        # its connection busy until the model finishes the completion.
+        async with stream:
+            async for chunk in stream:
+                if len(chunk.choices) != 0 and chunk.choices[0].delta.content is not None:
+                    if output_chars == 0:
+                        metrics.OPENAI_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started)
+                    output_chars += len(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+        metrics.OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - started, "stream")
+        # Streams don't report their usage, so it's estimated.
+        metrics.OPENAI_TOKENS.inc("prompt", amount=prompt_tokens)
+        metrics.OPENAI_TOKENS.inc("completion", amount=output_chars // CHARS_PER_TOKEN)
+
+
+async def stream_openai_json(msg: str) -> AsyncGenerator[Any, None]:
+    """Stream the response from OpenAI for a prompt that outputs a JSON array, yielding each item as it comes in."""
+    parser = JSONArrayParser()
+
+    try:
+        # Closed as soon as this is, so cancelling a request closes its stream (and releases its slot) right away.
+        async with contextlib.aclosing(cache.CACHE.stream(msg, lambda: request_openai_stream(msg))) as texts:
+            async for text in texts:
+                for item in parser.feed(text):
+                    yield item
+        parser.close()
+    except ValueError:
+        # Don't keep serving the same unusable response.
+        await cache.CACHE.invalidate(msg)
+        raise
+
+
 async def sleep(time: float = 0.5) -> None:
     """Sleep for a bit of time."""
     await asyncio.sleep(time)